@@ -17,6 +17,10 @@ setup(
         'numpy>=1.22.4',
         'cryptography>=3.4.8',
     ],
+    extras_require={
+        # psycopg 3 is needed to execute statements in pipeline mode
+        'pipeline': ['psycopg>=3.1'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'Operating System :: OS Independent',
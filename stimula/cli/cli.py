@@ -16,6 +16,7 @@ Commands:
 - count: Count records in a table based on specified criteria.
 - get: Fetch a table with specified mapping and query parameters.
 - post: Post data to a table from a specified file.
+- apply: Apply a plan that a post wrote, without reading and comparing again if no table changed.
 
 Options:
 -h, --help        Print help message
@@ -39,6 +40,9 @@ Options:
 -V, --verbose     Increase output verbosity
 -M, --transpose   Transpose the mapping
 -x, --execute     Script to execute on post
+-j, --journal     Journal of committed rows (default: .stimula_journal)
+-R, --resume      Skip rows that the journal proves are committed
+-L, --plan        Plan to write on post, or to apply (default: .stimula_plan)
 """
 
 import argparse
@@ -81,7 +85,7 @@ class StimulaCLI:
 
     def parse_args(self):
         parser = argparse.ArgumentParser(description='stimula - The STML CLI')
-        parser.add_argument('command', help='Command to execute', choices=['auth', 'list', 'mapping', 'count', 'get', 'post', 'transpose', 'google', 'anonymize'])
+        parser.add_argument('command', help='Command to execute', choices=['auth', 'list', 'mapping', 'count', 'get', 'post', 'apply', 'transpose', 'google', 'anonymize'])
         parser.add_argument('-r', '--remote', help='Remote API URL')
         parser.add_argument('-H', '--host', help='Database host', default='localhost')
         parser.add_argument('-P', '--port', help='Database port', type=int, default=5432)
@@ -110,6 +114,9 @@ class StimulaCLI:
         parser.add_argument('-U', '--update', action='store_true', help='Enable UPDATE operations')
         parser.add_argument('-D', '--delete', action='store_true', help='Enable DELETE operations')
         parser.add_argument('-C', '--commit', action='store_true', help='Commit transaction')
+        parser.add_argument('-j', '--journal', nargs='?', help='Optional path of a journal of committed rows', const='.stimula_journal')
+        parser.add_argument('-R', '--resume', action='store_true', help='Resume from the journal, skip rows that are committed')
+        parser.add_argument('-L', '--plan', nargs='?', help='Optional path of a plan to write on post, or to apply', const='.stimula_plan')
         args = parser.parse_args()
         return args
 
@@ -206,6 +213,13 @@ class StimulaCLI:
             assert not (args.nrows and args.delete), 'Cannot specify --nrows (n) and --delete (D) together. That could result in unexpected deletes.'
             assert not (args.block_size and args.delete), 'Cannot specify --block_size (b) and --delete (D) together. That could result in unexpected deletes.'
 
+            # resume from the default journal if no journal is specified
+            if args.resume and not args.journal:
+                args.journal = '.stimula_journal'
+
+            # a journal only records committed rows
+            assert not args.journal or args.commit, 'Cannot specify --journal (j) or --resume (R) without --commit (C). Only committed rows are journaled.'
+
             # read files from disk, stdin or google sheets. Also evaluate table and context
             files, tables, context, substitutions = source.read_files(args.files, args.tables, args.context)
 
@@ -230,7 +244,18 @@ class StimulaCLI:
                                         format=args.format,
                                         post_script=args.execute,
                                         context=context,
-                                        substitutions=substitutions)
+                                        substitutions=substitutions,
+                                        journal=args.journal,
+                                        resume=args.resume,
+                                        plan=args.plan)
+
+            print(self._create_report(result, args.audit, args.verbose))
+        elif args.command == 'apply':
+            # apply the default plan if no plan is specified
+            result = invoker.apply_plan(args.plan or '.stimula_plan', commit=args.commit)
+
+            if args.verbose:
+                print('Tables are unchanged, applied plan' if result['summary'].get('plan') == 'current' else 'Tables changed, loaded again')
 
             print(self._create_report(result, args.audit, args.verbose))
 
@@ -47,7 +47,10 @@ class Invoker:
     def get_table(self, table, header, query):
         return self._db.get_table_as_csv(table, header, query)
 
-    def post_table(self, table, header, query, files, skiprows, nrows, block_size, insert, update, delete, execute, commit, format, post_script, context, substitutions):
+    def post_table(self, table, header, query, files, skiprows, nrows, block_size, insert, update, delete, execute, commit, format, post_script, context, substitutions, journal=None, resume=False, plan=None):
+        # only the full report executes with a journal
+        assert not journal or format == 'full', 'Journal and resume are only supported with the full format'
+        assert not plan or format == 'full', 'Plans are only supported with the full format'
 
         if format == None or format == 'diff':
             # post table and get diff dataframes
@@ -66,13 +69,18 @@ class Invoker:
             context = context[0] if context and len(context) == 1 else None
             substitutions = substitutions[0].decode('utf-8') if substitutions[0] else None
             # post table and get full report
-            post_result = self._db.post_table_get_full_report(table[0], header, query, body, skiprows=skiprows, nrows=nrows, insert=insert, update=update, delete=delete, execute=execute, commit=commit, post_script=post_script, context=context, substitutions=substitutions)
+            post_result = self._db.post_table_get_full_report(table[0], header, query, body, skiprows=skiprows, nrows=nrows, insert=insert, update=update, delete=delete, execute=execute, commit=commit, post_script=post_script, context=context, substitutions=substitutions,
+                                                             journal=journal, resume=resume, plan=plan)
             # return json as string
             return post_result
         elif len(files) > 1:
-            post_result = self._db.post_multiple_tables_get_full_report(table, header, query, files, skiprows=skiprows, nrows=nrows, insert=insert, update=update, delete=delete, execute=execute, commit=commit, post_script=post_script, context=context)
+            post_result = self._db.post_multiple_tables_get_full_report(table, header, query, files, skiprows=skiprows, nrows=nrows, insert=insert, update=update, delete=delete, execute=execute, commit=commit, post_script=post_script, context=context,
+                                                                       journal=journal, resume=resume, plan=plan)
             return post_result
 
+    def apply_plan(self, plan, commit):
+        return self._db.apply_plan(plan, commit=commit)
+
 
 class LocalAuth(Auth):
     # set the secret key during instantiation
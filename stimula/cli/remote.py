@@ -71,9 +71,13 @@ class Invoker:
         # return the token from json response
         return self.get(path, params).text
 
-    def post_table(self, tables, header, query, files, skiprows, nrows, block_size, insert, update, delete, execute, commit, format, post_script, context, substitutions):
+    def post_table(self, tables, header, query, files, skiprows, nrows, block_size, insert, update, delete, execute, commit, format, post_script, context, substitutions, journal=None, resume=False, plan=None):
         assert files is not None and len(files) > 0, 'Provide one or more files to post'
 
+        # the journal is written where the load runs, so it can't be kept for a remote load
+        assert not journal and not resume, 'Journal and resume are only supported for local connections'
+        assert not plan, 'Plans are only supported for local connections'
+
         assert len(tables) == len(files), "Provide exactly one file per table, not %s" % len(files)
 
         # post single file if there's only one table and no substitutions
@@ -117,6 +121,10 @@ class Invoker:
             # return the token from json response
             return self.post_multi(path, params, files=file_map).json()
 
+    def apply_plan(self, plan, commit):
+        # plans are written where the load runs
+        raise AssertionError('Plans are only supported for local connections')
+
     def get(self, path, params):
         # create connection url
         url = f"{self._remote}/stimula/1.0/{path}"
@@ -0,0 +1,217 @@
+"""
+This class selects the backend that executes each part of a diff: the inserted, updated and deleted rows of a mapping.
+
+A backend turns rows into executors. Executing row by row is the safest, because each row gets its own statement and error. Batches
+and COPY need far fewer round trips, but only work for some mappings. The ORM runs the business logic of a model, which some tables
+need, but it's much slower than SQL.
+
+Each backend tells if it's safe for a part of the diff, and what that part would cost. The cost model is deliberately simple: a
+round trip per statement, plus a cost per row that grows with the number of tables that a row joins. Extensions on the root table
+need a second statement per row.
+
+By default, the selector picks backends like before: the ORM for tables that need it, COPY for insert only loads, batches if a batch
+size is given, and row by row otherwise. In automatic mode, it picks the cheapest safe backend. A 'backend' modifier on a column of
+the mapping, like 'title[unique=true: backend=row]', selects the backend of that mapping, if it's safe.
+
+Backends are registered by name, so other backends can be added with register_backend().
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import math
+from abc import ABC, abstractmethod
+
+from .orm_creator import InsertOrmCreator, UpdateOrmCreator, DeleteOrmCreator
+from .query_executor import OperationType
+from .sql_creator import InsertSqlCreator, UpdateSqlCreator, DeleteSqlCreator, BatchInsertSqlCreator, BatchUpdateSqlCreator, BatchDeleteSqlCreator, CopyInsertSqlCreator
+from ..stml.model import Entity, Attribute, Reference
+from ..stml.sql.insert_renderer import CopyRenderer
+
+# tables that must be written through the ORM, because writing them has side effects, like storing attachment files
+ORM_TABLES = ['ir_attachment']
+
+# selects the cheapest safe backend, instead of the default rules
+AUTOMATIC = 'auto'
+
+# estimated cost of a round trip to the database, relative to the cost of writing a row
+ROUND_TRIP_COST = 20
+# estimated cost of writing a row, and of each table that a row joins
+ROW_COST = 1
+JOIN_COST = 1
+# estimated cost of writing a row with COPY, which doesn't parse or plan a statement per row
+COPY_ROW_COST = 0.2
+# estimated cost of writing a row through the ORM, which runs the business logic of the model
+ORM_ROW_COST = 200
+
+# batch size to use in automatic mode, if none is given
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Backend(ABC):
+    # name to select the backend with, in the report and in the 'backend' modifier
+    name = None
+
+    @abstractmethod
+    def is_safe(self, mapping: Entity, operation_type: OperationType, copy: bool, orm) -> bool:
+        # returns true if the backend can execute this part of the diff
+        pass
+
+    @abstractmethod
+    def cost(self, mapping: Entity, operation_type: OperationType, row_count: int, batch_size: int) -> float:
+        # returns the estimated cost of executing this part of the diff
+        pass
+
+    @abstractmethod
+    def create_creator(self, operation_type: OperationType, batch_size: int):
+        # returns the executor creator of this part of the diff
+        pass
+
+
+class RowBackend(Backend):
+    # executes a statement per row
+    name = 'row'
+
+    def is_safe(self, mapping, operation_type, copy, orm):
+        return mapping.name not in ORM_TABLES
+
+    def cost(self, mapping, operation_type, row_count, batch_size):
+        return row_count * (statement_count(mapping, operation_type) * ROUND_TRIP_COST + row_cost(mapping))
+
+    def create_creator(self, operation_type, batch_size):
+        return {OperationType.INSERT: InsertSqlCreator, OperationType.UPDATE: UpdateSqlCreator, OperationType.DELETE: DeleteSqlCreator}[operation_type]()
+
+
+class BatchBackend(Backend):
+    # executes a statement per batch of rows with the same columns. Rows that can't be batched are executed by row
+    name = 'batch'
+
+    def is_safe(self, mapping, operation_type, copy, orm):
+        return mapping.name not in ORM_TABLES
+
+    def cost(self, mapping, operation_type, row_count, batch_size):
+        return math.ceil(row_count / batch_size) * statement_count(mapping, operation_type) * ROUND_TRIP_COST + row_count * row_cost(mapping)
+
+    def create_creator(self, operation_type, batch_size):
+        return {OperationType.INSERT: BatchInsertSqlCreator, OperationType.UPDATE: BatchUpdateSqlCreator, OperationType.DELETE: BatchDeleteSqlCreator}[operation_type](batch_size)
+
+
+class CopyBackend(Backend):
+    # inserts rows with COPY FROM STDIN. A batch that fails is inserted by row
+    name = 'copy'
+
+    def is_safe(self, mapping, operation_type, copy, orm):
+        # only inserts, and only in insert only loads, so that a failed batch doesn't hide rows that other operations fix
+        if operation_type != OperationType.INSERT or not copy or mapping.name in ORM_TABLES:
+            return False
+
+        # only plain columns can be copied
+        return CopyRenderer().is_copyable(Entity(mapping.name, [a for a in mapping.attributes if a and not a.skip and not a.orm_only]))
+
+    def cost(self, mapping, operation_type, row_count, batch_size):
+        return math.ceil(row_count / batch_size) * ROUND_TRIP_COST + row_count * COPY_ROW_COST
+
+    def create_creator(self, operation_type, batch_size):
+        return CopyInsertSqlCreator(batch_size)
+
+
+class OrmBackend(Backend):
+    # executes each row through the ORM
+    name = 'orm'
+
+    def is_safe(self, mapping, operation_type, copy, orm):
+        return orm is not None
+
+    def cost(self, mapping, operation_type, row_count, batch_size):
+        return row_count * ORM_ROW_COST
+
+    def create_creator(self, operation_type, batch_size):
+        return {OperationType.INSERT: InsertOrmCreator, OperationType.UPDATE: UpdateOrmCreator, OperationType.DELETE: DeleteOrmCreator}[operation_type]()
+
+
+# registered backends by name
+BACKENDS = {}
+
+
+def register_backend(backend: Backend):
+    # register a backend, replaces a backend with the same name
+    BACKENDS[backend.name] = backend
+
+
+for _backend in [RowBackend(), BatchBackend(), CopyBackend(), OrmBackend()]:
+    register_backend(_backend)
+
+
+class BackendSelector:
+    def __init__(self, backend=None, batch_size=None, copy=False, orm=None):
+        # name of the backend to use for all mappings, 'auto' to select the cheapest, or None for the default rules
+        assert backend is None or backend == AUTOMATIC or backend in BACKENDS, f"Backend '{backend}' not supported, use one of: {', '.join([AUTOMATIC] + list(BACKENDS))}"
+        self._backend = backend
+        self._batch_size = batch_size
+        # copy inserted rows, if this is an insert only load
+        self._copy = copy
+        self._orm = orm
+
+    def select(self, mapping: Entity, operation_type: OperationType, row_count: int):
+        # returns the name of the backend to execute a part of the diff with
+        override = self._override(mapping)
+
+        # ORM tables can only be written through the ORM
+        if mapping.name in ORM_TABLES:
+            assert self._orm is not None, 'ORM is required for this mapping'
+
+        # a backend that is selected by the mapping or by the caller wins, if it's safe
+        if override and override != AUTOMATIC:
+            assert override in BACKENDS, f"Backend '{override}' not supported, use one of: {', '.join([AUTOMATIC] + list(BACKENDS))}"
+            if self._is_safe(override, mapping, operation_type):
+                return override
+
+        if override == AUTOMATIC:
+            # select the cheapest safe backend, prefer the first registered backend if costs are equal
+            batch_size = self._batch_size or DEFAULT_BATCH_SIZE
+            safe = [name for name in BACKENDS if self._is_safe(name, mapping, operation_type)]
+            return min(safe, key=lambda name: BACKENDS[name].cost(mapping, operation_type, row_count, batch_size))
+
+        return self._default(mapping, operation_type)
+
+    def create_creator(self, name, operation_type: OperationType):
+        # create the executor creator of a backend
+        return BACKENDS[name].create_creator(operation_type, self._batch_size or DEFAULT_BATCH_SIZE)
+
+    def _override(self, mapping: Entity):
+        # a backend modifier on any column of the mapping overrides the backend of the caller
+        backends = {a.backend for a in mapping.attributes if a and a.backend}
+        assert len(backends) <= 1, f"Mapping of table {mapping.name} selects more than one backend: {', '.join(sorted(backends))}"
+        return backends.pop() if backends else self._backend
+
+    def _is_safe(self, name, mapping, operation_type):
+        return BACKENDS[name].is_safe(mapping, operation_type, self._copy, self._orm)
+
+    def _default(self, mapping: Entity, operation_type: OperationType):
+        # rules before backends could be selected: ORM for tables that need it, COPY for inserts of insert only loads if all rows
+        # can be copied, batches if a batch size is given, and row by row otherwise
+        if mapping.name in ORM_TABLES:
+            return OrmBackend.name
+        if self._is_safe(CopyBackend.name, mapping, operation_type):
+            return CopyBackend.name
+        if self._batch_size:
+            return BatchBackend.name
+        return RowBackend.name
+
+
+def statement_count(mapping: Entity, operation_type: OperationType):
+    # inserts and deletes with an extension on the root table need a second statement, to insert or delete the extension record
+    if operation_type in [OperationType.INSERT, OperationType.DELETE] and any(isinstance(a, Reference) and a.extension for a in mapping.attributes if a):
+        return 2
+    return 1
+
+
+def row_cost(mapping: Entity):
+    # cost of writing a row, plus the cost of each table that it joins
+    return ROW_COST + JOIN_COST * sum(_join_count(a) for a in mapping.attributes if a and not a.skip and not a.orm_only)
+
+
+def _join_count(attribute):
+    # number of tables that an attribute joins, including nested references
+    if isinstance(attribute, Attribute) or attribute is None:
+        return 0
+    return 1 + sum(_join_count(a) for a in attribute.attributes)
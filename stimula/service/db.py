@@ -6,22 +6,34 @@ Email: romke@rnadesign.net
 """
 import logging
 import re
+from functools import partial
 from io import StringIO
 from typing import Optional
 
 import pandas as pd
 import psycopg2
 from pandas import DataFrame
+from pandas.api.types import infer_dtype
+from pandas.util import hash_pandas_object
 
 from .abstract_orm import AbstractORM
 from .context import cnx_context, get_metadata
 from .csv_reader import CsvReader
 from .db_reader import DbReader
+from .dependency_sorter import DependencySorter
 from .diff_to_executor import DiffToExecutor
 from .executor_service import ExecutorService
+from .external_id_cache import ExternalIdCache
+from .merge_reader import MergeReader
 from .odoo.postgres_model_service import PostgresModelService
+from .partitioned_differ import PartitionedDiffer
 from .query_executor import OperationType
+from .plan import Plan, mapping_markers
+from .progress_journal import ProgressJournal
 from .reporter import Reporter
+from .staging_reader import StagingReader
+from .transaction_sizer import TransactionSizer
+from .validator import Validator
 from ..stml.header_renderer import HeaderRenderer
 from ..stml.json_renderer import JsonRenderer
 from ..stml.model import Entity
@@ -175,22 +187,47 @@ class DB:
         return self._convert_to_df(sqls, execute)
 
     def post_table_get_full_report(self, table_name, header, where_clause, body, skiprows=0, nrows=None, insert=False, update=False, delete=False, execute=False, commit=False,
-                                   post_script=None, context=None, substitutions=None):
+                                   post_script=None, context=None, substitutions=None, batch_size=None, diff_engine='pandas', savepoint_size=None, dependency_order=False, prepare=False, group_size=None,
+                                   pipeline_size=None, prefetch=False, validate=False, cache_external_ids=False, backend=None, parallel_size=None, tx_size_bounds=None, journal=None, resume=False, plan=None, key_pushdown=False, diff_processes=None):
+        # arguments of this load, to load again when applying a plan if tables changed
+        arguments = self._plan_arguments(locals())
 
         # create orm service if function is provided
         orm: Optional[AbstractORM] = self._orm_function() if self._orm_function else None
 
+        # backend that executes each operation, per table
+        backends = {}
+
+        # rows that the mapping reads, to detect changes before applying a plan
+        markers = {}
+
+        # write committed rows to a journal, and skip rows that an earlier run committed if resuming
+        progress_journal = self._open_journal(journal, resume, [table_name], [header], [body])
+
+        # read external ids once per module and model in this load, instead of joining the external id table in each query
+        external_ids = ExternalIdCache() if cache_external_ids else None
+
         # create diffs and sql
-        diff, query_executors = self._get_diffs_and_sql(table_name, header, where_clause, body, skiprows, nrows, insert, update, delete, post_script, context, orm=orm, substitutions=substitutions)
+        diff, query_executors = self._get_diffs_and_sql(table_name, header, where_clause, body, skiprows, nrows, insert, update, delete, post_script, context, orm=orm, substitutions=substitutions,
+                                                        batch_size=batch_size, diff_engine=diff_engine, prefetch=prefetch, loaded_tables=[table_name], validate=validate,
+                                                        external_ids=external_ids, backend=backend, backends=backends, markers=markers, key_pushdown=key_pushdown, diff_processes=diff_processes,
+                                                        committed_lines=progress_journal.committed_lines(table_name) if progress_journal else None)
 
-        # execute sql statements
-        execution_results = ExecutorService().execute_sql(query_executors, execute, commit)
+        if plan:
+            # write executors to a plan, to apply them later without reading and comparing again
+            Plan('post_table_get_full_report', arguments, query_executors, markers, backends).save(plan)
 
-        # create full report
-        return Reporter().create_post_report([table_name], [body], [context], execution_results, execute, commit, skiprows, nrows)
+        # execute sql statements and create full report
+        return self._execute_and_report(query_executors, execute, commit, [table_name], [body], [context], skiprows, nrows, backends, savepoint_size=savepoint_size,
+                                        dependency_order=dependency_order, prepare=prepare, group_size=group_size, pipeline_size=pipeline_size, parallel_size=parallel_size,
+                                        tx_size_bounds=tx_size_bounds, progress_journal=progress_journal, external_ids=external_ids)
 
     def post_multiple_tables_get_full_report(self, table_names, header, where_clause, contents, skiprows=0, nrows=None, insert=False, update=False, delete=False, execute=False, commit=False,
-                                             post_script=None, context=None, substitutions=None):
+                                             post_script=None, context=None, substitutions=None, batch_size=None, diff_engine='pandas', savepoint_size=None, dependency_order=False, prepare=False, group_size=None,
+                                             pipeline_size=None, prefetch=False, validate=False, cache_external_ids=False, backend=None, parallel_size=None, tx_size_bounds=None, journal=None, resume=False, plan=None, key_pushdown=False, diff_processes=None):
+        # arguments of this load, to load again when applying a plan if tables changed
+        arguments = self._plan_arguments(locals())
+
         assert len(table_names) == len(contents), f"Provide exactly one file for each table name, so {len(table_names)}, not {len(contents)}"
         assert header is None, "Header must be None when posting multiple tables"
         assert skiprows >= 1, "Skiprows must be at least 1 when posting multiple tables"
@@ -199,9 +236,21 @@ class DB:
 
         query_executors = []
 
+        # backend that executes each operation, per table
+        backends = {}
+
+        # rows that the mappings read, to detect changes before applying a plan
+        markers = {}
+
         # create orm service if function is provided
         orm: Optional[AbstractORM] = self._orm_function() if self._orm_function else None
 
+        # write committed rows to a journal, and skip rows that an earlier run committed if resuming. Headers are on the first line
+        progress_journal = self._open_journal(journal, resume, table_names, [content.decode('utf-8').split('\n', 1)[0] for content in contents], contents)
+
+        # read external ids once per module and model in this load, instead of joining the external id table in each query
+        external_ids = ExternalIdCache() if cache_external_ids else None
+
         # Iterate over tables here.
         for table_name, file_context, content in zip(table_names, context, contents):
             # decode binary content
@@ -212,14 +261,65 @@ class DB:
             header = text_content.split('\n', 1)[0]
 
             # create diffs and sql
-            _, qe = self._get_diffs_and_sql(table_name, header, where_clause, text_content, skiprows, nrows, insert, update, delete, post_script, file_context, orm=orm, substitutions=text_substitutions)
+            _, qe = self._get_diffs_and_sql(table_name, header, where_clause, text_content, skiprows, nrows, insert, update, delete, post_script, file_context, orm=orm, substitutions=text_substitutions,
+                                            batch_size=batch_size, diff_engine=diff_engine, prefetch=prefetch, loaded_tables=table_names, validate=validate,
+                                            external_ids=external_ids, backend=backend, backends=backends, markers=markers, key_pushdown=key_pushdown, diff_processes=diff_processes,
+                                            committed_lines=progress_journal.committed_lines(table_name) if progress_journal else None)
             query_executors.extend(qe)
 
+        if delete:
+            # delete from tables before the tables they reference, so that deletes don't fail on foreign keys and need retry rounds
+            query_executors = DependencySorter().sort_deletes(query_executors, PostgresModelService().sort_tables(table_names))
+
+        if plan:
+            # write executors to a plan, to apply them later without reading and comparing again
+            Plan('post_multiple_tables_get_full_report', arguments, query_executors, markers, backends).save(plan)
+
+        # execute sql statements and create full report
+        return self._execute_and_report(query_executors, execute, commit, table_names, contents, context, skiprows, nrows, backends, savepoint_size=savepoint_size,
+                                        dependency_order=dependency_order, prepare=prepare, group_size=group_size, pipeline_size=pipeline_size, parallel_size=parallel_size,
+                                        tx_size_bounds=tx_size_bounds, progress_journal=progress_journal, external_ids=external_ids)
+
+    def apply_plan(self, path, commit=False):
+        # execute the executors of a plan if no table changed since the plan was created, otherwise load again with the same arguments
+        orm: Optional[AbstractORM] = self._orm_function() if self._orm_function else None
+        plan = Plan.load(path, orm)
+        arguments = plan.arguments
+
+        if not plan.is_current():
+            _logger.info(f'Tables changed since plan {path} was created, loading again')
+            full_report = getattr(self, plan.method)(**arguments, execute=True, commit=commit)
+            full_report['summary']['plan'] = 'changed'
+            return full_report
+
+        # table names, contents and contexts for the report
+        if plan.method == 'post_table_get_full_report':
+            table_names, contents, contexts = [arguments['table_name']], [arguments['body']], [arguments['context']]
+        else:
+            table_names, contents, contexts = arguments['table_names'], arguments['contents'], arguments['context']
+
+        # execute with the same options as the load that created the plan
+        options = {name: arguments[name] for name in ['savepoint_size', 'dependency_order', 'prepare', 'group_size', 'pipeline_size', 'parallel_size', 'tx_size_bounds']}
+        full_report = self._execute_and_report(plan.query_executors, True, commit, table_names, contents, contexts, arguments['skiprows'], arguments['nrows'], plan.backends, **options)
+        full_report['summary']['plan'] = 'current'
+        return full_report
+
+    def _execute_and_report(self, query_executors, execute, commit, table_names, contents, contexts, skiprows, nrows, backends, savepoint_size=None, dependency_order=False, prepare=False,
+                            group_size=None, pipeline_size=None, parallel_size=None, tx_size_bounds=None, progress_journal=None, external_ids=None):
+        # commit every 1000 rows, or adapt the transaction size within bounds
+        tx_size = TransactionSizer(*tx_size_bounds) if tx_size_bounds else 1000
+
         # execute sql statements
-        execution_results = ExecutorService().execute_sql(query_executors, execute, commit)
+        executor_service = ExecutorService()
+        execution_results = executor_service.execute_sql(query_executors, execute, commit, tx_size=tx_size, savepoint_size=savepoint_size, dependency_order=dependency_order, prepare=prepare, group_size=group_size,
+                                                         pipeline_size=pipeline_size, parallel_size=parallel_size, journal=progress_journal, external_ids=external_ids)
+
+        if progress_journal:
+            progress_journal.close()
 
         # create full report
-        return Reporter().create_post_report(table_names, contents, context, execution_results, execute, commit, skiprows, nrows)
+        return Reporter().create_post_report(table_names, contents, contexts, execution_results, execute, commit, skiprows, nrows, executor_service.retry_statistics, backends,
+                                             executor_service.transaction_statistics)
 
     def _convert_to_df(self, sqls, showResult):
         # create empty pandas dataframe. First column contains sql
@@ -257,7 +357,10 @@ class DB:
     def post_table_get_summary(self, table_name, header, where_clause, body, skiprows=0, nrows=None, insert=False, update=False, delete=False, execute=False, commit=False):
         pass
 
-    def _get_diffs_and_sql(self, table_name, header, where_clause, body, skiprows, nrows, insert, update, delete, post_script, context, orm: Optional[AbstractORM] = None, substitutions: str=None):
+    def _get_diffs_and_sql(self, table_name, header, where_clause, body, skiprows, nrows, insert, update, delete, post_script, context, orm: Optional[AbstractORM] = None, substitutions: str=None,
+                           batch_size: int = None, diff_engine: str = 'pandas', prefetch: bool = False, loaded_tables=(), validate: bool = False,
+                           external_ids: ExternalIdCache = None, backend: str = None, backends: dict = None, committed_lines: set = None,
+                           markers: dict = None, key_pushdown: bool = False, diff_processes: int = None):
 
         # if header is empty and skiprows is larger than 0, then take the first line as header
         if not header and skiprows > 0:
@@ -282,21 +385,84 @@ class DB:
         # iterate over mappings
         for mapping in mappings:
 
+            if markers is not None:
+                # collect rows that the mapping reads. Prefetched references may resolve to any row of the referenced tables
+                markers.update(mapping_markers(mapping, resolved=prefetch))
+
             # read dataframe from request first, so we can give feedback on errors in the request
             df_request = CsvReader().read_from_request(mapping, body, skiprows, nrows, post_script, substitutions_map)
 
-            # read dataframe from DB
-            df_db = DbReader().read_from_db(mapping, where_clause, set_index=True)
+            # index values of rows that an earlier run committed, they are skipped on both sides of the diff
+            committed_index = None
+            if committed_lines:
+                committed = df_request['__line__'].isin(committed_lines)
+                committed_index = df_request.index[committed]
+                df_request = df_request[~committed]
+
+            # without updates, only the unique values of the table are compared, so only read the unique columns
+            db_mapping = mapping if update else DbReader().key_mapping(mapping, where_clause)
+
+            if diff_engine == 'staging':
+                # find changed rows on the server, and only read those request lines and DB rows
+                chunks = [StagingReader().read_changes(mapping, df_request, where_clause, insert, update, delete)]
+            elif diff_engine == 'merge':
+                # read the table in chunks in the order of the unique columns, each with the request lines of the same keys
+                chunks = MergeReader().read_chunks(db_mapping, df_request, where_clause)
+            else:
+                # without deletes, only rows with the unique values of the request are compared, so only read those if the request is small
+                keys = df_request.index if key_pushdown and not delete else None
+
+                # read dataframe from DB
+                chunks = [(df_request, DbReader().read_from_db(db_mapping, where_clause, set_index=True, external_ids=external_ids, keys=keys))]
+
+            chunk_diffs = []
+            for df_request_chunk, df_db in chunks:
+                if committed_index is not None:
+                    # committed rows are not in the request anymore, so they must not be deleted either
+                    df_db = df_db[~df_db.index.isin(committed_index)]
+
+                # copy inserted rows if only inserts are enabled, like in an initial load of a table
+                copy = insert and not update and not delete
+
+                # workers can't read from the database or use the ORM, so validation, prefetching and the ORM compare in this process
+                if diff_processes and not validate and not prefetch and orm is None and PartitionedDiffer.is_supported():
+                    # compare partitions of the keys and create their sql statements in several processes
+                    compare = partial(self._compare, insert=insert, update=update, delete=delete, fingerprint=diff_engine == 'hash')
+                    create_executors = partial(self._diff_to_sql.diff_executor, mapping, context=context, batch_size=batch_size, copy=copy, loaded_tables=loaded_tables, backend=backend)
+                    diffs, executors = PartitionedDiffer(diff_processes).diff(df_request_chunk, df_db, compare, create_executors, backends)
+                    sqls.extend(executors)
+                    chunk_diffs.append(diffs)
+                    continue
+
+                # todo: remove the need to return diffs
+                diffs = self._compare(df_request_chunk, df_db, insert, update, delete, fingerprint=diff_engine == 'hash')
+
+                if validate:
+                    # validate inserted and updated rows against the table definition, and report rows that would fail without executing them
+                    diffs, failed = Validator(PostgresModelService()).validate(mapping, diffs, context)
+                    sqls.extend(failed)
+
+                # create sql statements and parameters
+                sqls.extend(self._diff_to_sql.diff_executor(mapping, diffs, context, orm, batch_size, copy, prefetch, loaded_tables, external_ids, backend, backends))
+                chunk_diffs.append(diffs)
+
+            # combine the diffs of all chunks, they only hold changed rows
+            diffs = chunk_diffs[0] if len(chunk_diffs) == 1 else tuple(pd.concat(parts, ignore_index=True) for parts in zip(*chunk_diffs))
 
-            # todo: remove the need to return diffs
-            diffs = self._compare(df_request, df_db, insert, update, delete)
+        return diffs, sqls
 
-            # create sql statements and parameters
-            sqls.extend(self._diff_to_sql.diff_executor(mapping, diffs, context, orm))
+    def _plan_arguments(self, arguments):
+        # arguments of a post method to store in a plan. Applying a plan decides whether to execute and commit, and doesn't write a plan or journal
+        return {name: value for name, value in arguments.items() if name not in ['self', 'execute', 'commit', 'journal', 'resume', 'plan']}
 
-        return diffs, sqls
+    def _open_journal(self, journal, resume, table_names, headers, contents):
+        # open the journal at the given path, if any
+        assert journal or not resume, 'Provide the path of a journal to resume from'
+        if not journal:
+            return None
+        return ProgressJournal(journal, table_names, headers, contents).open(resume)
 
-    def _compare(self, df_request, df_db, insert, update, delete):
+    def _compare(self, df_request, df_db, insert, update, delete, fingerprint=False):
         # remove columns with empty names. Don't do this when reading from DB, because in get_table request we also want empty columns
         df_db = df_db.drop(columns=[''], errors='ignore')
 
@@ -313,10 +479,18 @@ class DB:
         deletes = df_db[df_db.index.isin(deleted_indices)]
         deletes.reset_index(inplace=True)
 
+        # without updates, the database may only have read the unique columns, so don't compare values
+        if not update:
+            return inserts if insert else DataFrame(), DataFrame(), deletes if delete else DataFrame()
+
         # find rows to update. Left is from request, right is from database
         left = df_request[~df_request.index.isin(inserted_indices)]
         right = df_db[~df_db.index.isin(deleted_indices)]
 
+        if fingerprint:
+            # skip rows that are the same on both sides, before comparing cells
+            left = self._fingerprint_changes(left, right)
+
         # Sort the right DataFrame to match the index of the left DataFrame
         right_df_sorted = right.reindex(left.index)
 
@@ -347,7 +521,35 @@ class DB:
         updates = self._move_line_to_front(updates)
 
         # return result
-        return inserts if insert else DataFrame(), updates if update else DataFrame(), deletes if delete else DataFrame()
+        return inserts if insert else DataFrame(), updates, deletes if delete else DataFrame()
+
+    def _fingerprint_changes(self, left, right):
+        # returns the rows of left whose hash of values differs from the row with the same index in right. Rows that are the same have the same
+        # hash, so this never drops a changed row, but rows with a different hash may still turn out to be the same when comparing cells
+        columns = [column for column in left.columns if column in right.columns]
+
+        # without values besides the unique columns, rows can't differ
+        if not columns:
+            return left
+
+        # N/A on one side and '' on the other hash differently, comparing cells tells that they are the same
+        left_values = left[columns]
+        right_values = right[columns].reindex(left.index)
+
+        # values of different types in object columns, like 1 and '1', hash the same. If types differ, compare all rows instead
+        if not all(self._same_value_types(left_values[column], right_values[column]) for column in columns):
+            return left
+
+        # hash each row of values, without the index. Don't categorize, because most values of a column are unique
+        changed = hash_pandas_object(left_values, index=False, categorize=False).values != hash_pandas_object(right_values, index=False, categorize=False).values
+        return left[changed]
+
+    def _same_value_types(self, left, right):
+        # hashes of object columns are only comparable if both sides have values of a single, same type, or no values at all
+        if left.dtype != object and right.dtype != object:
+            return True
+        types = {infer_dtype(left, skipna=True), infer_dtype(right, skipna=True)} - {'empty'}
+        return len(types) <= 1 and not any(t.startswith('mixed') for t in types)
 
     def _move_line_to_front(self, df):
         # move __line__ to become the left most column. This has no real purpose, but it makes the dataframes more readable
@@ -1,9 +1,13 @@
+from copy import copy
+
 import pandas as pd
 
+from stimula.service.external_id_cache import external_id_reference
 from stimula.service.model_service import ModelService
 from stimula.service.odoo.jsonrpc_model_service import JsonRpcModelService
 from stimula.service.odoo.postgres_model_service import PostgresModelService
 from stimula.stml.header_renderer import HeaderRenderer
+from stimula.stml.model import Entity, Attribute, Reference
 from stimula.stml.sql.types_renderer import TypesRenderer
 
 MODEL_SERVICES = {
@@ -11,22 +15,176 @@ MODEL_SERVICES = {
     "jsonrpc": JsonRpcModelService
 }
 
+# only read the rows with the unique values of the request, if the request has fewer rows than this share of the table
+KEY_PUSHDOWN_RATIO = 0.1
+
+# types of unique columns that are converted differently when reading the request and the table, so they can't be compared in the database
+NON_TEXT_TYPES = ['boolean', 'numeric', 'double precision', 'timestamp', 'date', 'jsonb', 'bytea']
+
 
 class DbReader:
     def __init__(self, protocol='sql'):
         assert protocol in MODEL_SERVICES, f"Protocol '{protocol}' not supported"
         self._model_service: ModelService = MODEL_SERVICES[protocol]()
 
-    def read_from_db(self, mapping, where_clause, set_index=False):
+    def read_from_db(self, mapping, where_clause, set_index=False, external_ids=None, keys=None):
+
+        # keys are the unique values of the request. Only read rows with those values, if the request is small compared to the table
+        if keys is not None and not self._push_down_keys(mapping, keys):
+            keys = None
+
+        # read ids instead of joining external ids, if they're in the cache. A free where clause may refer to the joined tables
+        if external_ids is not None and not where_clause:
+            return self.convert(mapping, self._read_with_external_ids(mapping, external_ids, keys), set_index)
+
+        # read dataframe from DB
+        df = self._model_service.read_table(mapping, where_clause, self._key_filter(mapping, keys))
+
+        # set headers and convert values
+        return self.convert(mapping, df, set_index)
+
+    def _read_with_external_ids(self, mapping, external_ids, keys=None):
+        # replace references to external ids by the id columns of the root table, and keep the cached names of those columns
+        attributes = []
+        names = {}
+        # cached ids of external id names per position, to select rows by the ids of the request names
+        ids = {}
+        for attribute in mapping.attributes:
+            external_id = external_id_reference(attribute, mapping.name) if attribute else None
+            if external_id and not attribute.skip and not attribute.orm_only:
+                # skip if a record has more than one external id, because then the join returns a row per external id
+                external_id_names = external_ids.names(*external_id)
+                if external_id_names is not None:
+                    # position of the column in the result, skipped columns are not selected
+                    position = len([a for a in attributes if not a or (not a.skip and not a.orm_only)])
+                    names[position] = (external_id_names, attribute.unique)
+                    ids[position] = external_ids.ids(*external_id)
+                    attributes.append(Attribute(attribute.name, unique=attribute.unique, enabled=attribute.enabled, in_use=attribute.in_use))
+                    continue
+            attributes.append(attribute)
+
+        # read dataframe from DB
+        df = self._model_service.read_table(Entity(mapping.name, attributes, mapping.primary_key), None, self._key_filter(mapping, keys, ids))
+
+        for index, (external_id_names, unique) in names.items():
+            # map ids to names, like the join with the external id table does
+            df.isetitem(index, df.iloc[:, index].map(external_id_names).astype(object))
+
+            # a unique external id is an inner join, that skips records without external id
+            if unique:
+                df = df[df.iloc[:, index].notna()]
+
+        return df.reset_index(drop=True)
+
+    def _push_down_keys(self, mapping, keys):
+        # push down keys if the request is small compared to the number of rows in the table, and the table has been analyzed
+        row_count = self._model_service.estimate_row_count(mapping.name)
+        return row_count is not None and len(keys) < KEY_PUSHDOWN_RATIO * row_count
+
+    def _key_filter(self, mapping, keys, ids=None):
+        # returns the position in the select clause, the type and the request values of each unique column, or None to read all rows
+        if keys is None:
+            return None
+
+        positions = self.key_positions(mapping)
+        if positions is None:
+            return None
+
+        # request values as tuples of unique values
+        rows = list(keys) if isinstance(keys, pd.MultiIndex) else [(value,) for value in keys]
+
+        # null never equals a value in the database, but the diff matches empty keys, so read all rows
+        if any(pd.isna(value) for row in rows for value in row):
+            return None
+
+        selected = [a for a in mapping.attributes if (not a) or (not a.skip and not a.orm_only)]
+        types = []
+        for index, position in enumerate(positions):
+            if ids and position in ids:
+                # names of external ids are selected by their cached ids. A name without id is inserted, it doesn't need a row
+                rows = [row for row in rows if row[index] in ids[position]]
+                rows = [row[:index] + (ids[position][row[index]],) + row[index + 1:] for row in rows]
+                types.append('integer')
+                continue
+
+            key_type = self._key_type(selected[position])
+            if key_type is None:
+                return None
+            types.append(key_type)
+
+        # convert values to the python type of the column
+        converters = {'integer': int, 'text': str}
+        return [(position, key_type, [converters[key_type](row[index]) for row in rows]) for index, (position, key_type) in enumerate(zip(positions, types))]
+
+    def key_mapping(self, mapping, where_clause=None):
+        # returns a copy of the mapping that only selects the unique columns, and the extension columns of the root table that deletes need.
+        # Other columns are dropped with their joins, unless they filter rows, or a free where clause may refer to their joins
+        attributes = []
+        for attribute in mapping.attributes:
+            # empty columns are not compared
+            if not attribute:
+                continue
+
+            if attribute.unique or (isinstance(attribute, Reference) and attribute.extension):
+                attributes.append(attribute)
+            elif where_clause or self._has_filter(attribute):
+                # keep the joins and filters of the column, but don't select it
+                skipped = copy(attribute)
+                skipped.skip = True
+                attributes.append(skipped)
+
+        return Entity(mapping.name, attributes, mapping.primary_key)
+
+    def _has_filter(self, attribute):
+        if isinstance(attribute, Reference):
+            # recurse
+            return any(self._has_filter(a) for a in attribute.attributes)
+        return bool(attribute.filter)
+
+    def key_positions(self, mapping):
+        # returns the position in the select clause of each unique column, or None if the unique columns are not all selected
+        column_names = HeaderRenderer().render_list(mapping)
+        index_columns = HeaderRenderer().render_list_unique(mapping)
+
+        # unique columns must be selected
+        if not index_columns or any(column not in column_names for column in index_columns):
+            return None
+        return [column_names.index(column) for column in index_columns]
+
+    def key_types(self, mapping):
+        # returns the position in the select clause and the type to compare as of each unique column, or None if they can't be compared in the database
+        positions = self.key_positions(mapping)
+        if positions is None:
+            return None
+
+        selected = [a for a in mapping.attributes if (not a) or (not a.skip and not a.orm_only)]
+        types = [self._key_type(selected[position]) for position in positions]
+        return None if None in types else list(zip(positions, types))
+
+    def _key_type(self, attribute):
+        # integer columns are compared as integers, text columns and columns of multiple attributes as text. Other types can't be compared
+        attributes = self._attributes(attribute)
+        if len(attributes) > 1:
+            return 'text'
+        if attributes[0].type == 'integer':
+            return 'integer'
+        if attributes[0].type in NON_TEXT_TYPES:
+            return None
+        return 'text'
+
+    def _attributes(self, attribute):
+        if isinstance(attribute, Reference):
+            # recurse
+            return [a for nested in attribute.attributes for a in self._attributes(nested)]
+        return [attribute]
+
+    def convert(self, mapping, df, set_index=False):
 
         # get enabled and unique columns and column types
         column_names = HeaderRenderer().render_list(mapping)
         index_columns = HeaderRenderer().render_list_unique(mapping)
         column_types = TypesRenderer().render(mapping, column_names)
 
-        # read dataframe from DB
-        df = self._model_service.read_table(mapping, where_clause)
-
         # set headers, they must equal the request headers for comparison
         df.columns = column_names
 
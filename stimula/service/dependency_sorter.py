@@ -0,0 +1,169 @@
+"""
+This class sorts query executors so that rows are executed after the rows they reference.
+
+A row references another row if it has a reference, like parent_id(name), with values that another row inserts or updates in the
+same table, or in another table of the same post. Executing rows in topological order lets these rows succeed in a single pass,
+instead of in repeated retry rounds. Rows that are part of a cycle can't be ordered, they are executed last and may be retried.
+
+A nested reference, like authorid(publisherid(publishername)), doesn't identify the referenced row by values. Rows with such a reference
+are executed after all rows that insert or update the tables of the reference, and may be retried as well.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import heapq
+
+from .query_executor import BatchQueryExecutor, OperationType
+
+
+class DependencySorter:
+
+    def sort(self, query_executors):
+        """
+        Sorts query executors in dependency order
+        :param query_executors: list of query executors
+        :return: tuple of the sorted executors, and the set of executors to retry: those that are part of, or depend on, a cycle, and
+        those that may reference any row of a table
+        """
+
+        # find the executors that each executor depends on
+        dependencies = self._dependencies(query_executors)
+
+        # count unresolved dependencies per executor, and list the executors that depend on each executor
+        in_degree = [len(d) for d in dependencies]
+        dependents = [[] for _ in query_executors]
+        for index, executor_dependencies in enumerate(dependencies):
+            for dependency in executor_dependencies:
+                dependents[dependency].append(index)
+
+        # start with executors without dependencies. Use a heap on the original position, so that independent rows keep their order
+        ready = [index for index, degree in enumerate(in_degree) if degree == 0]
+        heapq.heapify(ready)
+
+        sorted_indices = []
+        while ready:
+            index = heapq.heappop(ready)
+            sorted_indices.append(index)
+
+            # resolve the dependency of executors that depend on this one
+            for dependent in dependents[index]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+
+        # executors that were not sorted are part of a cycle, or depend on one. Execute them last, in their original order
+        sorted_set = set(sorted_indices)
+        cyclic_indices = [index for index in range(len(query_executors)) if index not in sorted_set]
+
+        # get executors from indices
+        sorted_executors = [query_executors[index] for index in sorted_indices + cyclic_indices]
+        cyclic_executors = set(self._expand(query_executors[index] for index in cyclic_indices))
+
+        # the rows that an executor references by a nested reference are not known, so it may still depend on a row that is not ordered before it
+        cyclic_executors.update(self._expand(executor for executor in query_executors if any(names is None for _, names, _ in self._references(executor))))
+
+        return sorted_executors, cyclic_executors
+
+    def components(self, query_executors):
+        """
+        Groups query executors that depend on each other, directly or through other executors
+        :param query_executors: list of query executors
+        :return: list with the position of the first executor of its group, per executor
+        """
+
+        # find the executors that each executor depends on
+        dependencies = self._dependencies(query_executors)
+
+        # union find, each group is represented by its lowest position
+        parent = list(range(len(query_executors)))
+
+        def find(index):
+            while parent[index] != index:
+                # halve the path on the way up
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        for index, executor_dependencies in enumerate(dependencies):
+            for dependency in executor_dependencies:
+                root, dependency_root = find(index), find(dependency)
+                parent[max(root, dependency_root)] = min(root, dependency_root)
+
+        return [find(index) for index in range(len(query_executors))]
+
+    def _dependencies(self, query_executors):
+        # index the executors that provide key values, by table and attribute names
+        index = {}
+
+        dependencies = []
+        for executor in query_executors:
+            executor_dependencies = set()
+
+            for table, names, values in self._references(executor):
+                if names is None:
+                    # the executor may reference any row of the table, so it depends on all executors that insert or update the table
+                    executor_dependencies.update(self._table_providers(query_executors, index, table))
+                    continue
+
+                # find executors that provide these values
+                providers = self._providers(query_executors, index, table, names)
+                executor_dependencies.update(providers.get(values, []))
+
+            dependencies.append(executor_dependencies)
+
+        return dependencies
+
+    def _providers(self, query_executors, index, table, names):
+        # create index of provider positions for this table and attribute names on first use
+        if (table, names) not in index:
+            providers = {}
+            for position, executor in enumerate(query_executors):
+                for key_table, key_values in self._keys(executor):
+                    # executor must provide values for all attribute names
+                    if key_table == table and all(name in key_values for name in names):
+                        values = tuple(key_values[name] for name in names)
+                        providers.setdefault(values, set()).add(position)
+            index[(table, names)] = providers
+
+        return index[(table, names)]
+
+    def _table_providers(self, query_executors, index, table):
+        # create index of positions of executors that insert or update this table on first use
+        if table not in index:
+            index[table] = {position for position, executor in enumerate(query_executors)
+                            if executor.table_name == table and executor.operation_type != OperationType.DELETE}
+
+        return index[table]
+
+    def _keys(self, executor):
+        # a batch provides the keys of all its rows
+        return [key for e in self._expand([executor]) for key in e.keys]
+
+    def _references(self, executor):
+        # a batch depends on the references of all its rows
+        return [reference for e in self._expand([executor]) for reference in e.references]
+
+    def _expand(self, query_executors):
+        # replace batches by their row executors, and keep the batches themselves
+        for executor in query_executors:
+            yield executor
+            if isinstance(executor, BatchQueryExecutor):
+                yield from executor.executors
+
+    def sort_deletes(self, query_executors, table_names):
+        """
+        Moves deletes after inserts and updates, and orders deletes so that rows are deleted from tables before the tables they reference
+        :param query_executors: list of query executors
+        :param table_names: table names, ordered so that tables come after the tables they reference
+        :return: list of sorted executors
+        """
+
+        # keep inserts and updates in their order
+        others = [executor for executor in query_executors if executor.operation_type != OperationType.DELETE]
+        deletes = [executor for executor in query_executors if executor.operation_type == OperationType.DELETE]
+
+        # delete from the last table first, keep the order of deletes within a table. Tables that are not listed go last
+        position = {table_name: index for index, table_name in enumerate(reversed(table_names))}
+        deletes.sort(key=lambda executor: position.get(executor.table_name, len(position)))
+
+        return others + deletes
@@ -1,6 +1,6 @@
 """
 This class takes a diff and creates query executors for each diff type.
-It also makes the split between using SQL, ORM or any other way to execute the queries.
+It also makes the split between using SQL, ORM or any other way to execute the queries, see BackendSelector.
 
 Author: Romke Jonker
 Email: romke@rnadesign.net
@@ -8,8 +8,9 @@ Email: romke@rnadesign.net
 from typing import Optional
 
 from .abstract_orm import AbstractORM
-from .orm_creator import InsertOrmCreator, UpdateOrmCreator, DeleteOrmCreator
-from .sql_creator import InsertSqlCreator, UpdateSqlCreator, DeleteSqlCreator
+from .backend_selector import BackendSelector, OrmBackend
+from .query_executor import OperationType
+from .reference_resolver import ReferenceResolver
 from ..stml.alias_enricher import AliasEnricher
 
 
@@ -18,47 +19,37 @@ class DiffToExecutor:
     def __init__(self):
         pass
 
-    def diff_executor(self, mapping, diffs, context=None, orm: Optional[AbstractORM] = None):
-
-        if not self._use_orm(mapping):
-            # create SQL query executors
-            return self._sql_executor(mapping, diffs, context)
-        else:
-            # assert that orm exists
-            assert orm is not None, 'ORM is required for this mapping'
-
-            # create ORM executors
-            return self._orm_executor(mapping, diffs, context, orm)
-
-    def _use_orm(self, mapping):
-        # hard coded for now
-        return mapping.name in ['ir_attachment']
-
-    def _sql_executor(self, mapping, diffs, context=None):
+    def diff_executor(self, mapping, diffs, context=None, orm: Optional[AbstractORM] = None, batch_size: int = None, copy: bool = False, prefetch: bool = False, loaded_tables=(), external_ids=None,
+                      backend: str = None, backends: dict = None):
         # get from tuple
         inserts, updates, deletes = diffs
 
-        # add alias and parameter names to mapping before creating sql
+        # add alias and parameter names to mapping before creating executors
         aliased_mapping = AliasEnricher().enrich(mapping)
 
-        # create sql for each diff
-        insert_sql = list(InsertSqlCreator().create_executors(aliased_mapping, inserts, context))
-        update_sql = list(UpdateSqlCreator().create_executors(aliased_mapping, updates, context))
-        delete_sql = list(DeleteSqlCreator().create_executors(aliased_mapping, deletes, context))
+        # select a backend for the inserted, updated and deleted rows: SQL by row, SQL in batches, COPY or ORM
+        selector = BackendSelector(backend, batch_size, copy, orm)
 
-        return insert_sql + update_sql + delete_sql
+        # look up the ids of references for all inserted and updated rows up front, instead of joining in the statement of each row.
+        # Look up external ids in the cache, if one is given
+        reference_resolver = ReferenceResolver(loaded_tables, external_ids=external_ids) if prefetch else None
 
-    def _orm_executor(self, mapping, diffs, context, orm):
+        executors = []
+        for operation_type, df in [(OperationType.INSERT, inserts), (OperationType.UPDATE, updates), (OperationType.DELETE, deletes)]:
+            name = selector.select(aliased_mapping, operation_type, len(df))
 
-        # get from tuple
-        inserts, updates, deletes = diffs
+            # keep the selected backend per table and operation for the report, skip operations without rows
+            if backends is not None and len(df):
+                backends.setdefault(mapping.name, {})[operation_type.value.lower()] = name
 
-        # add alias and parameter names to mapping before creating sql
-        aliased_mapping = AliasEnricher().enrich(mapping)
+            creator = selector.create_creator(name, operation_type)
+
+            # the ORM writes references itself, and deletes don't set references
+            if reference_resolver is not None and name != OrmBackend.name and operation_type != OperationType.DELETE:
+                creator.reference_resolver = reference_resolver
+
+            # create executors for each diff
+            executors.extend(creator.create_executors(aliased_mapping, df, context, orm))
 
-        # create sql for each diff
-        insert_orm = list(InsertOrmCreator().create_executors(aliased_mapping, inserts, context, orm))
-        update_orm = list(UpdateOrmCreator().create_executors(aliased_mapping, updates, context, orm))
-        delete_orm = list(DeleteOrmCreator().create_executors(aliased_mapping, deletes, context, orm))
+        return executors
 
-        return insert_orm + update_orm + delete_orm
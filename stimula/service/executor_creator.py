@@ -24,9 +24,9 @@ import numpy
 import pandas as pd
 from psycopg2._json import Json
 
-from .query_executor import FailedQueryExecutor
+from .query_executor import FailedQueryExecutor, OperationType
 from ..stml.header_renderer import HeaderRenderer
-from ..stml.model import Entity
+from ..stml.model import Entity, Attribute, Reference
 from ..stml.sql.parameter_types_renderer import ParameterTypesRenderer
 from ..stml.sql.parameters_renderer import ParametersRenderer
 from ..stml.values_parser import ValuesLexer, ValuesParser
@@ -38,9 +38,16 @@ class ExecutorCreator(ABC):
         self._values_lexer = ValuesLexer()
         self._values_parser = ValuesParser()
         self.operation_type = None
+        # looks up the ids of references for all rows up front, if set
+        self.reference_resolver = None
 
     def create_executors(self, mapping, diffs, context=None, orm=None):
 
+        if self.reference_resolver is not None:
+            # resolve references of all rows before creating executors
+            yield from self._create_executors_with_resolved_references(mapping, diffs, context, orm)
+            return
+
         # iterate rows in diff
         for i in range(len(diffs)):
             row = diffs.iloc[i]
@@ -57,12 +64,56 @@ class ExecutorCreator(ABC):
                 # yield query with line number and error message
                 yield FailedQueryExecutor(line_number, self.operation_type, mapping.name, context, str(e))
 
+    def _create_executors_with_resolved_references(self, mapping, diffs, context=None, orm=None):
+        # prepare mapping and values of all rows first, so that references can be looked up with a query per reference
+        rows = []
+        for i in range(len(diffs)):
+            row = diffs.iloc[i]
+
+            # return line number, depends on operation type
+            line_number = self._get_line_number(row)
+
+            try:
+                rows.append((line_number, *self._prepare_mapping_and_values(mapping, row), None))
+            except Exception as e:
+                # keep error message, to yield in order of the rows
+                rows.append((line_number, None, None, str(e)))
+
+        # look up ids of the references of all prepared rows
+        self.reference_resolver.resolve(mapping, [(filtered_mapping, value_dict) for _, filtered_mapping, value_dict, error in rows if error is None])
+
+        for line_number, filtered_mapping, value_dict, error in rows:
+            try:
+                # raise error if row could not be prepared
+                if error is not None:
+                    raise ValueError(error)
+
+                # replace references by their ids, raises an error if a reference was not found
+                resolved_mapping, resolved_value_dict = self.reference_resolver.substitute(filtered_mapping, value_dict)
+
+                # create and yield executor
+                yield self._create_executor_and_dependencies(line_number, resolved_mapping, resolved_value_dict, context, orm)
+
+            except Exception as e:
+
+                # yield query with line number and error message
+                yield FailedQueryExecutor(line_number, self.operation_type, mapping.name, context, str(e))
+
     def _prepare_and_create_executor(self, mapping, row, line_number, context=None, orm=None):
         # prepare mapping and values for row
         filtered_mapping, value_dict = self._prepare_mapping_and_values(mapping, row)
 
-        # create and return executor
-        return self._create_executor(line_number, filtered_mapping, value_dict, context, orm)
+        # create executor, with the keys and references it depends on
+        return self._create_executor_and_dependencies(line_number, filtered_mapping, value_dict, context, orm)
+
+    def _create_executor_and_dependencies(self, line_number, filtered_mapping, value_dict, context=None, orm=None):
+        # create executor
+        executor = self._create_executor(line_number, filtered_mapping, value_dict, context, orm)
+
+        # set keys and references, so that rows can be executed in dependency order
+        executor.keys, executor.references = self._create_dependencies(filtered_mapping, value_dict)
+
+        return executor
 
     def _prepare_mapping_and_values(self, mapping, row):
         # Create a dictionary with unique column headers as keys and values as values. We'll need these for all query types.
@@ -97,6 +148,57 @@ class ExecutorCreator(ABC):
 
         return filtered_mapping, value_dict_clean
 
+    def _create_dependencies(self, mapping, value_dict):
+        # deleted rows don't provide values to other rows
+        if self.operation_type == OperationType.DELETE:
+            return [], []
+
+        # the row provides the values of its own attributes
+        key_values = {a.name: value_dict[a.parameter] for a in mapping.attributes if isinstance(a, Attribute) and self._is_key_value(value_dict.get(a.parameter))}
+        keys = [(mapping.name, key_values)] if key_values else []
+
+        # the row references values in the target table
+        references = []
+        for reference in mapping.attributes:
+            # an extension on the root table is the external id of the row itself, not a reference
+            if not isinstance(reference, Reference) or reference.extension:
+                continue
+
+            # nested references, like those to an extension, don't identify a row by values in the target table, so the row may reference any row of their tables
+            if not all(isinstance(a, Attribute) for a in reference.attributes):
+                if any(self._is_key_value(value_dict.get(parameter)) for parameter in self._reference_parameters(reference)):
+                    references.extend((table, None, None) for table in self._reference_tables(reference))
+                continue
+
+            values = tuple(value_dict.get(a.parameter) for a in reference.attributes)
+
+            # skip references without values
+            if not all(self._is_key_value(value) for value in values):
+                continue
+
+            references.append((reference.table, tuple(a.name for a in reference.attributes), values))
+
+        return keys, references
+
+    def _reference_parameters(self, reference):
+        # parameter names of the attributes of a reference and its nested references
+        for attribute in reference.attributes:
+            if isinstance(attribute, Reference):
+                yield from self._reference_parameters(attribute)
+            else:
+                yield attribute.parameter
+
+    def _reference_tables(self, reference):
+        # table of a reference, and the tables of its nested references
+        yield reference.table
+        for attribute in reference.attributes:
+            if isinstance(attribute, Reference):
+                yield from self._reference_tables(attribute)
+
+    def _is_key_value(self, value):
+        # only non-empty scalar values can identify a row
+        return isinstance(value, (str, int, float)) and not self._is_empty(value)
+
     def _create_unique_value_dict(self, mapping, row):
         # get unique column headers
         unique_headers = HeaderRenderer().render_list_unique(mapping)
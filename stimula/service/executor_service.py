@@ -8,43 +8,153 @@ Email: romke@stml.io
 import logging
 
 from stimula.service.context import cnx_context
-from stimula.service.query_executor import OperationType
+from stimula.service.dependency_sorter import DependencySorter
+from stimula.service.parallel_executor import ParallelExecutor
+from stimula.service.pipeline_executor import PipelineExecutor
+from stimula.service.query_executor import OperationType, BatchQueryExecutor, GroupQueryExecutor, SimpleQueryExecutor, DependentQueryExecutor, GroupDependentQueryExecutor, NO_ROW_AFFECTED
+from stimula.service.statement_cache import StatementCache, PreparedStatementCursor
+from stimula.service.transaction_sizer import TransactionSizer
 
 _logger = logging.getLogger(__name__)
 
+# SQLSTATE codes of failures that other rows may fix by succeeding. A foreign key violation is fixed by inserting the referenced row, or by
+# deleting the referencing row first. A not null violation is what an insert gets if a referenced row can't be found yet. A unique or
+# exclusion violation is fixed by another row that changes or deletes the conflicting value, like when two rows swap values
+RETRYABLE_SQLSTATES = {
+    # foreign_key_violation
+    '23503',
+    # not_null_violation
+    '23502',
+    # unique_violation
+    '23505',
+    # exclusion_violation
+    '23P01',
+}
+
 
 class ExecutorService:
-    def execute_sql(self, query_executors, execute, commit, tx_size=1000):
+    def __init__(self):
+        # number of retry rounds and number of rows executed in those rounds, for the report
+        self.retry_statistics = {'rounds': 0, 'rows': 0}
+        # number and sizes of transactions, for the report, if the transaction size is adaptive
+        self.transaction_statistics = None
+        # journal of committed rows, to resume an interrupted load
+        self._journal = None
+        # results of the current transaction, to write to the journal when it's committed
+        self._uncommitted = []
+
+    def execute_sql(self, query_executors, execute, commit, tx_size=1000, savepoint_size=None, dependency_order=False, prepare=False, group_size=None, pipeline_size=None,
+                    parallel_size=None, journal=None, external_ids=None):
         if not execute:
-            # fake execution, return result
-            return [qe.fake_execute() for qe in query_executors]
+            # fake execution, return result. Report batches by row, as if they were not batched
+            return [qe.fake_execute() for qe in self._expand_batches(query_executors)]
+
+        if isinstance(tx_size, TransactionSizer):
+            # start measuring the first transaction
+            tx_size.begin()
+
+        # write committed rows to the journal, if any
+        self._journal = journal
+
+        if parallel_size:
+            # execute partitions concurrently over several connections, and commit them with a two phase commit
+            assert not pipeline_size, 'Parallel execution can not be combined with pipeline mode'
+            with ParallelExecutor(parallel_size) as parallel_executor:
+                result = self._execute_parallel(query_executors, commit, savepoint_size, dependency_order, prepare, group_size, parallel_executor)
+        elif pipeline_size:
+            # send row statements over a psycopg 3 connection in pipeline mode, instead of waiting for the reply to each statement
+            with PipelineExecutor(pipeline_size) as pipeline_executor:
+                result = self._execute_sql(query_executors, commit, tx_size, savepoint_size, dependency_order, prepare, group_size, pipeline_executor)
+        else:
+            result = self._execute_sql(query_executors, commit, tx_size, savepoint_size, dependency_order, prepare, group_size)
+
+        if external_ids is not None:
+            # external ids that were inserted or deleted must be read again from the cache of this load
+            external_ids.invalidate_results(result)
+
+        if isinstance(tx_size, TransactionSizer):
+            # report the transaction sizes that were chosen
+            self.transaction_statistics = tx_size.statistics()
+
+        return result
 
+    def _execute_sql(self, query_executors, commit, tx_size, savepoint_size, dependency_order, prepare, group_size, pipeline_executor=None):
         # get cursor from context
         cr = cnx_context.cr
 
+        if prepare:
+            # execute recurring queries as prepared statements
+            statement_cache = StatementCache.get()
+            cr = PreparedStatementCursor(cr, statement_cache)
+
+        # executors to retry if they fail, default is to retry all
+        retry = None
+
+        if dependency_order:
+            # execute rows after the rows they reference, so they succeed in a single pass. Only retry rows that are in a cycle, or that may reference any row of a table
+            query_executors, retry = DependencySorter().sort(query_executors)
+
+        if group_size:
+            # execute consecutive executors with the same query in a single statement
+            query_executors = list(self._group_statements(query_executors, group_size))
+
         # execute queries, rerun until exhausted
-        result = self._eat_sleep_repeat(query_executors, cr, commit, tx_size)
+        result = self._eat_sleep_repeat(query_executors, cr, commit, tx_size, savepoint_size, retry, pipeline_executor)
+
+        if prepare:
+            _logger.info(f'Prepared statement cache: {statement_cache.hits} hits, {statement_cache.misses} misses')
 
         # commit if requested
         if commit:
-
-            # registry may not be available during unit tests
-            if hasattr(cnx_context, 'registry'):
-                # registry may not have clear_cache() method
-                if hasattr(cnx_context.registry, 'clear_cache'):
-                    # invalidate caches to avoid stale values coming from cache
-                    cnx_context.registry.clear_cache()
-                else:
-                    _logger.warning("Registry has no clear_cache() method")
+            self._clear_registry_cache()
 
         return result
 
-    def _eat_sleep_repeat(self, query_executors, cr, commit, tx_size):
+    def _execute_parallel(self, query_executors, commit, savepoint_size, dependency_order, prepare, group_size, parallel_executor):
+        # executor service per partition, so that partitions don't share retry statistics
+        services = []
+
+        def execute_partition(executors):
+            # execute in a single transaction, the parallel executor commits all partitions at once
+            service = ExecutorService()
+            services.append(service)
+            return service._execute_sql(executors, False, float('inf'), savepoint_size, dependency_order, prepare, group_size)
+
+        results = parallel_executor.execute(query_executors, execute_partition, commit)
+
+        if commit and self._journal:
+            # all partitions were committed at once, so write them to the journal as a single chunk
+            self._journal.record([result for partition_results in results for result in partition_results if result.success])
+
+        # add up retry statistics of all partitions
+        for service in services:
+            self.retry_statistics['rounds'] += service.retry_statistics['rounds']
+            self.retry_statistics['rows'] += service.retry_statistics['rows']
+
+        if commit:
+            self._clear_registry_cache()
+
+        # report inserts and updates by line number, then deletes, like a single connection does
+        return self._sort_results([result for partition_results in results for result in partition_results])
+
+    def _clear_registry_cache(self):
+        # registry may not be available during unit tests
+        if hasattr(cnx_context, 'registry'):
+            # registry may not have clear_cache() method
+            if hasattr(cnx_context.registry, 'clear_cache'):
+                # invalidate caches to avoid stale values coming from cache
+                cnx_context.registry.clear_cache()
+            else:
+                _logger.warning("Registry has no clear_cache() method")
+
+    def _eat_sleep_repeat(self, query_executors, cr, commit, tx_size, savepoint_size=None, retry=None, pipeline_executor=None):
         # execute in rounds until no new successful queries are found
 
         # create result lists
         completed = []
         failed = []
+        # failed results of executors that are not retried
+        final_failed = []
 
         # copy query executors list
         remaining = query_executors.copy()
@@ -53,53 +163,121 @@ class ExecutorService:
         tx_count = 0
 
         while not done:
-            new_completed_executors = []
             new_completed_results = []
-            # iterate query executors
-            for query_executor in remaining:
-                # create or replace savepoint
-                self.create_savepoint()
-                # delegate execution to query executor
-                execution_result = query_executor.execute(cr)
-                # if successful
-                if execution_result.success:
-                    # append result to list
-                    new_completed_results.append(execution_result)
-                    # remove from remaining
-                    new_completed_executors.append(query_executor)
-                    # increment tx count
-                    tx_count += 1
-                    if tx_count >= tx_size:
-                        # commit transaction
-                        if commit:
-                            cnx_context.cnx.commit()
-                        else:
-                            # rollback all queries
-                            cnx_context.cnx.rollback()
-                        # reset tx count
-                        tx_count = 0
+            # executors to retry in the next round
+            new_remaining = []
+            # iterate query executors, grouped to execute under a single savepoint
+            for executors in self._savepoint_groups(remaining, savepoint_size, pipeline_executor.size if pipeline_executor else None):
+                if isinstance(executors[0], BatchQueryExecutor):
+                    query_executor = executors[0]
+                    # create or replace savepoint
+                    self.create_savepoint()
+                    # execute all rows of the batch in a single query
+                    execution_result = query_executor.execute(cr)
+                    # if successful, report per row and continue with the next executor
+                    if execution_result.success:
+                        row_results = query_executor.row_results()
+                        completed_results = [result for result in row_results if result.success]
+                        new_completed_results.extend(completed_results)
+                        tx_count = self._count_and_commit(tx_count, completed_results, commit, tx_size)
+                        # rows of a group that affected no row may depend on rows earlier in the group, so execute them by row
+                        executors = [executor for executor, result in zip(query_executor.executors, row_results) if not result.success]
+                        if not executors:
+                            continue
+                    else:
+                        # rollback to savepoint, and fall back to executing rows
+                        self.rollback_to_savepoint()
+                        executors = query_executor.executors
+
+                    if savepoint_size and not execution_result.success:
+                        # the batch as a whole failed, so start by bisecting it
+                        completed_results, failed_results, failed_executors = self._bisect_halves(executors, cr)
+                        new_completed_results.extend(completed_results)
+                        tx_count = self._count_and_commit(tx_count, completed_results, commit, tx_size)
+                        failed.extend(failed_results)
+                        new_remaining.extend(failed_executors)
+                        continue
+
+                if pipeline_executor and type(executors[0]) is SimpleQueryExecutor:
+                    # send the rows in pipeline mode, each row still runs under its own savepoint
+                    execution_results = pipeline_executor.execute(executors)
+                    completed_results = [result for result in execution_results if result.success]
+                    new_completed_results.extend(completed_results)
+                    # increment tx count, commit if needed. All rows were executed, so count them together
+                    tx_count = self._count_and_commit(tx_count, completed_results, commit, tx_size)
+                    failed.extend(result for result in execution_results if not result.success)
+                    # retry failed row executors in next round
+                    new_remaining.extend(executor for executor, result in zip(executors, execution_results) if not result.success)
+                    continue
+
+                if savepoint_size:
+                    # execute group under a single savepoint, bisect to isolate failing rows
+                    completed_results, failed_results, failed_executors = self._bisect(executors, cr)
+                    new_completed_results.extend(completed_results)
+                    # increment tx count, commit if needed. There's no open savepoint after bisecting, so it's safe to commit
+                    tx_count = self._count_and_commit(tx_count, completed_results, commit, tx_size)
+                    failed.extend(failed_results)
+                    # retry failed row executors in next round
+                    new_remaining.extend(failed_executors)
+                    continue
+
+                for row_executor in executors:
+                    # create or replace savepoint
+                    self.create_savepoint()
+                    # delegate execution to query executor
+                    execution_result = row_executor.execute(cr)
+                    # if successful
+                    if execution_result.success:
+                        # append result to list
+                        new_completed_results.append(execution_result)
+                        # increment tx count, commit if needed
+                        tx_count = self._count_and_commit(tx_count, [execution_result], commit, tx_size)
+                    else:
+                        # rollback to savepoint
+                        self.rollback_to_savepoint()
+                        # append to failed list
+                        failed.append(execution_result)
+                        # retry row executor in next round
+                        new_remaining.append(row_executor)
+            # split failures in those that other rows may fix, and those that fail the same way in every round
+            retried_executors = []
+            retried_results = []
+            for executor, result in zip(new_remaining, failed):
+                # with dependency order, only executors in a cycle are retried, the retry set makes this a constant time lookup
+                if self._is_retryable(result) and (retry is None or executor in retry):
+                    retried_executors.append(executor)
+                    retried_results.append(result)
                 else:
-                    # rollback to savepoint
-                    self.rollback_to_savepoint()
-                    # append to failed list
-                    failed.append(execution_result)
-            if new_completed_results:
-                # append new completed to completed list
-                completed.extend(new_completed_results)
-                # remove completed executors from remaining
-                remaining = [qe for qe in remaining if qe not in new_completed_executors]
+                    final_failed.append(result)
+
+            # append new completed to completed list
+            completed.extend(new_completed_results)
+
+            if new_completed_results and retried_executors:
+                # continue with failed executors that may still succeed
+                remaining = retried_executors
                 # reset failed list and start again
                 failed = []
+                # count retry round and retried rows
+                self.retry_statistics['rounds'] += 1
+                self.retry_statistics['rows'] += len(remaining)
             else:
-                # nothing new completed, we're done
+                # nothing new completed, or nothing left to retry, we're done
+                failed = retried_results
                 done = True
                 # commit if transactions remain
                 if tx_count > 0 and commit:
-                    cnx_context.cnx.commit()
+                    if isinstance(tx_size, TransactionSizer):
+                        # measure the last transaction as well, for the report
+                        tx_size.commit(cnx_context.cnx.commit, tx_count)
+                    else:
+                        cnx_context.cnx.commit()
+                    self._record_committed()
 
         # combine completed and failed lists
-        all_results = completed + failed
+        return self._sort_results(completed + final_failed + failed)
 
+    def _sort_results(self, all_results):
         # set delete queries apart, because they don't have line numbers
         deleted = [result for result in all_results if result.operation_type == OperationType.DELETE]
         insert_and_updates = [result for result in all_results if result.operation_type != OperationType.DELETE]
@@ -110,6 +288,178 @@ class ExecutorService:
         # append deleted to the end
         return insert_and_updates + deleted
 
+    def _is_retryable(self, result):
+        # a row that affected no row may reference a row that is inserted later
+        if result.sqlstate is None:
+            return result.error is None or result.error.startswith(NO_ROW_AFFECTED)
+
+        # a database error is only retried if other rows may fix it
+        return result.sqlstate in RETRYABLE_SQLSTATES
+
+    def _group_statements(self, query_executors, group_size):
+        # group runs of executors with the same queries, up to group size
+        group = []
+        for query_executor in query_executors:
+            key = self._group_key(query_executor)
+
+            # yield group if the query changes
+            if group and not (key is not None and key == self._group_key(group[0]) and len(group) < group_size):
+                yield from self._create_group(group)
+                group = []
+
+            if key is not None:
+                group.append(query_executor)
+            else:
+                yield query_executor
+
+        if group:
+            yield from self._create_group(group)
+
+    def _group_key(self, query_executor):
+        # a simple query with a returning clause can't return the row index
+        if type(query_executor) is SimpleQueryExecutor and ' returning ' not in query_executor.query:
+            return SimpleQueryExecutor, query_executor.query
+
+        # dependent queries are grouped if both the initial and the dependent query are the same
+        if type(query_executor) is DependentQueryExecutor:
+            return DependentQueryExecutor, query_executor.query, query_executor.dependent_query[0]
+
+        # other executors can't be grouped
+        return None
+
+    def _create_group(self, executors):
+        # a single executor doesn't need a group
+        if len(executors) == 1:
+            return executors
+
+        if isinstance(executors[0], DependentQueryExecutor):
+            return [GroupDependentQueryExecutor(executors[0].operation_type, executors[0].table_name, executors, executors[0].context)]
+
+        return [GroupQueryExecutor(executors[0].operation_type, executors[0].table_name, executors, executors[0].context)]
+
+    def _savepoint_groups(self, query_executors, savepoint_size, pipeline_size=None):
+        if not savepoint_size and pipeline_size:
+            # in pipeline mode, send consecutive simple executors together
+            yield from self._pipeline_groups(query_executors, pipeline_size)
+            return
+
+        # without savepoint size, execute each executor under its own savepoint
+        if not savepoint_size:
+            for query_executor in query_executors:
+                yield [query_executor]
+            return
+
+        # group consecutive executors, but keep batches apart because they already run in a single query
+        group = []
+        for query_executor in query_executors:
+            if isinstance(query_executor, BatchQueryExecutor):
+                if group:
+                    yield group
+                    group = []
+                yield [query_executor]
+                continue
+
+            group.append(query_executor)
+            if len(group) >= savepoint_size:
+                yield group
+                group = []
+
+        if group:
+            yield group
+
+    def _pipeline_groups(self, query_executors, pipeline_size):
+        # group consecutive simple executors up to pipeline size, other executors are executed by themselves
+        group = []
+        for query_executor in query_executors:
+            if type(query_executor) is not SimpleQueryExecutor:
+                if group:
+                    yield group
+                    group = []
+                yield [query_executor]
+                continue
+
+            group.append(query_executor)
+            if len(group) >= pipeline_size:
+                yield group
+                group = []
+
+        if group:
+            yield group
+
+    def _bisect(self, executors, cr):
+        # execute executors under a single savepoint. Returns completed results, failed results and failed executors
+        self.create_savepoint()
+
+        results = []
+        for executor in executors:
+            execution_result = executor.execute(cr)
+            results.append(execution_result)
+            # stop at the first failure, the transaction may be aborted anyway
+            if not execution_result.success:
+                break
+        else:
+            # all executors succeeded, release savepoint to keep the savepoint stack shallow
+            self.release_savepoint()
+            return results, [], []
+
+        # undo the executors that ran before the failure
+        self.rollback_to_savepoint()
+        self.release_savepoint()
+
+        # a single executor failed, report it
+        if len(executors) == 1:
+            return [], results, executors
+
+        # isolate failing rows by executing each half under its own savepoint
+        return self._bisect_halves(executors, cr)
+
+    def _bisect_halves(self, executors, cr):
+        # split executors in two halves and bisect each
+        middle = len(executors) // 2
+        left = self._bisect(executors[:middle], cr)
+        right = self._bisect(executors[middle:], cr)
+
+        # combine results, keeping the order of the executors
+        return left[0] + right[0], left[1] + right[1], left[2] + right[2]
+
+    def _count_and_commit(self, tx_count, results, commit, tx_size):
+        # increment tx count
+        tx_count += len(results)
+        self._uncommitted.extend(results)
+
+        # an adaptive transaction size changes after each transaction
+        adaptive = isinstance(tx_size, TransactionSizer)
+        if tx_count >= (tx_size.size if adaptive else tx_size):
+            # commit transaction, or rollback all queries
+            end_transaction = cnx_context.cnx.commit if commit else cnx_context.cnx.rollback
+            if adaptive:
+                # measure the transaction to size the next one
+                tx_size.commit(end_transaction, tx_count)
+            else:
+                end_transaction()
+            if commit:
+                # the rows of this transaction are durable now
+                self._record_committed()
+            else:
+                self._uncommitted = []
+            # reset tx count
+            tx_count = 0
+        return tx_count
+
+    def _record_committed(self):
+        # write the rows of the committed transaction to the journal
+        if self._journal:
+            self._journal.record(self._uncommitted)
+        self._uncommitted = []
+
+    def _expand_batches(self, query_executors):
+        # replace batches by their row executors
+        for query_executor in query_executors:
+            if isinstance(query_executor, BatchQueryExecutor):
+                yield from query_executor.executors
+            else:
+                yield query_executor
+
     def create_savepoint(self):
         # create savepoint
         cnx_context.cr.execute("SAVEPOINT stimula_savepoint")
@@ -117,3 +467,7 @@ class ExecutorService:
     def rollback_to_savepoint(self):
         # rollback to savepoint
         cnx_context.cr.execute("ROLLBACK TO SAVEPOINT stimula_savepoint")
+
+    def release_savepoint(self):
+        # release savepoint
+        cnx_context.cr.execute("RELEASE SAVEPOINT stimula_savepoint")
@@ -0,0 +1,108 @@
+"""
+This class caches the external ids of the Odoo ir_model_data table per module and model, so that they're read with one query per load.
+
+Mappings refer to records by external id, like 'authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite])'.
+Without a cache, each reference lookup and each diff read joins the ir_model_data table, which is one of the largest tables in Odoo.
+The cache reads the name and res_id of all external ids of a module and model once, and keeps them in a dictionary in both directions.
+
+A cache is created for each load, so that each load sees the external ids that other sessions inserted or deleted in the meantime.
+External ids that the load itself inserts or deletes are invalidated after execution.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import logging
+
+from .context import cnx_context
+from ..stml.model import Attribute, Reference
+from ..stml.sql.select_renderer import SelectRenderer
+
+_logger = logging.getLogger(__name__)
+
+# table and column names of Odoo external ids
+EXTERNAL_ID_TABLE = 'ir_model_data'
+EXTERNAL_ID_TARGET_NAME = 'res_id'
+EXTERNAL_ID_NAME = 'name'
+
+
+class ExternalIdCache:
+    def __init__(self):
+        # maps (module, model) to a dictionary of name to res_id
+        self._ids = {}
+        # maps (module, model) to a dictionary of res_id to name, or to None if a res_id has more than one name
+        self._names = {}
+        # number of queries, for logging and testing
+        self.loads = 0
+
+    def ids(self, module, model):
+        # get dictionary of name to res_id, read it on first use
+        self._load(module, model)
+        return self._ids[(module, model)]
+
+    def names(self, module, model):
+        # get dictionary of res_id to name, or None if a record has more than one external id in this module
+        self._load(module, model)
+        return self._names[(module, model)]
+
+    def invalidate(self, module=None, model=None):
+        # remove cached external ids of a module and model, or of all modules or models if not specified
+        for key in [key for key in self._ids if (module is None or key[0] == module) and (model is None or key[1] == model)]:
+            del self._ids[key]
+            del self._names[key]
+
+    def invalidate_results(self, results):
+        # remove cached external ids that were inserted or deleted by successful queries
+        for result in results:
+            for r in [result, result.dependent_execution_result]:
+                if r is not None and r.success and r.query and EXTERNAL_ID_TABLE in r.query:
+                    # module and model are parameters of the extension queries, invalidate everything if they're not
+                    params = r.params or {}
+                    self.invalidate(params.get('module'), params.get('model'))
+
+    def _load(self, module, model):
+        if (module, model) in self._ids:
+            return
+
+        # read all external ids of this module and model in a single query
+        cr = cnx_context.cr
+        cr.execute(f'select {EXTERNAL_ID_NAME}, {EXTERNAL_ID_TARGET_NAME} from {EXTERNAL_ID_TABLE} where module = %s and model = %s', (module, model))
+        rows = cr.fetchall()
+        self.loads += 1
+        _logger.info(f'Read {len(rows)} external ids of module {module} and model {model}')
+
+        self._ids[(module, model)] = {name: res_id for name, res_id in rows}
+
+        # the reverse map is only usable if each record has a single name, like a join would return a single row
+        names = {res_id: name for name, res_id in rows}
+        self._names[(module, model)] = names if len(names) == len(rows) else None
+
+
+def external_id_reference(reference, alias):
+    """
+    Returns module and model if a reference reads a record's external id from the ir_model_data table, or None otherwise.
+
+    root extension:   'bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite]' on table books
+    nested extension: 'authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite])' on table books
+
+    In both cases, the name is the external id of the id in the column of the root table, so the cache can map one to the other.
+    """
+    if not isinstance(reference, Reference) or reference.key:
+        return None
+
+    # a nested extension must join on the column that the reference refers to
+    if not reference.extension:
+        if len(reference.attributes) != 1 or not isinstance(reference.attributes[0], Reference) or reference.attributes[0].name != reference.target_name:
+            return None
+        return external_id_reference(reference.attributes[0], reference.alias or reference.table)
+
+    # only a single name of an Odoo style external id, without filters
+    if reference.table != EXTERNAL_ID_TABLE or reference.target_name != EXTERNAL_ID_TARGET_NAME or not reference.qualifier:
+        return None
+    if len(reference.attributes) != 1 or not isinstance(reference.attributes[0], Attribute):
+        return None
+    name = reference.attributes[0]
+    if name.name != EXTERNAL_ID_NAME or name.key or name.filter:
+        return None
+
+    # model name is derived from the alias, like the join clause does
+    return reference.qualifier, SelectRenderer().get_model_name(alias)
@@ -0,0 +1,100 @@
+"""
+This class reads a table in chunks, in the order of its unique columns, and pairs each chunk with the request lines of the same keys.
+
+Reading the full table into pandas takes memory in the size of the table. Instead, the select query of the mapping is read through a
+server side cursor, ordered by the unique columns, a chunk at a time. The request is sorted the same way. The last key of a chunk bounds
+the request lines that can match it: request lines up to that key are either in this chunk or not in the table. Comparing each pair
+produces the same diff as comparing the full table, while only one chunk of the table is in memory.
+
+The database must order keys the same way as python does. Integer keys are ordered as numbers, text keys by code point, using the "C"
+collation. If the unique columns are of another type, or the request has empty keys, the full table is read as a single chunk.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+from bisect import bisect_right
+
+import pandas as pd
+
+from .context import cnx_context
+from .db_reader import DbReader
+from ..stml.alias_enricher import AliasEnricher
+from ..stml.sql.select_renderer import SelectRenderer, SelectClauseRenderer
+
+# number of table rows to read at a time
+MERGE_CHUNK_SIZE = 10000
+
+# name of the server side cursor that reads the table
+MERGE_CURSOR = 'stimula_merge'
+
+
+class MergeReader:
+    def __init__(self, chunk_size=MERGE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def read_chunks(self, mapping, df_request, where_clause):
+        """
+        Yields pairs of request lines and database rows that must be compared to find inserts, updates and deletes
+        :param mapping: the mapping
+        :param df_request: the request as read by CsvReader, indexed by unique columns
+        :param where_clause: a free where clause to select database rows
+        :return: generator of tuples of request lines and database rows, indexed by unique columns
+        """
+
+        # get position and type of the unique columns, to order the table like the request
+        key_types = DbReader().key_types(mapping)
+
+        # without keys that order the same way on both sides, compare the full table at once
+        if key_types is None or any(self._is_empty(key) for key in df_request.index):
+            yield df_request, DbReader().read_from_db(mapping, where_clause, set_index=True)
+            return
+
+        # sort request by unique columns, and get the key of each line as a tuple to search the bound of each chunk
+        df_request = df_request.sort_index()
+        keys = [self._key(key) for key in df_request.index]
+
+        start = 0
+        df_db = None
+        for df_db in self._read_table(mapping, where_clause, key_types):
+            # the last key of the chunk bounds the request lines that can match it. Skip keys with empty values, they can't match a request line
+            bound = next((self._key(key) for key in reversed(df_db.index) if not self._is_empty(key)), None)
+            end = bisect_right(keys, bound, lo=start) if bound is not None else start
+
+            yield df_request.iloc[start:end], df_db
+            start = end
+
+        # request lines beyond the last key of the table are not in the table
+        if start < len(keys):
+            yield df_request.iloc[start:], df_db.iloc[0:0]
+
+    def _read_table(self, mapping, where_clause, key_types):
+        # add aliases and parameter names
+        aliased_mapping = AliasEnricher().enrich(mapping)
+
+        # order integer columns as numbers and other columns as text by code point, like python sorts them
+        columns = SelectClauseRenderer().render_columns(aliased_mapping)
+        order_by = ', '.join(columns[position] if key_type == 'integer' else f'cast({columns[position]} as text) collate "C"' for position, key_type in key_types)
+        query = SelectRenderer().render(aliased_mapping, where_clause, order_by)
+
+        # read the rows of the query a chunk at a time through a server side cursor
+        with cnx_context.cnx.cursor(name=MERGE_CURSOR) as cr:
+            cr.execute(query)
+            while True:
+                rows = cr.fetchmany(self.chunk_size)
+
+                # use coerce_float like read_sql_query does, to read numeric as float
+                df_db = pd.DataFrame.from_records(rows, columns=[f'c{i}' for i in range(len(cr.description))], coerce_float=True)
+
+                # set headers and convert values, like when reading the full table. Always yield a chunk, so that an empty table has columns
+                yield DbReader().convert(mapping, df_db, set_index=True)
+
+                if len(rows) < self.chunk_size:
+                    break
+
+    def _key(self, key):
+        # keys of a single unique column are values, keys of multiple unique columns are tuples
+        return key if isinstance(key, tuple) else (key,)
+
+    def _is_empty(self, key):
+        # true if any value of the key is empty
+        return any(pd.isna(value) for value in self._key(key))
@@ -27,5 +27,9 @@ class ModelService(ABC):
         pass
 
     @abstractmethod
-    def read_table(self, mapping: dict, where_clause=None):
+    def read_table(self, mapping: dict, where_clause=None, key_filter=None):
         pass
+
+    def estimate_row_count(self, table_name):
+        # number of rows of a table, or None if unknown
+        return None
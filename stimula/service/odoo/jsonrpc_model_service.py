@@ -44,7 +44,8 @@ class JsonRpcModelService(ModelService):
     def get_non_empty_columns(self, table):
         return []
 
-    def read_table(self, mapping: Entity, where_clause=None):
+    def read_table(self, mapping: Entity, where_clause=None, key_filter=None):
+        # the key filter is not supported, so all records are read
         # get model name
         model = mapping.name
 
@@ -10,7 +10,7 @@ from sqlalchemy import select, func
 from stimula.service.context import cnx_context, get_metadata
 from stimula.service.model_service import ModelService
 from stimula.stml.alias_enricher import AliasEnricher
-from stimula.stml.sql.select_renderer import SelectRenderer
+from stimula.stml.sql.select_renderer import SelectRenderer, SelectClauseRenderer
 
 
 class PostgresModelService(ModelService):
@@ -48,6 +48,21 @@ class PostgresModelService(ModelService):
         foreign_column_name = foreign_key.column.name
         return foreign_table, foreign_column_name
 
+    def sort_tables(self, table_names):
+        # order table names so that tables come after the tables they reference. Tables in a cycle keep their order
+        referenced = {name: {fk.column.table.name for fk in self.get_table(name).foreign_keys} - {name} for name in table_names}
+
+        result = []
+        remaining = list(table_names)
+        while remaining:
+            # take the first table that references no remaining table, or the first table if all are in a cycle
+            ready = [name for name in remaining if not referenced[name] & set(remaining)]
+            name = ready[0] if ready else remaining[0]
+            result.append(name)
+            remaining.remove(name)
+
+        return result
+
     def get_non_empty_columns(self, table):
         # create list of column names
         column_names = [c.name for c in table.columns]
@@ -62,19 +77,45 @@ class PostgresModelService(ModelService):
         # return list
         return result
 
-    def read_table(self, mapping: dict, where_clause=None):
+    def read_table(self, mapping: dict, where_clause=None, key_filter=None):
         # get sqlalchemy engine from context
         engine = cnx_context.engine
 
         # create select query
-        query = self._create_select_query(mapping, where_clause)
+        query = self._create_select_query(mapping, where_clause, key_filter)
 
         # read dataframe from DB
         return pd.read_sql_query(query, engine)
 
-    def _create_select_query(self, mapping, where_clause):
+    def estimate_row_count(self, table_name):
+        # number of rows of a table according to the planner statistics, or None if the table was never analyzed
+        cr = cnx_context.cr
+        cr.execute('select reltuples from pg_class where oid = to_regclass(%s)', (table_name,))
+        row = cr.fetchone()
+        return int(row[0]) if row and row[0] >= 0 else None
+
+    def _create_select_query(self, mapping, where_clause, key_filter=None):
         # add aliases and parameter names
         aliased_mapping = AliasEnricher().enrich(mapping)
 
+        if key_filter:
+            # only select rows whose unique columns have one of the given values
+            key_condition = self._render_key_condition(aliased_mapping, key_filter)
+            where_clause = f'({where_clause}) and {key_condition}' if where_clause else key_condition
+
         # translate syntax tree to select query
         return SelectRenderer().render(aliased_mapping, where_clause)
+
+    def _render_key_condition(self, aliased_mapping, key_filter):
+        # key filter is a list of position, type and values of each unique column. Compare the select expressions, so that the database can use indexes
+        columns = SelectClauseRenderer().render_columns(aliased_mapping)
+        expressions = [f'cast({columns[position]} as {type})' for position, type, _ in key_filter]
+
+        # render values as array literals, so that the query has no parameters
+        cr = cnx_context.cr
+        arrays = [cr.mogrify(f'cast(%s as {type}[])', (list(values),)).decode('utf-8') for _, type, values in key_filter]
+
+        # a single unique column is compared with any value of the array, multiple unique columns with the rows of the unnested arrays
+        if len(key_filter) == 1:
+            return f'{expressions[0]} = any({arrays[0]})'
+        return f'({", ".join(expressions)}) in (select * from unnest({", ".join(arrays)}))'
@@ -0,0 +1,130 @@
+"""
+This class executes query executors concurrently over several connections, and commits them atomically with a two phase commit.
+
+Executing row by row on a single connection uses a single backend process on the database server. The executor opens a number of
+connections with the parameters of the current connection, splits the executors into a partition per connection, and executes the
+partitions in threads. Each thread uses its own connection through the thread local connection context.
+
+Executors that depend on each other, like a row that references a row that is inserted by the same load, are kept in the same
+partition, so that retry rounds still work. Other executors are spread by a hash of their unique key values. Deletes are kept in
+the first partition, because a delete may depend on other deletes through foreign keys that are not part of the mapping. If a load
+has deletes, updates are kept in the first partition as well, because an update may remove the last reference to a deleted row.
+
+Each partition runs in a single transaction. When all partitions are done, each transaction is prepared with PREPARE TRANSACTION
+and then committed with COMMIT PREPARED, so that either all partitions are committed, or none. If a row affected more than one row,
+all partitions are rolled back. This requires max_prepared_transactions to be set on the server.
+
+Rows in different partitions that lock the same row, wait for each other until all partitions are done. A lock timeout turns such a
+wait into a failed row, instead of a wait that never ends.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import logging
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from .context import cnx_context
+from .dependency_sorter import DependencySorter
+from .query_executor import OperationType
+
+_logger = logging.getLogger(__name__)
+
+
+class ParallelExecutor:
+    def __init__(self, size=4, lock_timeout='10s'):
+        assert size > 1, 'Parallel execution requires at least two connections'
+        # number of connections, and of partitions
+        self.size = size
+        # maximum time that a row waits for a lock that a row in another partition holds
+        self.lock_timeout = lock_timeout
+        self.connections = []
+
+    def __enter__(self):
+        # open connections with the parameters of the current connection
+        info = cnx_context.cnx.info
+        for index in range(self.size):
+            cnx = psycopg2.connect(host=info.host, port=info.port, dbname=info.dbname, user=info.user, password=info.password)
+            self.connections.append(cnx)
+
+            # set lock timeout for the session, then start a two phase commit transaction
+            with cnx.cursor() as cr:
+                cr.execute('SET lock_timeout = %s', (self.lock_timeout,))
+            cnx.commit()
+            cnx.tpc_begin(cnx.xid(0, f'stimula_{uuid.uuid4().hex}_{index}', 'stimula'))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # transactions that were not committed or prepared are rolled back when the connection is closed
+        for cnx in self.connections:
+            cnx.close()
+
+    def partition(self, query_executors):
+        # returns a list of executors per connection, executors keep their original order within a partition
+        groups = DependencySorter().components(query_executors)
+
+        # groups with deletes, or with updates in a load with deletes, must be in the first partition
+        has_deletes = any(executor.operation_type == OperationType.DELETE for executor in query_executors)
+        pinned = {group for executor, group in zip(query_executors, groups)
+                  if executor.operation_type == OperationType.DELETE or (has_deletes and executor.operation_type == OperationType.UPDATE)}
+
+        partitions = [[] for _ in range(self.size)]
+        for executor, group in zip(query_executors, groups):
+            if group in pinned:
+                # deletes may depend on each other and on updates through foreign keys, so keep them together
+                index = 0
+            else:
+                # spread groups by the unique key values of their first executor, or by position if there are no key values
+                first = query_executors[group]
+                index = zlib.crc32(repr(first.keys or group).encode('utf-8')) % self.size
+            partitions[index].append(executor)
+
+        return partitions
+
+    def execute(self, query_executors, execute_partition, commit):
+        # execute partitions concurrently, execute_partition executes a list of executors on the current connection
+        partitions = self.partition(query_executors)
+        _logger.info(f'Executing {len(query_executors)} executors in partitions of {", ".join(str(len(p)) for p in partitions)}')
+
+        with ThreadPoolExecutor(self.size) as pool:
+            results = list(pool.map(lambda args: self._execute_partition(*args, execute_partition), zip(self.connections, partitions)))
+
+        # a row that affected more than one row must not be committed, so roll back all partitions
+        blocked = [result for partition_results in results for result in partition_results if result.block_commit]
+        if blocked:
+            self._rollback()
+            raise ValueError(f'More than one row was affected by table {blocked[0].table_name} line {blocked[0].line_number}, rolled back all partitions')
+
+        if commit:
+            self._commit()
+        else:
+            self._rollback()
+
+        return results
+
+    def _execute_partition(self, cnx, executors, execute_partition):
+        # runs in a worker thread, so set the connection of this partition in the thread local context
+        cnx_context.cnx = cnx
+        cnx_context.cr = cnx.cursor()
+        return execute_partition(executors) if executors else []
+
+    def _commit(self):
+        # prepare all transactions first, a transaction that fails to prepare rolls back all partitions
+        try:
+            for cnx in self.connections:
+                cnx.tpc_prepare()
+        except psycopg2.Error:
+            self._rollback()
+            raise
+
+        # commit prepared transactions, they can no longer fail on constraints
+        for cnx in self.connections:
+            cnx.tpc_commit()
+
+    def _rollback(self):
+        # roll back transactions, whether they're prepared or not
+        for cnx in self.connections:
+            cnx.tpc_rollback()
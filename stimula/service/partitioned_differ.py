@@ -0,0 +1,115 @@
+"""
+This class compares a request with the rows of a table in several processes, and creates the executors of the differences.
+
+Comparing and creating executors is pandas and python code that runs on a single core. For large tables, the keys of the request
+and of the table are split into partitions, so that equal keys are in the same partition, and each partition is compared in a
+separate process. Partitions are spread by the code of each key when factorizing the keys of both sides together, so that equal
+keys of different types, like the Int64 keys of the request and the int64 keys of the table, are in the same partition.
+
+Worker processes are forked, so they inherit the request and the table from the parent process instead of receiving a pickled copy.
+Only the executors and the changed rows of each partition are returned to the parent, which orders them by operation and line
+number, like a single process creates them.
+
+Workers don't use the connection of the parent process. Options that read from the database while creating executors, or an ORM,
+are not supported, the caller compares in a single process in that case.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import pandas as pd
+
+from .query_executor import OperationType
+
+# order of the executors of a mapping, like a single process creates them
+OPERATION_ORDER = [OperationType.INSERT, OperationType.UPDATE, OperationType.DELETE]
+
+# dataframes and functions of the current diff, forked worker processes inherit them
+_work = None
+
+
+class PartitionedDiffer:
+    def __init__(self, size=4):
+        assert size > 1, 'Partitioned diff requires at least two processes'
+        # number of processes, and of partitions
+        self.size = size
+
+    @staticmethod
+    def is_supported():
+        # workers inherit the dataframes by forking, other start methods would pickle them
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    def diff(self, df_request, df_db, compare, create_executors, backends=None):
+        """
+        Compares partitions of the request and the table in worker processes, and creates the executors of the differences
+        :param df_request: the request as read by CsvReader, indexed by unique columns
+        :param df_db: the rows of the table, indexed by unique columns
+        :param compare: function that returns the inserts, updates and deletes of a partition of the request and the table
+        :param create_executors: function that returns the executors of the diffs of a partition, and keeps the selected backends
+        :param backends: backend that executes each operation, per table, for the report
+        :return: tuple of the combined diffs and the executors of all partitions
+        """
+        global _work
+
+        # partition of each request line and table row
+        request_partitions, db_partitions = self.partition(df_request.index, df_db.index)
+
+        # set the work before forking, so that the workers don't need to receive it
+        _work = (df_request, df_db, request_partitions, db_partitions, compare, create_executors)
+        try:
+            with ProcessPoolExecutor(self.size, mp_context=multiprocessing.get_context('fork')) as pool:
+                results = list(pool.map(_diff_partition, range(self.size)))
+        finally:
+            _work = None
+
+        # combine backends that the partitions selected
+        if backends is not None:
+            for partition_backends in [result[2] for result in results]:
+                for table_name, operations in partition_backends.items():
+                    backends.setdefault(table_name, {}).update(operations)
+
+        # combine diffs, and order executors by operation and line number. Sorting is stable, so deletes keep the order of their partition
+        diffs = tuple(self._concat(parts) for parts in zip(*[result[0] for result in results]))
+        executors = sorted(chain(*[result[1] for result in results]), key=lambda executor: (OPERATION_ORDER.index(executor.operation_type), _line_number(executor)))
+
+        return diffs, executors
+
+    def partition(self, request_index, db_index):
+        # returns the partition of each request line and each table row. Equal keys have the same code, empty keys have code -1
+        codes, _ = request_index.append(db_index).factorize()
+        partitions = codes % self.size
+        return partitions[:len(request_index)], partitions[len(request_index):]
+
+    def _concat(self, parts):
+        # combine the diffs of the partitions, in the order of the request lines
+        df = pd.concat(parts, ignore_index=True)
+        if not df.empty and '__line__' in df.columns:
+            df = df.sort_values(df.columns[0], ignore_index=True)
+        return df
+
+
+def _diff_partition(index):
+    # runs in a worker process, on the work that was set before forking
+    df_request, df_db, request_partitions, db_partitions, compare, create_executors = _work
+
+    # compare the request lines and table rows of this partition
+    diffs = compare(df_request[request_partitions == index], df_db[db_partitions == index])
+
+    # create executors, and keep the backends that are selected, to return them to the parent process
+    backends = {}
+    executors = create_executors(diffs, backends=backends)
+
+    return diffs, executors, backends
+
+
+def _line_number(executor):
+    # line number of an executor, or of the first row of a batch. Deletes have no line number
+    if executor.line_number is None and getattr(executor, 'executors', None):
+        return _line_number(executor.executors[0])
+
+    # updates take their line number from a row with two levels of columns, as a series of a single value
+    line_number = executor.line_number.iloc[0] if isinstance(executor.line_number, pd.Series) else executor.line_number
+    return line_number if line_number is not None else -1
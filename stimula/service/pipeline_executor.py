@@ -0,0 +1,152 @@
+"""
+This class executes row executors over a psycopg 3 connection in pipeline mode, to avoid waiting for a reply after each statement.
+
+Executing row by row is latency bound, because the savepoint, the statement and the result of each row are sent and received one
+after the other. In pipeline mode, the savepoints and statements of many rows are sent at once, and the replies are read afterwards.
+Each row still runs under its own savepoint. If a row fails, the statements after it are aborted by the server. The row is rolled back
+to its savepoint, and the rows after it are sent again. This gives the same results as executing row by row.
+
+Pipeline mode requires psycopg 3, which is an optional dependency. The executor opens a psycopg 3 connection with the parameters of the
+current connection, and uses it instead of the current connection until it's closed.
+
+The load runs in the transaction of the new connection, not in the transaction of the caller, like an Odoo cursor. It would not see rows
+that the caller changed and didn't commit, and it would wait for rows that the caller locked. Pipeline mode is refused if the transaction
+of the current connection has written or locked rows. A transaction that only read rows, like reading the table to compare, is fine.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import pandas as pd
+from psycopg2._json import Json
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from .context import cnx_context
+
+try:
+    import psycopg
+    from psycopg.adapt import Dumper
+except ImportError:
+    psycopg = None
+    Dumper = object
+
+
+class PipelineExecutor:
+    def __init__(self, size=100):
+        assert psycopg is not None, 'Pipeline mode requires psycopg 3, install it with: pip install psycopg'
+        # maximum number of rows to send before reading the replies
+        self.size = size
+        self.cnx = None
+        # connection and cursor to restore when the executor is closed
+        self._original = None
+
+    def __enter__(self):
+        # the load can't see or wait for changes of the current transaction, so it must not have any
+        assert not self._has_changes(cnx_context.cnx), 'Pipeline mode runs outside the current transaction, commit or roll back its changes first'
+
+        # open a psycopg 3 connection with the parameters of the current connection. Use client side binding, like psycopg2 does,
+        # because postgres can't infer the type of a server side parameter in 'is null'
+        info = cnx_context.cnx.info
+        self.cnx = psycopg.connect(host=info.host, port=info.port, dbname=info.dbname, user=info.user, password=info.password, cursor_factory=psycopg.ClientCursor)
+
+        # adapt json values that were created for psycopg2
+        self.cnx.adapters.register_dumper(Json, _JsonDumper)
+
+        # use the new connection instead of the current one
+        self._original = cnx_context.cnx, cnx_context.cr
+        cnx_context.cnx, cnx_context.cr = self.cnx, self.cnx.cursor()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # restore the original connection. Changes that were not committed are rolled back when the connection is closed
+        cnx_context.cnx, cnx_context.cr = self._original
+        self.cnx.close()
+
+    def _has_changes(self, cnx):
+        # a transaction that wrote or locked rows has a transaction id, a transaction that only read rows doesn't
+        status = cnx.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return False
+        if status != TRANSACTION_STATUS_INTRANS:
+            return True
+        with cnx.cursor() as cr:
+            cr.execute('select txid_current_if_assigned()')
+            return cr.fetchone()[0] is not None
+
+    def execute(self, executors):
+        # execute simple query executors, returns an execution result per executor
+        results = []
+        while len(results) < len(executors):
+            # send remaining rows, this returns the results up to and including the first row that was rolled back
+            results.extend(self._send(executors[len(results):]))
+        return results
+
+    def _send(self, executors):
+        # cursor per statement, to read the number of affected rows of each statement
+        cursors = []
+        error = None
+
+        with self.cnx.pipeline() as pipeline:
+            try:
+                for index, executor in enumerate(executors):
+                    # create savepoint per row, so that a row can be rolled back after reading the replies
+                    self.cnx.execute(f'SAVEPOINT stimula_pipeline_{index}')
+
+                    # replace ':' style place holders with '%' style, and replace NA values with None in params dictionary
+                    cursor = self.cnx.cursor()
+                    cursor.execute(executor._replace_placeholders(executor.query), {k: None if pd.isna(v) else v for k, v in executor.params.items()})
+                    cursors.append(cursor)
+
+                # read all replies
+                pipeline.sync()
+            except psycopg.Error as e:
+                error = e
+                # sync until the replies of the aborted statements are read, the transaction stays aborted until it's rolled back to a savepoint
+                self._sync_aborted(pipeline)
+
+        # a failed statement, and the statements after it, have no result
+        failed_index = next((index for index, cursor in enumerate(cursors) if cursor.pgresult is None), len(cursors))
+
+        results = []
+        for index, (executor, cursor) in enumerate(zip(executors, cursors[:failed_index])):
+            result = executor.rowcount_result(cursor.rowcount)
+            results.append(result)
+
+            # a row that affected more than one row must be rolled back, then continue with the rows after it
+            if result.block_commit:
+                self._rollback(index)
+                return results
+
+        if error is None:
+            # all rows were executed, release savepoints to keep the savepoint stack shallow
+            self.cnx.execute('RELEASE SAVEPOINT stimula_pipeline_0')
+            return results
+
+        # an error that is not caused by a row, can't be reported per row
+        if failed_index >= len(executors):
+            raise error
+
+        # roll back the failed row, then continue with the rows after it
+        self._rollback(failed_index)
+        results.append(executors[failed_index].error_result(str(error), error.sqlstate))
+        return results
+
+    def _sync_aborted(self, pipeline):
+        # each sync reads the replies up to the next sync point, so sync until no aborted replies are left
+        while True:
+            try:
+                pipeline.sync()
+                return
+            except psycopg.errors.PipelineAborted:
+                continue
+
+    def _rollback(self, index):
+        # rollback to the savepoint of the row, and release savepoints of this pipeline
+        self.cnx.execute(f'ROLLBACK TO SAVEPOINT stimula_pipeline_{index}')
+        self.cnx.execute('RELEASE SAVEPOINT stimula_pipeline_0')
+
+
+class _JsonDumper(Dumper):
+    # dumps a psycopg2 json value as a literal, like psycopg2 does
+
+    def dump(self, obj):
+        return obj.dumps(obj.adapted).encode('utf-8')
@@ -0,0 +1,138 @@
+"""
+This class holds the executors of a load, so that a load can be reviewed first and applied later without comparing again.
+
+A load is usually posted twice: once without commit to review the report, and once with commit. Each run reads the contents, reads
+the tables and compares them. A plan is written by the first run. It holds the executors, the arguments of the load, and markers of
+the rows that the mapping reads. Applying the plan executes the executors directly if no marker changed, and loads again with the
+same arguments otherwise.
+
+A marker is the number of rows and the sum of the transaction ids that wrote them. Any committed insert, update or delete changes
+the marker, rows of transactions that were rolled back, like the review run itself, don't. The statistics counters of the server
+can't be used instead, because they also count rolled back rows, and they are updated with a delay.
+
+The table that the mapping writes is marked as a whole. A referenced table, like ir_model_data, can be much larger than the rows that
+the load reads from it, so it's only marked for the rows that the written table references, through the index of the referenced column.
+External ids are marked for the module and model of the reference only. If references are resolved up front, the rows that a reference
+value resolves to can be any row, so referenced tables are marked as a whole.
+
+Plans are pickled, so only apply plans that you wrote yourself. The ORM of the connection is not pickled, but restored when the
+plan is loaded.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import pickle
+
+from psycopg2 import sql
+
+from .abstract_orm import AbstractORM
+from .context import cnx_context
+from ..stml.model import Entity, Reference
+from ..stml.sql.select_renderer import SelectRenderer
+
+# version of the plan format, a plan of another version can't be applied
+PLAN_VERSION = 2
+
+# persistent id of the ORM in a pickled plan
+ORM_ID = 'orm'
+
+
+class Plan:
+    def __init__(self, method, arguments, query_executors, markers, backends=None):
+        # name and arguments of the DB method that created the plan, to load again if tables changed
+        self.method = method
+        self.arguments = arguments
+        self.query_executors = query_executors
+        # backend that executes each operation, per table, for the report
+        self.backends = backends
+        # queries of the rows that the mappings read, and their markers
+        self.marker_queries = markers
+        self.markers = read_markers(markers)
+        self.version = PLAN_VERSION
+
+    def save(self, path):
+        # write the plan, the ORM is replaced by a persistent id
+        with open(path, 'wb') as file:
+            _PlanPickler(file).dump(self)
+
+    @staticmethod
+    def load(path, orm=None):
+        # read a plan, and restore the ORM of this connection
+        with open(path, 'rb') as file:
+            plan = _PlanUnpickler(file, orm).load()
+        assert isinstance(plan, Plan) and plan.version == PLAN_VERSION, f'File {path} is not a plan of this version, create the plan again'
+        return plan
+
+    def is_current(self):
+        # true if no marked rows changed since the plan was created
+        return read_markers(self.marker_queries) == self.markers
+
+
+class _PlanPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        return ORM_ID if isinstance(obj, AbstractORM) else None
+
+
+class _PlanUnpickler(pickle.Unpickler):
+    def __init__(self, file, orm):
+        super().__init__(file)
+        self._orm = orm
+
+    def persistent_load(self, pid):
+        assert pid == ORM_ID, f'Unknown persistent id in plan: {pid}'
+        return self._orm
+
+
+def mapping_markers(mapping: Entity, resolved=False):
+    """
+    Returns the rows that a mapping reads, as a dictionary of a marker name to a query of the rows, like "from authors where ..."
+    :param mapping: the mapping
+    :param resolved: true if references are resolved up front, so that any row of a referenced table may be read
+    """
+    markers = {mapping.name: sql.SQL('from {table}').format(table=sql.Identifier(mapping.name))}
+    for attribute in mapping.attributes:
+        markers.update(_reference_markers(attribute, mapping.name, mapping.name, sql.Identifier(mapping.name), markers[mapping.name], resolved))
+    return markers
+
+
+def _reference_markers(attribute, name, source_table, source, source_rows, resolved):
+    if not isinstance(attribute, Reference) or not attribute.table:
+        return {}
+
+    # name of the marker is the path of columns that lead to the referenced table
+    name = f'{name}.{attribute.name}'
+    table = sql.Identifier(attribute.table)
+
+    conditions = []
+    if not resolved:
+        # only rows that the source rows reference, the referenced column is usually indexed
+        conditions.append(sql.SQL('{table}.{target} in (select {source}.{column} {source_rows})').format(
+            table=table, target=sql.Identifier(attribute.target_name), source=source, column=sql.Identifier(attribute.name), source_rows=source_rows))
+    if attribute.extension:
+        # only external ids of the module and model of the reference
+        conditions.append(sql.SQL('{table}.module = {module} and {table}.model = {model}').format(
+            table=table, module=sql.Literal(attribute.qualifier), model=sql.Literal(SelectRenderer().get_model_name(source_table))))
+
+    rows = sql.SQL('from {table}').format(table=table)
+    if conditions:
+        rows = sql.SQL('{rows} where {conditions}').format(rows=rows, conditions=sql.SQL(' and ').join(conditions))
+
+    markers = {name: rows}
+    for nested in attribute.attributes:
+        markers.update(_reference_markers(nested, name, attribute.table, table, rows, resolved))
+    return markers
+
+
+def read_markers(markers):
+    # number of rows and sum of transaction ids of the rows of each marker, in a single query
+    names = sorted(markers)
+    if not names:
+        return {}
+
+    query = sql.SQL(' union all ').join(
+        sql.SQL('select {name}, count(*), coalesce(sum(xmin::text::bigint), 0) {rows}').format(name=sql.Literal(name), rows=markers[name])
+        for name in names)
+
+    cr = cnx_context.cr
+    cr.execute(query)
+    return {name: (count, int(checksum)) for name, count, checksum in cr.fetchall()}
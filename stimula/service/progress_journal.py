@@ -0,0 +1,126 @@
+"""
+This class keeps a journal of the rows that a load has committed, so that a load that dies midway can be resumed.
+
+A large load that is interrupted, by a network drop, a crash or a deploy, would otherwise be re-run from the start. The executor
+writes a line to the journal after each committed transaction, with the line numbers that were committed per table, as ranges, and
+the number of deleted rows. Each line is flushed and synced to disk, so the journal never claims more than the database committed.
+
+The first line of the journal holds a hash of the contents and of the mapping of each table. A load only resumes from a journal
+that was written for the same contents and mappings. When resuming, rows that the journal proves are committed are skipped, on both
+sides of the diff, so that they are not inserted, updated or deleted again.
+
+Rows that failed are not in the journal, so a resumed load tries them again. Deleted rows don't have line numbers, a resumed load
+doesn't find them anymore, because they were deleted.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import hashlib
+import json
+import os
+
+from .query_executor import OperationType
+
+# version of the journal format, a journal of another version can't be resumed
+JOURNAL_VERSION = 1
+
+
+class ProgressJournal:
+    def __init__(self, path, table_names, headers, contents):
+        self.path = path
+        # hash of the contents and of the mapping of each table
+        self.files = {table_name: fingerprint(content) for table_name, content in zip(table_names, contents)}
+        self.mappings = {table_name: fingerprint(f'{table_name}\n{header}') for table_name, header in zip(table_names, headers)}
+        assert len(self.files) == len(table_names), 'A journal requires each table to be posted only once'
+        # committed line numbers per table, from the journal that is resumed
+        self.committed = {table_name: set() for table_name in table_names}
+        # number of chunks in the journal
+        self.chunks = 0
+        self._file = None
+
+    def open(self, resume=False):
+        # read the committed rows of an existing journal if resuming, otherwise start a new journal
+        if resume and os.path.exists(self.path):
+            self._read()
+            self._file = open(self.path, 'a')
+        else:
+            self._file = open(self.path, 'w')
+            self._write({'version': JOURNAL_VERSION, 'files': self.files, 'mappings': self.mappings})
+        return self
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def committed_lines(self, table_name):
+        # line numbers of a table that are committed by an earlier run
+        return self.committed.get(table_name, set())
+
+    def record(self, results):
+        # append a chunk of committed results to the journal
+        lines = {}
+        deletes = {}
+        for result in results:
+            if result.operation_type == OperationType.DELETE:
+                deletes[result.table_name] = deletes.get(result.table_name, 0) + 1
+            elif result.line_number is not None:
+                lines.setdefault(result.table_name, []).append(int(result.line_number))
+
+        # nothing to record if the transaction was empty
+        if not lines and not deletes:
+            return
+
+        self._write({'chunk': self.chunks, 'lines': {table_name: to_ranges(numbers) for table_name, numbers in lines.items()}, 'deletes': deletes})
+        self.chunks += 1
+
+    def _read(self):
+        with open(self.path, 'r') as file:
+            # a line that was cut off by a crash was never synced, so it's ignored
+            entries = []
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+
+        # verify that the journal was written for the same contents and mappings
+        assert entries and entries[0].get('version') == JOURNAL_VERSION, f'Journal {self.path} can not be resumed, remove it to start over'
+        assert entries[0]['files'] == self.files, f'Journal {self.path} was written for other contents, remove it to start over'
+        assert entries[0]['mappings'] == self.mappings, f'Journal {self.path} was written for another mapping, remove it to start over'
+
+        # collect committed line numbers per table
+        for entry in entries[1:]:
+            for table_name, ranges in entry['lines'].items():
+                self.committed.setdefault(table_name, set()).update(number for first, last in ranges for number in range(first, last + 1))
+            self.chunks = entry['chunk'] + 1
+
+    def _write(self, entry):
+        # write a single line, and make sure it's on disk before the load continues
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def fingerprint(text):
+    # hash of the contents of a file or of a mapping
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def to_ranges(numbers):
+    # compact a list of line numbers to a list of first and last numbers of consecutive runs
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
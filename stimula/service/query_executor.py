@@ -1,9 +1,14 @@
+import io
 import logging
 import re
 from abc import ABC, abstractmethod
 from enum import Enum
+from functools import lru_cache
 
 import pandas as pd
+from psycopg2._json import Json
+
+from ..stml.sql.values_renderer import batch_parameter_name, batch_parameter_values
 
 '''
 This class allows for different execution styles. 
@@ -12,6 +17,9 @@ In particular, it allows for dependent queries, where the result of the first qu
 
 _logger = logging.getLogger(__name__)
 
+# error of a row that had no effect, for example because a referenced row doesn't exist yet
+NO_ROW_AFFECTED = 'No row was affected'
+
 
 class Executor(ABC):
     def __init__(self, line_number, operation_type, table_name, context):
@@ -19,6 +27,10 @@ class Executor(ABC):
         self.operation_type = operation_type
         self.table_name = table_name
         self.context = context
+        # key values that this executor inserts or updates, as list of (table, {attribute name: value})
+        self.keys = []
+        # key values that this executor references, as list of (table, (attribute names), (values)). Names and values are None if it may reference any row of the table
+        self.references = []
 
     @abstractmethod
     def execute(self, cursor):
@@ -36,9 +48,15 @@ class Executor(ABC):
         pass
 
     def _replace_placeholders(self, query):
-        # replace :xyz with %(xyz)s using regex
-        # but make sure to not replace the '::text' type cast in to_jsonb(:parameter::text)
-        return re.sub(r'(?<!:):(\w+)', r'%(\1)s', query)
+        return _replace_placeholders(query)
+
+
+@lru_cache(maxsize=1000)
+def _replace_placeholders(query):
+    # replace :xyz with %(xyz)s using regex
+    # but make sure to not replace the '::text' type cast in to_jsonb(:parameter::text)
+    # cache the result, because most rows share the same query
+    return re.sub(r'(?<!:):(\w+)', r'%(\1)s', query)
 
 
 class SimpleQueryExecutor(Executor):
@@ -60,15 +78,19 @@ class SimpleQueryExecutor(Executor):
             # execute query
             cursor.execute(psycopg_query, params_with_none)
         except Exception as e:
-            error = str(e)
-            return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context, error=error)
+            return self.error_result(str(e), _sqlstate(e))
 
-        # Get the number of affected rows
-        rowcount = cursor.rowcount
+        # create result from the number of affected rows
+        return self.rowcount_result(cursor.rowcount)
 
+    def error_result(self, error, sqlstate=None):
+        # create result of a query that raised an error
+        return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context, error=error, sqlstate=sqlstate)
+
+    def rowcount_result(self, rowcount):
         # verify row was affected
         if rowcount == 0:
-            error = 'No row was affected'
+            error = NO_ROW_AFFECTED
             return ExecutionResult(self.line_number, self.operation_type, False, rowcount, self.table_name, self.query, self.params, self.context, error=error)
 
         # verify no more than one row was affected
@@ -98,6 +120,250 @@ class FailedQueryExecutor(Executor):
     def fake_execute(self):
         return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, None, {}, self.context, error=self.error)
 
+'''
+This class executes a batch of row executors in a single query, to avoid a round trip per row.
+The batch only succeeds if it affects exactly one row per row executor. Otherwise, the caller must roll back and fall back
+to executing the row executors one by one, so that errors are reported per line.
+'''
+class BatchQueryExecutor(Executor):
+    def __init__(self, operation_type, table_name, query, params, executors, context):
+        super().__init__(None, operation_type, table_name, context)
+        self.query = query
+        self.params = params
+        self.executors = executors
+
+    def queries(self):
+        return [(self.query, self.params)]
+
+    def execute(self, cursor):
+        try:
+            # execute query
+            self._execute(cursor)
+        except Exception as e:
+            error = str(e)
+            return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context, error=error, sqlstate=_sqlstate(e))
+
+        # Get the number of affected rows
+        rowcount = cursor.rowcount
+
+        # verify that each row executor affected exactly one row
+        if rowcount != len(self.executors):
+            error = f'Expected {len(self.executors)} rows to be affected, found {rowcount}'
+            return ExecutionResult(self.line_number, self.operation_type, False, rowcount, self.table_name, self.query, self.params, self.context, error=error)
+
+        return ExecutionResult(self.line_number, self.operation_type, True, rowcount, self.table_name, self.query, self.params, self.context)
+
+    def _execute(self, cursor):
+        # replace ':' style place holders with '%' style
+        psycopg_query = self._replace_placeholders(self.query)
+        # replace NA values with None in params dictionary
+        params_with_none = {k: None if pd.isna(v) else v for k, v in self.params.items()}
+
+        cursor.execute(psycopg_query, params_with_none)
+
+    def row_results(self):
+        # a successful batch affected one row per row executor, report it as if the row executors ran one by one
+        return [ExecutionResult(e.line_number, e.operation_type, True, 1, e.table_name, e.query, e.params, e.context) for e in self.executors]
+
+    def fake_execute(self):
+        return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context)
+
+'''
+This class inserts a batch of row executors with COPY FROM STDIN, which streams the rows to the server instead of binding them as parameters.
+Like a plain batch, it only succeeds if it inserts all rows. Otherwise, the caller must roll back and fall back to executing the row executors.
+'''
+class CopyQueryExecutor(BatchQueryExecutor):
+    def __init__(self, operation_type, table_name, query, parameter_names, executors, context):
+        super().__init__(operation_type, table_name, query, {}, executors, context)
+        # parameter names, in the same order as the copied columns
+        self.parameter_names = parameter_names
+
+    def _execute(self, cursor):
+        # write a csv line per row executor
+        data = ''.join(_copy_line([e.params.get(name) for name in self.parameter_names]) for e in self.executors)
+
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2 reads the data from a file
+            cursor.copy_expert(self.query, io.StringIO(data))
+        else:
+            # psycopg 3 writes the data to a copy object
+            with cursor.copy(self.query) as copy:
+                copy.write(data)
+
+
+def _copy_line(values):
+    # render a line of csv, terminated by a line break
+    return ','.join(_copy_value(value) for value in values) + '\n'
+
+
+def _copy_value(value):
+    # an unquoted empty value is null
+    if value is None or pd.isna(value):
+        return ''
+
+    # write json as text, like psycopg does
+    if isinstance(value, Json):
+        value = value.dumps(value.adapted)
+
+    # quote all other values, so that empty strings, separators and line breaks are copied as they are
+    return '"' + str(value).replace('"', '""') + '"'
+
+'''
+This class executes a batch of row executors in a single query that returns the index of the row executor for each affected row.
+Unlike a plain batch, the number of affected rows is known per row, so rows that affect no row fail on their own instead of failing the batch.
+'''
+class IndexedBatchQueryExecutor(BatchQueryExecutor):
+    def __init__(self, operation_type, table_name, query, params, executors, context):
+        super().__init__(operation_type, table_name, query, params, executors, context)
+        self.rowcounts = []
+
+    def execute(self, cursor):
+        # replace ':' style place holders with '%' style
+        psycopg_query = self._replace_placeholders(self.query)
+        # replace NA values with None in params dictionary
+        params_with_none = {k: None if pd.isna(v) else v for k, v in self.params.items()}
+
+        try:
+            # execute query
+            cursor.execute(psycopg_query, params_with_none)
+            row_indices = [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            error = str(e)
+            return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context, error=error, sqlstate=_sqlstate(e))
+
+        # count affected rows per row executor
+        self.rowcounts = [row_indices.count(index) for index in range(len(self.executors))]
+
+        # if a row affected more than one row, the caller must roll back and execute by row to report it on the right line
+        if any(rowcount > 1 for rowcount in self.rowcounts):
+            error = 'More than one row was affected'
+            return ExecutionResult(self.line_number, self.operation_type, False, len(row_indices), self.table_name, self.query, self.params, self.context, error=error)
+
+        return ExecutionResult(self.line_number, self.operation_type, True, len(row_indices), self.table_name, self.query, self.params, self.context)
+
+    def row_results(self):
+        # report rows that affected one row as successful, and rows that affected no row as failed
+        return [ExecutionResult(e.line_number, e.operation_type, rowcount == 1, rowcount, e.table_name, e.query, e.params, e.context, error=None if rowcount == 1 else NO_ROW_AFFECTED)
+                for e, rowcount in zip(self.executors, self.rowcounts)]
+
+
+'''
+This class executes a group of row executors with the same query in a single statement, to avoid a round trip per row.
+Each row becomes a data modifying common table expression that returns its index, so that the number of affected rows is known per row.
+Rows that affect no row had no effect, the caller can execute them by row, because they may depend on rows earlier in the group.
+'''
+class GroupQueryExecutor(IndexedBatchQueryExecutor):
+    def __init__(self, operation_type, table_name, executors, context):
+        # rename parameters per row, and return the row index from each row's statement
+        ctes = [f'row_{index} as ({_number_parameters(e.query, index)} returning {index} as row_index)' for index, e in enumerate(executors)]
+        selects = [f'select row_index from row_{index}' for index in range(len(executors))]
+        query = f'with {", ".join(ctes)} {" union all ".join(selects)}'
+        params = batch_parameter_values([e.params for e in executors])
+
+        super().__init__(operation_type, table_name, query, params, executors, context)
+
+
+'''
+This class executes a batch of dependent query executors in two statements, instead of in two statements per row.
+The initial query returns the row index and id of each affected row. The second statement executes the dependent queries
+with the returned ids, like the ir_model_data records of Odoo external ids.
+'''
+class IndexedBatchDependentQueryExecutor(BatchQueryExecutor):
+    def __init__(self, operation_type, table_name, query, params, executors, context):
+        super().__init__(operation_type, table_name, query, params, executors, context)
+        self.rowcounts = []
+        # dependent query, params and rowcount per row index
+        self.dependent_results = {}
+
+    def execute(self, cursor):
+        # replace ':' style place holders with '%' style
+        psycopg_query = self._replace_placeholders(self.query)
+        # replace NA values with None in params dictionary
+        params_with_none = {k: None if pd.isna(v) else v for k, v in self.params.items()}
+
+        try:
+            # execute initial queries
+            cursor.execute(psycopg_query, params_with_none)
+            rows = cursor.fetchall()
+        except Exception as e:
+            error = str(e)
+            return ExecutionResult(self.line_number, self.operation_type, False, 0, self.table_name, self.query, self.params, self.context, error=error, sqlstate=_sqlstate(e))
+
+        # count affected rows and get returned id per row executor
+        rowcounts = [0] * len(self.executors)
+        ids = {}
+        for row_index, id in rows:
+            rowcounts[row_index] += 1
+            ids[row_index] = id
+
+        # if a row affected more than one row, the caller must roll back and execute by row
+        if any(rowcount > 1 for rowcount in rowcounts):
+            error = 'More than one row was affected'
+            return ExecutionResult(self.line_number, self.operation_type, False, len(rows), self.table_name, self.query, self.params, self.context, error=error)
+
+        # create dependent queries with the returned id, skip rows that were not affected
+        indices = [index for index, rowcount in enumerate(rowcounts) if rowcount == 1]
+        dependents = [self._dependent_executor(self.executors[index], ids[index]) for index in indices]
+
+        if dependents:
+            # execute all dependent queries in a single statement
+            group = GroupQueryExecutor(self.operation_type, self.table_name, dependents, self.context)
+            result = group.execute(cursor)
+            if not result.success:
+                return ExecutionResult(self.line_number, self.operation_type, False, len(rows), self.table_name, self.query, self.params, self.context, error=result.error)
+
+            # keep dependent query, params and rowcount per row, to report like a dependent query executor does
+            self.dependent_results = {index: (d.query, d.params, rowcount) for index, d, rowcount in zip(indices, dependents, group.rowcounts)}
+
+        self.rowcounts = rowcounts
+        return ExecutionResult(self.line_number, self.operation_type, True, len(rows), self.table_name, self.query, self.params, self.context)
+
+    def _dependent_executor(self, executor, id):
+        # set the returned id in a copy of the dependent query parameters
+        query, params = executor.dependent_query
+        return SimpleQueryExecutor(executor.line_number, executor.operation_type, executor.table_name, query, {**params, 'res_id': id}, executor.context)
+
+    def row_results(self):
+        results = []
+        for index, (e, rowcount) in enumerate(zip(self.executors, self.rowcounts)):
+            # replace NA values with None in params dictionary, like a dependent query executor does
+            params = {k: None if pd.isna(v) else v for k, v in e.params.items()}
+            result = ExecutionResult(e.line_number, e.operation_type, rowcount == 1, rowcount, e.table_name, e.query, params, e.context)
+
+            # add result of dependent query
+            if index in self.dependent_results:
+                query, dependent_params, dependent_rowcount = self.dependent_results[index]
+                result.dependent_execution_result = ExecutionResult(e.line_number, e.operation_type, True, dependent_rowcount, e.table_name, query, dependent_params, e.context)
+
+            results.append(result)
+        return results
+
+
+'''
+This class executes a group of dependent query executors with the same queries in two statements, instead of in two statements per row.
+The first statement executes the initial queries, each in a common table expression that returns its row index and id.
+'''
+class GroupDependentQueryExecutor(IndexedBatchDependentQueryExecutor):
+    def __init__(self, operation_type, table_name, executors, context):
+        # rename parameters per row, the initial queries already return the id
+        ctes = [f'row_{index} as ({_number_parameters(e.query, index)})' for index, e in enumerate(executors)]
+        selects = [f'select {index} as row_index, row_{index}.* from row_{index}' for index in range(len(executors))]
+        query = f'with {", ".join(ctes)} {" union all ".join(selects)}'
+        params = batch_parameter_values([e.params for e in executors])
+
+        super().__init__(operation_type, table_name, query, params, executors, context)
+
+
+def _sqlstate(error):
+    # get the SQLSTATE code of a database error, psycopg2 calls it pgcode and psycopg 3 calls it sqlstate. Other errors have no code
+    return getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)
+
+
+def _number_parameters(query, index):
+    # rename :xyz to :xyz__index, but make sure to not replace the '::text' type cast in to_jsonb(:parameter::text)
+    return re.sub(r'(?<!:):(\w+)', lambda match: f':{batch_parameter_name(match.group(1), index)}', query)
+
+
 '''
 This class allows for dependent queries, where the result of the first query is used as a parameter in the second query.
 This is useful for extensions, such as the ir_model_data table in Odoo.
@@ -173,7 +439,7 @@ class OperationType(Enum):
 
 
 class ExecutionResult:
-    def __init__(self, line_number, operation_type, success, rowcount, table_name, query, params, context, error=None, block_commit=False):
+    def __init__(self, line_number, operation_type, success, rowcount, table_name, query, params, context, error=None, block_commit=False, sqlstate=None):
         # convert numpy int64 to int
         self.line_number = int(line_number) if line_number is not None else None
         if not isinstance(operation_type, OperationType):
@@ -187,6 +453,8 @@ class ExecutionResult:
         self.context = context
         self.error = error
         self.block_commit = block_commit
+        # SQLSTATE code of the database error, used to decide whether the row is worth retrying
+        self.sqlstate = sqlstate
         self.dependent_execution_result = None
 
     def __str__(self):
@@ -197,6 +465,6 @@ class ExecutionResult:
         self.params = {k: '' if pd.isna(v) else v for k, v in self.params.items()}
 
         if execute:
-            return [{key: value for key, value in vars(self).items() if value is not None and key not in ['block_commit', 'dependent_execution_result']}]
+            return [{key: value for key, value in vars(self).items() if value is not None and key not in ['block_commit', 'sqlstate', 'dependent_execution_result']}]
         else:
-            return [{key: value for key, value in vars(self).items() if value is not None and key not in ['block_commit', 'success', 'rowcount', 'dependent_execution_result']}]
+            return [{key: value for key, value in vars(self).items() if value is not None and key not in ['block_commit', 'sqlstate', 'success', 'rowcount', 'dependent_execution_result']}]
@@ -0,0 +1,131 @@
+"""
+This class looks up the ids of references for all rows up front, instead of joining the referenced tables in the statement of each row.
+
+Most loads only reference a handful of distinct rows, like the countries of a list of customers. The resolver collects the distinct key
+values of each reference from the prepared rows, and looks them up with a query per reference. Then it replaces the references in the
+mapping of a row by plain columns, and their key values by the ids. A row that references a row that doesn't exist, fails before any
+statement is sent.
+
+References to tables that are loaded in the same request are not looked up, because the load may insert the rows they reference.
+References by external id are looked up in the external id cache if one is given, instead of with a query.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import pandas as pd
+
+from .context import cnx_context
+from .external_id_cache import external_id_reference
+from .query_executor import _replace_placeholders
+from ..stml.model import Entity, Attribute, Reference
+from ..stml.sql.lookup_renderer import LookupRenderer
+from ..stml.sql.parameters_renderer import ParametersRenderer
+from ..stml.sql.values_renderer import batch_parameter_values
+
+
+class ReferenceResolver:
+    def __init__(self, loaded_tables=(), batch_size=1000, external_ids=None):
+        # tables that the request loads, references to these tables are resolved by the row statements
+        self._loaded_tables = set(loaded_tables)
+        # maximum number of key values to look up in a single query
+        self._batch_size = batch_size
+        # optional cache of external ids per module and model
+        self._external_ids = external_ids
+        # ids per reference name, as dictionary of key values to the list of ids found
+        self._ids = {}
+
+    def resolve(self, mapping: Entity, rows):
+        # collect distinct key values per reference, from a list of filtered mapping and parameter values per row
+        references = {}
+        keys = {}
+        for filtered_mapping, value_dict in rows:
+            for reference in self._references(filtered_mapping, value_dict):
+                references[reference.name] = reference
+                # use a dictionary as ordered set, and skip key values that were looked up before
+                key = self._key_values(reference, value_dict)
+                if key not in self._ids.get(reference.name, {}):
+                    keys.setdefault(reference.name, {})[key] = None
+
+        # look up ids with a query per reference
+        for name, reference_keys in keys.items():
+            self._ids.setdefault(name, {}).update(self._lookup(mapping, references[name], list(reference_keys)))
+
+    def substitute(self, mapping: Entity, value_dict):
+        # replace resolved references by plain columns, and their key values by the ids. Raises an error if a reference was not found
+        references = self._references(mapping, value_dict)
+        if not references:
+            return mapping, value_dict
+
+        attributes = []
+        values = dict(value_dict)
+        for attribute in mapping.attributes:
+            if attribute not in references:
+                attributes.append(attribute)
+                continue
+
+            # get ids of the key values, they're looked up in resolve()
+            key = self._key_values(attribute, value_dict)
+            ids = self._ids[attribute.name][key]
+
+            # a row can only reference a single row
+            if not ids:
+                raise ValueError(f'No row found in table {attribute.table} for {attribute.name}: {", ".join(str(v) for v in key)}')
+            if len(ids) > 1:
+                raise ValueError(f'More than one row found in table {attribute.table} for {attribute.name}: {", ".join(str(v) for v in key)}')
+
+            # remove key values, and set the id as parameter value of a plain column
+            for parameter in self._parameters(attribute):
+                values.pop(parameter)
+            values[attribute.name] = ids[0]
+            attributes.append(Attribute(attribute.name, unique=attribute.unique, enabled=attribute.enabled, in_use=attribute.in_use, parameter=attribute.name))
+
+        return Entity(mapping.name, attributes, mapping.primary_key), values
+
+    def _references(self, mapping: Entity, value_dict):
+        # get references that can be looked up
+        return [a for a in mapping.attributes if self._is_resolvable(a, value_dict)]
+
+    def _is_resolvable(self, attribute, value_dict):
+        # an extension on the root table is not a foreign key, and tables that are loaded may not contain the referenced row yet
+        if not isinstance(attribute, Reference) or attribute.extension or attribute.table in self._loaded_tables:
+            return False
+
+        # the id needs a parameter, skip if its name is taken by another attribute
+        if attribute.name in value_dict and attribute.name not in self._parameters(attribute):
+            return False
+
+        # only look up complete key values, leave empty references to the row statement
+        return self._key_values(attribute, value_dict) is not None
+
+    def _key_values(self, reference: Reference, value_dict):
+        # get values of the parameters of a reference, or None if a value is missing
+        values = tuple(value_dict.get(parameter) for parameter in self._parameters(reference))
+        if not all(isinstance(value, (str, int, float)) and not pd.isna(value) for value in values):
+            return None
+        return values
+
+    def _parameters(self, reference: Reference):
+        # get parameter names of a reference, including those of nested references
+        return ParametersRenderer().render(Entity(None, [reference]))[0]
+
+    def _lookup(self, mapping: Entity, reference: Reference, keys):
+        # external ids are in the cache, look them up without a query
+        external_id = external_id_reference(reference, mapping.name) if self._external_ids is not None else None
+        if external_id:
+            ids = self._external_ids.ids(*external_id)
+            return {key: [ids[str(key[0])]] if str(key[0]) in ids else [] for key in keys}
+
+        # find the ids of each key value, in batches
+        ids = {key: [] for key in keys}
+        for start in range(0, len(keys), self._batch_size):
+            batch = keys[start:start + self._batch_size]
+
+            # render a query that returns the row index and id for each key value that is found
+            query = LookupRenderer().render(mapping, reference, len(batch))
+            params = batch_parameter_values([dict(zip(self._parameters(reference), key)) for key in batch])
+
+            cnx_context.cr.execute(_replace_placeholders(query), params)
+            for row_index, id in cnx_context.cr.fetchall():
+                ids[batch[row_index]].append(id)
+
+        return ids
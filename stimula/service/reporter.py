@@ -9,7 +9,7 @@ from stimula.service.query_executor import OperationType
 
 
 class Reporter:
-    def create_post_report(self, tables, contents, contexts, execution_results, execute, commit, skiprows, nrows):
+    def create_post_report(self, tables, contents, contexts, execution_results, execute, commit, skiprows, nrows, retry_statistics=None, backends=None, transaction_statistics=None):
 
         summary = {
             'execute': execute,
@@ -47,6 +47,18 @@ class Reporter:
                              'update': len([er for er in execution_results if er.operation_type == OperationType.UPDATE and not er.success]),
                              'delete': len([er for er in execution_results if er.operation_type == OperationType.DELETE and not er.success])}
 
+        # number of retry rounds, and number of rows executed in those rounds
+        if retry_statistics is not None:
+            summary['retry'] = retry_statistics
+
+        # backend that executed the inserts, updates and deletes of each table
+        if backends is not None:
+            summary['backends'] = backends
+
+        # number and sizes of transactions, if the transaction size is adaptive
+        if transaction_statistics is not None:
+            summary['transactions'] = transaction_statistics
+
         # files
         files = [self._summarize_file(table, context, content) for table, context, content in zip(tables, contexts, contents)]
 
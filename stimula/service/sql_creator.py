@@ -4,14 +4,16 @@ This script provides the concrete ExecutorCreator implementation to insert, upda
 Author: Romke Jonker
 Email: romke@stml.io
 """
+from abc import ABC, abstractmethod
 
 from .executor_creator import ExecutorCreator
-from .query_executor import SimpleQueryExecutor, DependentQueryExecutor, OperationType
+from .query_executor import SimpleQueryExecutor, DependentQueryExecutor, OperationType, IndexedBatchQueryExecutor, IndexedBatchDependentQueryExecutor, CopyQueryExecutor
 from ..stml.header_renderer import HeaderRenderer
 from ..stml.model import Entity, Reference, Attribute
-from ..stml.sql.delete_renderer import DeleteRenderer
-from ..stml.sql.insert_renderer import InsertRenderer, ReturningClauseRenderer
-from ..stml.sql.update_renderer import UpdateRenderer
+from ..stml.sql.delete_renderer import DeleteRenderer, BatchDeleteRenderer
+from ..stml.sql.insert_renderer import InsertRenderer, ReturningClauseRenderer, BatchInsertRenderer, CopyRenderer
+from ..stml.sql.update_renderer import UpdateRenderer, BatchUpdateRenderer
+from ..stml.sql.values_renderer import batch_parameter_values
 
 
 class InsertSqlCreator(ExecutorCreator):
@@ -54,6 +56,103 @@ class InsertSqlCreator(ExecutorCreator):
         return sql, values
 
 
+class BatchSqlCreator(ABC):
+    # creates the same row executors as the sql creator that it's mixed with, then combines row executors with the same query into batches
+
+    def __init__(self, batch_size=1000):
+        super().__init__()
+        self._batch_size = batch_size
+        # filtered mapping per query, needed to render the batch query
+        self._mappings = {}
+
+    def create_executors(self, mapping, diffs, context=None, orm=None):
+        # create row executors
+        executors = list(super().create_executors(mapping, diffs, context, orm))
+
+        # group batchable executors by query, other executors can't be batched
+        groups = {}
+        for executor in executors:
+            if self._is_batchable(executor):
+                groups.setdefault(executor.query, []).append(executor)
+
+        # yield executors in order of first appearance, yield a batch at the position of its first row executor
+        batched = set()
+        for executor in executors:
+            if not self._is_batchable(executor):
+                yield executor
+            elif executor.query not in batched:
+                batched.add(executor.query)
+                yield from self._create_batches(groups[executor.query], context)
+
+    def _create_executor(self, line_number, mapping, values, context, orm):
+        # create executor
+        executor = super()._create_executor(line_number, mapping, values, context, orm)
+
+        # remember filtered mapping, so we can render a batch query for all rows with the same query
+        if self._is_batchable(executor):
+            self._mappings.setdefault(executor.query, mapping)
+
+        return executor
+
+    def _is_batchable(self, executor):
+        # by default, only simple executors can be batched
+        return isinstance(executor, SimpleQueryExecutor)
+
+    def _create_batches(self, executors, context):
+        # split executors in chunks of at most batch size
+        for start in range(0, len(executors), self._batch_size):
+            chunk = executors[start:start + self._batch_size]
+
+            # no need to batch a single row
+            if len(chunk) == 1:
+                yield chunk[0]
+                continue
+
+            # render a single query for all rows in the chunk
+            yield self._create_batch(self._mappings[chunk[0].query], chunk, context)
+
+    @abstractmethod
+    def _create_batch(self, mapping, executors, context):
+        pass
+
+
+class BatchInsertSqlCreator(BatchSqlCreator, InsertSqlCreator):
+    # inserts all rows of a batch with a single insert...select from a values list, and returns the index of each inserted row
+
+    def _create_batch(self, mapping, executors, context):
+        query = BatchInsertRenderer().render(mapping, len(executors))
+        params = batch_parameter_values([e.params for e in executors])
+
+        return IndexedBatchQueryExecutor(self.operation_type, mapping.name, query, params, executors, context)
+
+
+class CopyInsertSqlCreator(BatchInsertSqlCreator):
+    # inserts all rows of a batch with COPY FROM STDIN, if the rows only have plain columns
+
+    def __init__(self, batch_size=1000, batch_insert=False):
+        super().__init__(batch_size)
+        # insert rows that can't be copied in batches, or else by row
+        self._batch_insert = batch_insert
+
+    def _create_batches(self, executors, context):
+        # rows that reference other tables can't be copied
+        if not self._batch_insert and not CopyRenderer().is_copyable(self._mappings[executors[0].query]):
+            yield from executors
+            return
+
+        yield from super()._create_batches(executors, context)
+
+    def _create_batch(self, mapping, executors, context):
+        # insert rows that can't be copied with a single insert...select
+        if not CopyRenderer().is_copyable(mapping):
+            return super()._create_batch(mapping, executors, context)
+
+        query = CopyRenderer().render(mapping)
+        parameter_names = CopyRenderer().render_parameters(mapping)
+
+        return CopyQueryExecutor(self.operation_type, mapping.name, query, parameter_names, executors, context)
+
+
 class UpdateSqlCreator(ExecutorCreator):
 
     def __init__(self):
@@ -140,6 +239,18 @@ class UpdateSqlCreator(ExecutorCreator):
         return this != that
 
 
+class BatchUpdateSqlCreator(BatchSqlCreator, UpdateSqlCreator):
+    # updates all rows of a batch with a single update...from a values list. Rows with the same modified columns have the same query,
+    # so each batch contains rows with the same modified column signature
+
+    def _create_batch(self, mapping, executors, context):
+        query = BatchUpdateRenderer().render(mapping, len(executors))
+        params = batch_parameter_values([e.params for e in executors])
+
+        # the query returns the index of each updated row, so that success is known per row
+        return IndexedBatchQueryExecutor(self.operation_type, mapping.name, query, params, executors, context)
+
+
 class DeleteSqlCreator(ExecutorCreator):
     def __init__(self):
         super().__init__()
@@ -180,6 +291,25 @@ class DeleteSqlCreator(ExecutorCreator):
         return sql, values
 
 
+class BatchDeleteSqlCreator(BatchSqlCreator, DeleteSqlCreator):
+    # deletes all rows of a batch with a single delete...using a values list, including the extension records of the deleted rows
+
+    def _is_batchable(self, executor):
+        # deletes with an extension return the deleted ids, so they can be batched as well
+        return isinstance(executor, (SimpleQueryExecutor, DependentQueryExecutor))
+
+    def _create_batch(self, mapping, executors, context):
+        query = BatchDeleteRenderer().render(mapping, len(executors))
+        params = batch_parameter_values([e.params for e in executors])
+
+        # delete extension records with the ids returned by the batch
+        if isinstance(executors[0], DependentQueryExecutor):
+            return IndexedBatchDependentQueryExecutor(self.operation_type, mapping.name, query, params, executors, context)
+
+        # the query returns the index of each deleted row, so that success is known per row
+        return IndexedBatchQueryExecutor(self.operation_type, mapping.name, query, params, executors, context)
+
+
 class ExtensionValueHelper:
     def get_extension_parameter_values(self, mapping: Entity, param):
         # get extension foreign keys
@@ -0,0 +1,215 @@
+"""
+This class finds the rows that differ between a request and the database on the server, to avoid reading the full table into pandas.
+
+The request is copied into a temporary staging table, which is joined with the select query of the mapping. Only request lines and
+database rows that are inserted, updated or deleted are returned, so that comparing them in pandas produces the same diff as comparing
+the full table.
+
+Author: Romke Jonker
+Email: romke@rnadesign.net
+"""
+import csv
+import json
+from datetime import date, datetime
+from io import StringIO
+
+import pandas as pd
+
+from .context import cnx_context
+from .db_reader import DbReader
+from ..stml.alias_enricher import AliasEnricher
+from ..stml.header_renderer import HeaderRenderer
+from ..stml.model import Attribute, Reference
+from ..stml.sql.select_renderer import SelectRenderer
+
+# name of the session local table that holds the request
+STAGING_TABLE = 'stimula_staging'
+
+# types to cast to before comparing, so that equal values with a different text representation are equal. Other types are compared as text.
+COMPARE_TYPES = {
+    'integer': 'numeric',
+    'bigint': 'numeric',
+    'smallint': 'numeric',
+    'numeric': 'numeric',
+    'real': 'numeric',
+    'double precision': 'numeric',
+    'boolean': 'boolean',
+    'date': 'timestamp',
+    'timestamp': 'timestamp',
+    'jsonb': 'jsonb',
+}
+
+
+class StagingReader:
+
+    def read_changes(self, mapping, df_request, where_clause, insert, update, delete):
+        """
+        Returns the request lines and database rows that must be compared to find inserts, updates and deletes
+        :param mapping: the mapping
+        :param df_request: the request as read by CsvReader, indexed by unique columns
+        :param where_clause: a free where clause to select database rows
+        :return: tuple of the changed request lines and the changed database rows, indexed by unique columns
+        """
+
+        # get enabled and unique columns, in the order of the select query
+        column_names = HeaderRenderer().render_list(mapping)
+        index_columns = HeaderRenderer().render_list_unique(mapping)
+
+        # rows can only be matched on unique columns
+        assert index_columns, 'Staging diff requires at least one unique column'
+
+        # compare columns that are both in the request and in the database, skip empty columns
+        value_columns = [c for c in column_names if c and c not in index_columns and c in df_request.columns]
+
+        # get the type to compare each column as
+        compare_types = dict(zip(column_names, self._compare_types(mapping)))
+
+        cr = cnx_context.cr
+
+        # create staging table and copy request into it
+        self._create_staging_table(cr, len(index_columns), len(value_columns))
+        self._copy(cr, df_request, index_columns, value_columns)
+
+        # find changed rows on the server
+        query = self._render_diff_query(mapping, where_clause, column_names, index_columns, value_columns, compare_types, insert, update, delete)
+        cr.execute(query)
+        rows = cr.fetchall()
+
+        # staging table is no longer needed
+        cr.execute(f'drop table {STAGING_TABLE}')
+
+        # get request lines that are inserted or updated
+        lines = {row[1] for row in rows if row[1] is not None}
+        df_request_changes = df_request[df_request['__line__'].isin(lines)]
+
+        # get database rows that are updated or deleted. Use coerce_float like read_sql_query does, to read numeric as float
+        db_rows = [row[2:] for row in rows if row[0]]
+        df_db = pd.DataFrame.from_records(db_rows, columns=[f'c{i}' for i in range(len(column_names))], coerce_float=True)
+
+        # set headers and convert values, like when reading the full table
+        df_db_changes = DbReader().convert(mapping, df_db, set_index=True)
+
+        return df_request_changes, df_db_changes
+
+    def _create_staging_table(self, cr, key_count, value_count):
+        # create columns for line number, unique columns and compared columns. Store values as text, they are cast when comparing
+        columns = ['line integer'] + [f'k{i} text' for i in range(key_count)] + [f'v{i} text' for i in range(value_count)]
+
+        # drop the staging table if a previous request left it behind
+        cr.execute(f'drop table if exists {STAGING_TABLE}')
+
+        # temporary table is only visible to this session and is not written to the WAL
+        cr.execute(f'create temporary table {STAGING_TABLE} ({", ".join(columns)}) on commit drop')
+
+    def _copy(self, cr, df_request, index_columns, value_columns):
+        # get unique columns from index
+        df = df_request.reset_index()[['__line__'] + index_columns + value_columns]
+
+        # write rows as csv. Empty values are read as null
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([self._to_text(value) for value in row] for row in df.itertuples(index=False))
+        buffer.seek(0)
+
+        # copy buffer into staging table
+        cr.copy_expert(f'copy {STAGING_TABLE} from stdin with (format csv)', buffer)
+
+    def _to_text(self, value):
+        # dictionaries, lists and frozen sets are json values
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        if isinstance(value, frozenset):
+            return json.dumps(dict(value))
+
+        # csv writer writes None as empty value, which is read as null
+        if pd.isna(value):
+            return None
+
+        # write booleans like postgres does
+        if pd.api.types.is_bool(value):
+            return 'true' if value else 'false'
+
+        # write dates in iso format
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+
+        return str(value)
+
+    def _compare_types(self, mapping):
+        # return compare type for each column that is read from the database, in the same order as the select clause
+        return [self._compare_type(a) for a in mapping.attributes if (not a) or (not a.skip and not a.orm_only)]
+
+    def _compare_type(self, attribute):
+        # empty columns are not compared
+        if not attribute:
+            return None
+
+        # columns with multiple attributes are concatenated as text
+        attributes = self._attributes(attribute)
+        if len(attributes) > 1:
+            return None
+
+        return COMPARE_TYPES.get(attributes[0].type)
+
+    def _attributes(self, attribute):
+        if isinstance(attribute, Attribute):
+            return [attribute]
+
+        if isinstance(attribute, Reference):
+            # recurse
+            return [a for nested in attribute.attributes for a in self._attributes(nested)]
+
+    def _render_diff_query(self, mapping, where_clause, column_names, index_columns, value_columns, compare_types, insert, update, delete):
+        """
+            select db.present, req.line, db.c0, db.c1
+            from (select true, s.* from (select books.title, authors.name from books ...) as s(c0, c1)) as db(present, c0, c1)
+            full join stimula_staging as req on cast(nullif(cast(req.k0 as text), '') as ...) = ...
+            where db.present is null or req.line is null or (db.present and req.line is not null and (... is distinct from ...))
+        """
+
+        # render select query of the mapping, including joins and filters
+        select_query = SelectRenderer().render(AliasEnricher().enrich(mapping), where_clause)
+
+        # name database columns by position, because column names are not valid identifiers
+        db_columns = [f'c{i}' for i in range(len(column_names))]
+
+        # match request and database rows on unique columns
+        keys = [self._compare(f'req.k{i}', f'db.{db_columns[column_names.index(c)]}', compare_types[c], '=') for i, c in enumerate(index_columns)]
+
+        # a matched row is changed if any of the compared columns is distinct
+        distinct = [self._compare(f'req.v{i}', f'db.{db_columns[column_names.index(c)]}', compare_types[c], 'is distinct from') for i, c in enumerate(value_columns)]
+
+        # only return rows for enabled operations
+        conditions = []
+
+        # request lines without database row are inserted
+        if insert:
+            conditions.append('db.present is null')
+
+        # database rows without request line are deleted
+        if delete:
+            conditions.append('req.line is null')
+
+        # matched rows with distinct values are updated
+        if update and distinct:
+            conditions.append(f'(db.present and req.line is not null and ({" or ".join(distinct)}))')
+
+        # nothing to return if no operation is enabled
+        where = ' or '.join(conditions) or 'false'
+
+        return f'select db.present, req.line, {", ".join(f"db.{c}" for c in db_columns)} ' \
+               f'from (select true, s.* from ({select_query}) as s({", ".join(db_columns)})) as db(present, {", ".join(db_columns)}) ' \
+               f'full join {STAGING_TABLE} as req on {" and ".join(keys)} ' \
+               f'where {where}'
+
+    def _compare(self, request_value, db_value, compare_type, operator):
+        # treat empty strings as null, like comparing in pandas does
+        request_value = f"nullif(cast({request_value} as text), '')"
+        db_value = f"nullif(cast({db_value} as text), '')"
+
+        # cast to compare type, if any
+        if compare_type:
+            request_value = f'cast({request_value} as {compare_type})'
+            db_value = f'cast({db_value} as {compare_type})'
+
+        return f'{request_value} {operator} {db_value}'
@@ -0,0 +1,115 @@
+"""
+This class caches prepared statements per connection, so that queries with the same text are parsed and planned only once.
+
+Most rows in a load share a few query shapes, because they only differ in which columns are set. The cache issues PREPARE the first
+time it sees a query, and EXECUTE for each row. Statements are evicted in least recently used order. Prepared statements are not
+transactional, so they survive rollbacks and stay valid for the lifetime of the connection.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import logging
+import re
+from collections import OrderedDict
+
+from .context import cnx_context
+
+_logger = logging.getLogger(__name__)
+
+
+class StatementCache:
+    def __init__(self, cnx, size=100):
+        self.cnx = cnx
+        self.size = size
+        # maps query text to a tuple of statement name and parameter names, or to None if the query can't be prepared
+        self._statements = OrderedDict()
+        self._counter = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get(size=100):
+        # get cache of the current connection, create a new one if the connection changed
+        cache = getattr(cnx_context, 'statement_cache', None)
+        if cache is None or cache.cnx is not cnx_context.cnx:
+            cache = StatementCache(cnx_context.cnx, size)
+            cnx_context.statement_cache = cache
+        return cache
+
+    def execute(self, cursor, query, params):
+        # get prepared statement, prepare on first use
+        statement = self._statement(cursor, query)
+
+        # execute query as is if it can't be prepared
+        if statement is None:
+            cursor.execute(query, params)
+            return
+
+        name, parameter_names = statement
+
+        # execute prepared statement with positional parameters
+        if parameter_names:
+            cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(parameter_names))})', [params[p] for p in parameter_names])
+        else:
+            cursor.execute(f'EXECUTE {name}')
+
+    def _statement(self, cursor, query):
+        if query in self._statements:
+            self.hits += 1
+            # mark as most recently used
+            self._statements.move_to_end(query)
+            return self._statements[query]
+
+        self.misses += 1
+
+        # evict least recently used statement
+        if len(self._statements) >= self.size:
+            _, evicted = self._statements.popitem(last=False)
+            if evicted is not None:
+                cursor.execute(f'DEALLOCATE {evicted[0]}')
+
+        statement = self._prepare(cursor, query)
+        self._statements[query] = statement
+        return statement
+
+    def _prepare(self, cursor, query):
+        # number parameters by order of first appearance, a parameter that appears more than once gets the same number
+        parameter_names = []
+
+        def replace(match):
+            if match.group(1) not in parameter_names:
+                parameter_names.append(match.group(1))
+            return f'${parameter_names.index(match.group(1)) + 1}'
+
+        # replace %(xyz)s with $1, and unescape %% because PREPARE is executed without parameters
+        prepared_query = re.sub(r'%\((\w+)\)s', replace, query).replace('%%', '%')
+
+        self._counter += 1
+        name = f'stimula_statement_{self._counter}'
+
+        # postgres must infer parameter types from the query, which fails for a parameter in 'is null'. Use a savepoint to continue if it fails
+        cursor.execute('SAVEPOINT stimula_prepare')
+        try:
+            cursor.execute(f'PREPARE {name} AS {prepared_query}')
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT stimula_prepare')
+            _logger.debug(f'Could not prepare query, executing without prepared statement: {query}, error: {e}')
+            return None
+        finally:
+            cursor.execute('RELEASE SAVEPOINT stimula_prepare')
+
+        return name, parameter_names
+
+
+class PreparedStatementCursor:
+    # wraps a cursor to execute queries as prepared statements. Other attributes, like rowcount and fetchone, are taken from the cursor
+
+    def __init__(self, cursor, statement_cache):
+        self._cursor = cursor
+        self._statement_cache = statement_cache
+
+    def execute(self, query, params=None):
+        self._statement_cache.execute(self._cursor, query, params or {})
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
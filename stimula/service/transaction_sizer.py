@@ -0,0 +1,76 @@
+"""
+This class adapts the number of rows per transaction to the measured cost of statements and commits.
+
+A fixed transaction size doesn't fit all loads. Wide rows, rows that join many tables, or a database that is busy with other users,
+make statements slow, so a transaction of a fixed number of rows holds its locks for a long time. Narrow rows on an idle database make
+statements fast, so the commits take a large share of the time.
+
+The sizer measures the time of the statements and of the commit of each transaction. The next transaction is large enough to keep the
+commit below a share of the statement time, but not so large that it holds its locks longer than a target duration. The size changes
+by no more than a factor of two per transaction, and stays within the configured bounds.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import time
+
+
+class TransactionSizer:
+    def __init__(self, min_size=100, max_size=10000, size=1000, target_duration=1.0, max_commit_share=0.05):
+        assert 0 < min_size <= max_size, f'Invalid transaction size bounds: {min_size}, {max_size}'
+        self.min_size = min_size
+        self.max_size = max_size
+        # number of rows in the current transaction
+        self.size = self._clamp(size)
+        # maximum time in seconds that a transaction should hold its locks
+        self.target_duration = target_duration
+        # maximum share of the commit in the time of a transaction
+        self.max_commit_share = max_commit_share
+        # number of rows of each committed transaction, for the report
+        self.sizes = []
+        # start time of the current transaction
+        self._started = time.perf_counter()
+
+    def begin(self):
+        # start measuring the first transaction
+        self._started = time.perf_counter()
+
+    def commit(self, end_transaction, row_count):
+        # end the transaction with the given function, measure it, and adapt the size of the next transaction
+        started = time.perf_counter()
+        end_transaction()
+        ended = time.perf_counter()
+
+        self.record(row_count, started - self._started, ended - started)
+        self._started = ended
+
+    def record(self, row_count, statement_seconds, commit_seconds):
+        # adapt the size of the next transaction to the time that the statements and the commit of a transaction took
+        self.sizes.append(row_count)
+        if row_count <= 0 or statement_seconds <= 0:
+            return
+
+        row_seconds = statement_seconds / row_count
+
+        # smallest size at which the commit takes no more than its share of the time, and largest size that holds locks no longer than the target
+        commit_size = commit_seconds / (self.max_commit_share * row_seconds)
+        lock_size = self.target_duration / row_seconds
+
+        # prefer short transactions, as long as the commit overhead is acceptable
+        target = min(max(commit_size, self.min_size), lock_size)
+
+        # change gradually, because the measurements of a single transaction are noisy
+        target = min(max(target, self.size / 2), self.size * 2)
+        self.size = self._clamp(int(target))
+
+    def statistics(self):
+        # number of transactions, and the smallest, largest and last transaction size
+        return {
+            'commits': len(self.sizes),
+            'min_size': min(self.sizes, default=0),
+            'max_size': max(self.sizes, default=0),
+            'next_size': self.size,
+        }
+
+    def _clamp(self, size):
+        return min(max(size, self.min_size), self.max_size)
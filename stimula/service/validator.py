@@ -0,0 +1,279 @@
+"""
+This class validates inserted and updated rows against the table definition, before any statement is sent to the database.
+
+Rows that violate a not null constraint, that have a value that is too long or out of range for its column, or that clash with a unique
+constraint, fail anyway when they're executed. Each failure costs a rollback to a savepoint. The validator finds these rows with
+column-wise pandas operations, and reports them as failed rows instead.
+
+Checks are limited to what can be decided from the request and the table definition:
+- not null: an empty value in a column that must not be null. For inserts, only columns without a default, because empty values are not inserted
+- length: a string that is longer than a varchar or char column allows
+- range: a value that is not a number, or that is out of range, for an integer or numeric column
+- unique: inserted rows with the same values for a unique constraint, or with the values of an existing row that the load doesn't
+  delete or update to other values
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import pandas as pd
+from sqlalchemy import UniqueConstraint
+
+from .context import cnx_context
+from .model_service import ModelService
+from .query_executor import FailedQueryExecutor, OperationType, _replace_placeholders
+from ..stml.header_renderer import HeaderRenderer
+from ..stml.model import Entity, Attribute, Reference
+from ..stml.sql.values_renderer import ValuesClauseRenderer, batch_parameter_values, BATCH_ALIAS, BATCH_ROW_INDEX
+
+# range of postgres integer types
+INTEGER_RANGES = {
+    'smallint': (-2 ** 15, 2 ** 15 - 1),
+    'integer': (-2 ** 31, 2 ** 31 - 1),
+    'bigint': (-2 ** 63, 2 ** 63 - 1),
+}
+
+
+class Validator:
+    def __init__(self, model_service: ModelService, batch_size=1000):
+        self._model_service = model_service
+        # maximum number of rows to look up in a single query
+        self._batch_size = batch_size
+
+    def validate(self, mapping: Entity, diffs, context=None, check_existing=True):
+        # get from tuple
+        inserts, updates, deletes = diffs
+
+        # get table definition
+        table = self._model_service.get_table(mapping.name)
+
+        # get columns in the table, with the header of each column in the data frames
+        columns = self._columns(mapping, table)
+
+        # validate inserts and updates
+        insert_errors = self._validate_inserts(mapping, table, columns, inserts, updates, deletes, check_existing)
+        update_errors = self._validate_updates(columns, updates)
+
+        # create failed executors for rows with errors, in order of the rows
+        failed = self._failed_executors(inserts, insert_errors, OperationType.INSERT, mapping.name, context)
+        failed += self._failed_executors(updates, update_errors, OperationType.UPDATE, mapping.name, context)
+
+        # remove failed rows from the diffs, so that they're not executed
+        return (self._drop_failed(inserts, insert_errors), self._drop_failed(updates, update_errors), deletes), failed
+
+    def _columns(self, mapping: Entity, table):
+        # get headers in the same order as the attributes
+        headers = HeaderRenderer().render_list(mapping, include_skip=True, include_orm_only=True)
+
+        # map header to table column. Skip columns that are not written, or that are written in a way that the checks don't apply to
+        columns = {}
+        for attribute, header in zip(mapping.attributes, headers):
+            if attribute.skip or attribute.orm_only or attribute.key or attribute.name not in table.columns:
+                continue
+            if isinstance(attribute, Reference) and attribute.extension:
+                continue
+            columns[header] = (attribute, table.columns[attribute.name])
+        return columns
+
+    def _validate_inserts(self, mapping, table, columns, inserts, updates, deletes, check_existing):
+        # list of tuples with a mask of rows that fail a check, and the error message
+        errors = []
+        if inserts.empty:
+            return errors
+
+        for header, (attribute, column) in columns.items():
+            values = inserts[header]
+
+            # empty values are not inserted, so the column must have a default. Empty unique values are inserted as null
+            if not column.nullable and (column.server_default is None or attribute.unique):
+                errors.append((_is_empty(values), f"Column '{column.name}' must not be empty"))
+
+            # references are resolved to ids, so the other checks only apply to plain columns
+            if isinstance(attribute, Attribute):
+                errors.extend(self._validate_values(column, values))
+
+        # find rows that clash with other rows or existing rows on a unique constraint
+        errors.extend(self._validate_unique(mapping, table, columns, inserts, updates, deletes, check_existing))
+
+        return errors
+
+    def _validate_updates(self, columns, updates):
+        errors = []
+        if updates.empty:
+            return errors
+
+        for header, (attribute, column) in columns.items():
+            # only modified columns are updated, their new value is in the 'self' column
+            if (header, 'self') not in updates.columns:
+                continue
+            values = updates[(header, 'self')]
+
+            # an empty value sets the column to null
+            if not column.nullable:
+                errors.append((_is_empty(values), f"Column '{column.name}' must not be empty"))
+
+            if isinstance(attribute, Attribute):
+                errors.extend(self._validate_values(column, values))
+
+        return errors
+
+    def _validate_values(self, column, values):
+        # validate length and range of values against the column type
+        errors = []
+        empty = _is_empty(values)
+
+        # strings must not be longer than the column allows
+        length = getattr(column.type, 'length', None)
+        if isinstance(length, int):
+            too_long = ~empty & values.astype('string').str.len().gt(length).fillna(False).astype(bool)
+            errors.append((too_long, f"Value too long for column '{column.name}', maximum length is {length}"))
+
+        # get base type name, without length or precision
+        type_name = str(column.type).lower().split('(')[0]
+
+        if type_name in INTEGER_RANGES or type_name in ['numeric', 'decimal', 'real', 'float', 'double precision']:
+            # values that can't be converted to a number are not valid
+            numbers = pd.to_numeric(values, errors='coerce')
+            errors.append((~empty & numbers.isna(), f"Value is not a number for column '{column.name}'"))
+
+            # integers must fit in the column type
+            if type_name in INTEGER_RANGES:
+                low, high = INTEGER_RANGES[type_name]
+                out_of_range = numbers.notna() & (numbers.lt(low) | numbers.gt(high) | numbers.mod(1).ne(0))
+                errors.append((~empty & out_of_range.fillna(False).astype(bool), f"Value out of range for column '{column.name}' of type {type_name}"))
+
+            # numbers must fit in the precision of a numeric column
+            precision = getattr(column.type, 'precision', None)
+            if type_name in ['numeric', 'decimal'] and precision:
+                limit = 10 ** (precision - (column.type.scale or 0))
+                out_of_range = numbers.abs().ge(limit)
+                errors.append((~empty & out_of_range.fillna(False).astype(bool), f"Value out of range for column '{column.name}' of type {column.type}"))
+
+        return errors
+
+    def _validate_unique(self, mapping, table, columns, inserts, updates, deletes, check_existing):
+        errors = []
+
+        # map column name to header of plain columns
+        headers = {column.name: header for header, (attribute, column) in columns.items() if isinstance(attribute, Attribute)}
+
+        for name, column_names in self._unique_constraints(table):
+            # can only check constraints on columns that are all in the request
+            if not all(column_name in headers for column_name in column_names):
+                continue
+
+            # rows with an empty value never clash, because null values are distinct
+            values = inserts[[headers[column_name] for column_name in column_names]]
+            complete = ~values.apply(_is_empty).any(axis=1)
+
+            # the first row with a value is inserted, the next rows clash with it
+            duplicated = complete & values.duplicated(keep='first')
+            errors.append((duplicated, f"Duplicate value for unique constraint '{name}' on {', '.join(column_names)}"))
+
+            # values that the load deletes or updates are free once those rows are executed, so inserts of them are retried instead
+            released = self._released_values([headers[column_name] for column_name in column_names], updates, deletes)
+            if check_existing and released is not None:
+                candidates = values[complete & ~duplicated]
+                candidates = candidates[[tuple(_python_values(row)) not in released for row in candidates.itertuples(index=False)]]
+                existing = self._find_existing(table, column_names, candidates)
+                errors.append((inserts.index.isin(existing), f"Value already exists for unique constraint '{name}' on {', '.join(column_names)}"))
+
+        return errors
+
+    def _released_values(self, headers, updates, deletes):
+        # returns the values of a unique constraint that the load deletes or updates to other values, or None if they're not known
+        released = set()
+
+        if not deletes.empty:
+            # without updates, only the unique columns of deleted rows are read, so their other values are not known
+            if not all(header in deletes.columns for header in headers):
+                return None
+            released.update(tuple(_python_values(row)) for row in deletes[headers].itertuples(index=False))
+
+        # modified columns have their old value in the 'other' column
+        modified = [header for header in headers if (header, 'other') in updates.columns]
+        if updates.empty or not modified:
+            return released
+
+        # rows that change a value of the constraint release their old values
+        changed = pd.DataFrame({header: updates[(header, 'self')].notna() | updates[(header, 'other')].notna() for header in modified})
+        rows = changed.any(axis=1)
+
+        # the old value of a cell that didn't change is not in the diff, unless it's a unique column, which is the same on both sides
+        if (~changed[rows]).any(axis=None) or any((header, 'other') not in updates.columns and (header, '') not in updates.columns for header in headers):
+            return None
+
+        old_values = updates[rows][[(header, 'other') if header in modified else (header, '') for header in headers]]
+        released.update(tuple(_python_values(row)) for row in old_values.itertuples(index=False))
+        return released
+
+    def _unique_constraints(self, table):
+        # get name and column names of unique constraints and unique indexes
+        constraints = [(c.name, [column.name for column in c.columns]) for c in table.constraints if isinstance(c, UniqueConstraint)]
+        indexes = [(i.name, [column.name for column in i.columns]) for i in table.indexes if i.unique and i.columns]
+        return constraints + indexes
+
+    def _find_existing(self, table, column_names, values):
+        # find rows in the table with the same values, return the index of the request rows
+        existing = []
+        if values.empty:
+            return existing
+
+        # render a values list with a parameter per column, typed like the column
+        entity = Entity(table.name, [Attribute(name, parameter=name, type=str(table.columns[name].type).lower()) for name in column_names])
+        where_clause = ' and '.join(f'{table.name}.{name} = {BATCH_ALIAS}.{name}' for name in column_names)
+
+        for start in range(0, len(values), self._batch_size):
+            batch = values.iloc[start:start + self._batch_size]
+
+            query = f'select distinct {BATCH_ALIAS}.{BATCH_ROW_INDEX} from {ValuesClauseRenderer().render(entity, len(batch), row_index=True)}, {table.name} where {where_clause}'
+            params = batch_parameter_values([dict(zip(column_names, _python_values(row))) for row in batch.itertuples(index=False)])
+
+            cnx_context.cr.execute(_replace_placeholders(query), params)
+            existing.extend(batch.index[row_index] for row_index, in cnx_context.cr.fetchall())
+
+        return existing
+
+    def _failed_executors(self, df, errors, operation_type, table_name, context):
+        # create a failed executor per row with at least one error, with the messages of all errors
+        if not errors:
+            return []
+
+        failed = _any(errors, df.index)
+        masks = [(_mask(mask, df.index), message) for mask, message in errors]
+
+        # the line number column of updates has a second level, so select it by position
+        line_numbers = df['__line__']
+        if isinstance(line_numbers, pd.DataFrame):
+            line_numbers = line_numbers.iloc[:, 0]
+
+        return [FailedQueryExecutor(int(line_numbers[index]), operation_type, table_name, context, '; '.join(message for mask, message in masks if mask[index]))
+                for index in df.index[failed]]
+
+    def _drop_failed(self, df, errors):
+        # remove rows with errors
+        if not errors:
+            return df
+        return df[~_any(errors, df.index)]
+
+
+def _is_empty(values):
+    # a value is empty if it's missing or an empty string
+    return values.isna() | values.astype('string').eq('').fillna(False).astype(bool)
+
+
+def _mask(mask, index):
+    # convert mask to a boolean series with the index of the data frame
+    return pd.Series(mask, index=index).astype(bool) if not isinstance(mask, pd.Series) else mask.astype(bool)
+
+
+def _any(errors, index):
+    # combine masks of all errors
+    result = pd.Series(False, index=index)
+    for mask, message in errors:
+        result |= _mask(mask, index)
+    return result
+
+
+def _python_values(row):
+    # convert numpy values to python values, so they can be passed as parameters
+    return [value.item() if hasattr(value, 'item') else value for value in row]
@@ -30,7 +30,7 @@ class Entity:
 
 class AbstractAttribute(ABC):
     def __init__(self, name: str, unique: bool, skip: bool, exp: str, default_value: str, orm_only: bool, enabled: bool, primary_key: bool, in_use: bool, default: bool, deduplicate: bool,
-                 substitute: str, key: str, filter_src: str = None) -> None:
+                 substitute: str, key: str, filter_src: str = None, backend: str = None) -> None:
         self.name: str = name
         self.unique: bool = unique
         self.skip: bool = skip
@@ -45,10 +45,12 @@ class AbstractAttribute(ABC):
         self.substitute: str = substitute
         self.key: str = key
         self.filter_src: str = filter_src
+        self.backend: str = backend
 
     def to_dict(self) -> Dict[str, any]:
         data = {"name": self.name, 'unique': self.unique, 'skip': self.skip, 'exp': self.exp, 'default_value': self.default_value, 'orm_only': self.orm_only, 'enabled': self.enabled,
-                'primary_key': self.primary_key, 'in_use': self.in_use, 'default': self.default, 'deduplicate': self.deduplicate, 'substitute': self.substitute, 'key': self.key, 'filter_src': self.filter_src}
+                'primary_key': self.primary_key, 'in_use': self.in_use, 'default': self.default, 'deduplicate': self.deduplicate, 'substitute': self.substitute, 'key': self.key, 'filter_src': self.filter_src,
+                'backend': self.backend}
         return {key: value for key, value in data.items() if value}
 
     def __repr__(self) -> str:
@@ -71,14 +73,15 @@ class AbstractAttribute(ABC):
             and self.deduplicate == other.deduplicate \
             and self.substitute == other.substitute \
             and self.key == other.key \
-            and self.filter_src == other.filter_src
+            and self.filter_src == other.filter_src \
+            and self.backend == other.backend
 
 
 class Attribute(AbstractAttribute):
     def __init__(self, name: str, unique=False, skip=False, exp='', default_value=None, orm_only=False, enabled: bool = False, primary_key: bool = False, in_use: bool = False, default: bool = False,
                  deduplicate: bool = False, substitute: str = None, key: str = None, filter_src: str = None,
-                 type: str = None, parameter: str = None, filter: str = None, api: str = None, url: str = None, auth: str = None) -> None:
-        super().__init__(name, unique, skip, exp, default_value, orm_only, enabled, primary_key, in_use, default, deduplicate, substitute, key, filter_src)
+                 type: str = None, parameter: str = None, filter: str = None, api: str = None, url: str = None, auth: str = None, backend: str = None) -> None:
+        super().__init__(name, unique, skip, exp, default_value, orm_only, enabled, primary_key, in_use, default, deduplicate, substitute, key, filter_src, backend)
         self.type: str = type
         self.parameter: str = parameter
         self.filter: str = filter
@@ -106,8 +109,8 @@ class Attribute(AbstractAttribute):
 class Reference(AbstractAttribute):
     def __init__(self, name: str, attributes: List['AbstractAttribute'] = [], unique: bool = False, skip: bool = False, exp: str = '', default_value: str = None, orm_only: bool = False,
                  enabled: bool = False, primary_key: bool = False, in_use: bool = False, default: bool = False, deduplicate: bool = False, substitute: str = None, key: str = None, filter_src: str = None,
-                 table: str = None, target_name: str = None, qualifier: str = None, extension: bool = False, alias: str = None, id: str = None) -> None:
-        super().__init__(name, unique, skip, exp, default_value, orm_only, enabled, primary_key, in_use, default, deduplicate, substitute, key, filter_src)
+                 table: str = None, target_name: str = None, qualifier: str = None, extension: bool = False, alias: str = None, id: str = None, backend: str = None) -> None:
+        super().__init__(name, unique, skip, exp, default_value, orm_only, enabled, primary_key, in_use, default, deduplicate, substitute, key, filter_src, backend)
         self.attributes: List[AbstractAttribute] = attributes
         self.table = table
         self.target_name = target_name
@@ -9,6 +9,7 @@ from typing import List
 from stimula.stml.model import Entity, AbstractAttribute, Reference
 from stimula.stml.sql.foreign_where_renderer import ForeignWhereClauseRenderer
 from stimula.stml.sql.insert_renderer import ReturningClauseRenderer
+from stimula.stml.sql.values_renderer import ValuesClauseRenderer, batch_parameters, BATCH_ALIAS, BATCH_ROW_INDEX
 from stimula.stml.sql.where_renderer import WhereClauseRenderer
 
 
@@ -34,16 +35,48 @@ class DeleteRenderer:
         return result
 
 
+class BatchDeleteRenderer:
+    """
+        delete from c
+        using (values (0, cast(:c1__0 as text), cast(:b1__0 as text)), (1, :c1__1, :b1__1)) as batch_values(row_index, c1, b1), c
+        left join b on c.c0 = b.b0
+        where c.c1 = batch_values.c1 and b.b1 = batch_values.b1
+        returning batch_values.row_index
+    """
+
+    def render(self, mapping: Entity, row_count: int):
+        using_clauses = UsingClauseRenderer().render_as_list(mapping)
+        where_clause = WhereClauseRenderer().render(mapping)
+        foreign_where_clause = ForeignWhereClauseRenderer(False, True).render(mapping)
+        # in a delete statement, the foreign where clause always needs an 'and'
+        foreign_where_clause = ' and ' + foreign_where_clause if foreign_where_clause else ''
+        # returning clause is needed if we need to delete from an extension table
+        returning_clause = ReturningClauseRenderer().render(mapping)
+
+        # delete using the values list first, then using the foreign key tables
+        using_clause = ' using ' + ', '.join([ValuesClauseRenderer().render(mapping, row_count, row_index=True)] + using_clauses)
+
+        # return the index of each deleted row first, so that success can be reported per row, then the id for the extension table
+        row_index_clause = f' returning {BATCH_ALIAS}.{BATCH_ROW_INDEX}'
+        returning_clause = returning_clause.replace(' returning ', f'{row_index_clause}, ') if returning_clause else row_index_clause
+
+        return f'delete from {mapping.name}{using_clause}{batch_parameters(where_clause)}{batch_parameters(foreign_where_clause)}{returning_clause}'
+
+
 class UsingClauseRenderer:
     # this class is similar to FromClauseCompiler, but it only uses unique columns
     def render(self, mapping: Entity):
         # get clauses for unique foreign keys
-        clauses = [self._attribute(a) for a in mapping.attributes if a.unique and isinstance(a, Reference)]
+        clauses = self.render_as_list(mapping)
 
         if not clauses:
             return ''
         return f' using ' + ', '.join(clauses)
 
+    def render_as_list(self, mapping: Entity) -> List[str]:
+        # return clauses as list, so a batch delete can add the values list
+        return [self._attribute(a) for a in mapping.attributes if a.unique and isinstance(a, Reference)]
+
     def _attribute(self, attribute: Reference) -> str:
 
         # add target table
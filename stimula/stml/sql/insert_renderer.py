@@ -9,6 +9,11 @@ from typing import List
 from stimula.stml.model import Entity, AbstractAttribute, Attribute, Reference
 from stimula.stml.sql.foreign_where_renderer import ForeignWhereClauseRenderer
 from stimula.stml.sql.select_renderer import SelectRenderer
+from stimula.stml.sql.values_renderer import ValuesClauseRenderer, batch_parameters, BATCH_ALIAS, BATCH_ROW_INDEX
+
+# names of the rows to insert and of the insert in a batch query
+BATCH_ROWS = 'batch_rows'
+BATCH_INSERT = 'batch_insert'
 
 
 class InsertRenderer:
@@ -38,6 +43,71 @@ class InsertRenderer:
         return f'{insert_clause}{select_clause}{from_clause}{where_clause}{returning_clause}'
 
 
+class BatchInsertRenderer:
+    """
+        header: 'c1[unique=true], c3(b1)'
+
+        query:
+        with batch_rows(row_index, c1, c3) as (
+            select batch_values.row_index, batch_values.c1, b.b0
+            from (values (0, cast(:c1__0 as text), cast(:b1__0 as text)), (1, :c1__1, :b1__1)) as batch_values(row_index, c1, b1), b
+            where b.b1 = batch_values.b1),
+        batch_insert as (insert into c(c1, c3) select c1, c3 from batch_rows)
+        select row_index from batch_rows
+    """
+
+    def render(self, mapping: Entity, row_count: int):
+        # a batch can't return the ids that we need to insert extension records
+        assert not ReturningClauseRenderer().render(mapping), f'Can not insert extension records in a batch for table {mapping.name}'
+
+        insert_clause = InsertClauseRenderer().render(mapping)
+        select_clause = SelectClauseRenderer().render(mapping)
+        where_clause = ForeignWhereClauseRenderer(True, False).render(mapping)
+
+        # select from the values list first, then from the foreign key tables
+        from_clauses = [ValuesClauseRenderer().render(mapping, row_count, row_index=True)] + FromClauseRenderer(True).compile_as_list(mapping)
+        from_clause = ' from ' + ', '.join(from_clauses)
+
+        # this where clause is also used in update query. Here we need 'where'
+        if where_clause:
+            where_clause = ' where ' + batch_parameters(where_clause)
+
+        # an insert can't return columns of the values list, so select the rows with their index first, then insert them
+        columns = ', '.join(a.name for a in mapping.attributes if not (isinstance(a, Reference) and a.extension))
+        select_clause = batch_parameters(select_clause).replace(' select ', f' select {BATCH_ALIAS}.{BATCH_ROW_INDEX}, ', 1)
+        rows_clause = f'with {BATCH_ROWS}({BATCH_ROW_INDEX}, {columns}) as ({select_clause.strip()}{from_clause}{where_clause})'
+        insert_clause = f'{BATCH_INSERT} as ({insert_clause} select {columns} from {BATCH_ROWS})'
+
+        # return the index of each selected row, so that the number of inserted rows can be checked per row
+        return f'{rows_clause}, {insert_clause} select {BATCH_ROW_INDEX} from {BATCH_ROWS}'
+
+
+class CopyRenderer:
+    """
+        header: 'c1[unique=true], c2'
+
+        query:
+        copy c(c1, c2) from stdin with (format csv)
+    """
+
+    def render(self, mapping: Entity):
+        # copy writes values to columns as they are, so it can't look up foreign keys or build json objects
+        assert self.is_copyable(mapping), f'Can only copy plain columns into table {mapping.name}'
+
+        # get column names
+        columns = [a.name for a in mapping.attributes]
+
+        return f"copy {mapping.name}({', '.join(columns)}) from stdin with (format csv)"
+
+    def render_parameters(self, mapping: Entity):
+        # get parameter names, in the same order as the copied columns
+        return [a.parameter for a in mapping.attributes]
+
+    def is_copyable(self, mapping: Entity):
+        # only plain columns can be copied, not references and not keys in a json column
+        return all(isinstance(a, Attribute) and not a.key for a in mapping.attributes)
+
+
 class InsertClauseRenderer:
     def render(self, mapping: Entity):
         # get attributes. Skip extensions on base table, because they are not columns. We'll insert them in a separate query
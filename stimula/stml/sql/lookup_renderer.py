@@ -0,0 +1,39 @@
+"""
+This class renders a query that looks up the ids of a reference for a batch of key values, so that rows can set foreign keys without a join.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+from stimula.stml.model import Entity, Reference
+from stimula.stml.sql.foreign_where_renderer import ForeignWhereClauseRenderer
+from stimula.stml.sql.insert_renderer import FromClauseRenderer
+from stimula.stml.sql.values_renderer import ValuesClauseRenderer, batch_parameters, BATCH_ALIAS, BATCH_ROW_INDEX
+
+
+class LookupRenderer:
+    """
+        header: 'c1[unique=true], c3(b1)'
+
+        query for reference c3:
+        select batch_values.row_index, b.b0
+        from (values (0, cast(:b1__0 as text)), (1, :b1__1)) as batch_values(row_index, b1), b
+        where b.b1 = batch_values.b1
+    """
+
+    def render(self, mapping: Entity, reference: Reference, row_count: int):
+        # a reference on the root table that is an extension, is not a foreign key
+        assert not reference.extension, f'Can not look up extension {reference.name} of table {mapping.name}'
+
+        # render the reference as if it's the only attribute of the mapping
+        entity = Entity(mapping.name, [reference])
+
+        # select the row index of the key values, and the id they refer to
+        target_alias = reference.alias or reference.table
+        select_clause = f'select {BATCH_ALIAS}.{BATCH_ROW_INDEX}, {target_alias}.{reference.target_name}'
+        where_clause = ForeignWhereClauseRenderer(True, False).render(entity)
+
+        # select from the values list first, then from the referenced tables
+        from_clauses = [ValuesClauseRenderer().render(entity, row_count, row_index=True)] + FromClauseRenderer(True).compile_as_list(entity)
+        from_clause = ' from ' + ', '.join(from_clauses)
+
+        return f'{select_clause}{from_clause} where {batch_parameters(where_clause)}'
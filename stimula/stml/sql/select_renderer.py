@@ -23,16 +23,17 @@ class SelectRenderer:
         order by c.c1
     """
 
-    def render(self, mapping: Entity, where_clause=None):
+    def render(self, mapping: Entity, where_clause=None, order_by=None):
         """
         Compiles a mapping into a select query
         :param mapping: the mapping
         :param where_clause: a free where clause for the caller to specify
+        :param order_by: expressions to order by instead of the unique columns
         :return: the select query
         """
         select_clause = SelectClauseRenderer().render(mapping)
         join_clause = JoinClauseRenderer().render(mapping)
-        order_by_clause = OrderByClauseRenderer().render(mapping)
+        order_by_clause = f' order by {order_by}' if order_by else OrderByClauseRenderer().render(mapping)
 
         # render [filter="...$..."] headers into a where clause, replacing '$' with the column name
         where = WhereClauseRenderer().render(mapping, where_clause)
@@ -58,15 +59,15 @@ class SelectRenderer:
 
 class SelectClauseRenderer:
     def render(self, mapping: Entity):
+        # comma separate columns
+        return 'select ' + ', '.join(self.render_columns(mapping))
 
+    def render_columns(self, mapping: Entity):
         # Include empty columns. Skip cells with skip=true or orm-only modifier. We need those when reading CSV, but not when reading from DB
         attributes = [self._attribute(a, mapping.name) for a in mapping.attributes if (not a) or (not a.skip and not a.orm_only)]
 
         # join attributes per column
-        joined_columns = [self._join_attributes(a) for a in attributes]
-
-        # comma separate columns
-        return 'select ' + ', '.join(joined_columns)
+        return [self._join_attributes(a) for a in attributes]
 
     def _attribute(self, attribute: AbstractAttribute, alias) -> List[Tuple]:
         # column may be empty
@@ -6,6 +6,7 @@ Email: romke@rnadesign.net
 """
 from .foreign_where_renderer import ForeignWhereClauseRenderer
 from .insert_renderer import FromClauseRenderer
+from .values_renderer import ValuesClauseRenderer, batch_parameters, BATCH_ALIAS, BATCH_ROW_INDEX
 from .where_renderer import WhereClauseRenderer
 from ..model import Entity, AbstractAttribute, Attribute, Reference
 
@@ -31,6 +32,34 @@ class UpdateRenderer:
         return result
 
 
+class BatchUpdateRenderer:
+    """
+        header: 'c1[unique=true], c2, c3(b1)'
+
+        query:
+        update c set c2 = batch_values.c2, c3 = b.b0
+        from (values (0, cast(:c1__0 as text), cast(:c2__0 as text), cast(:b1__0 as text)), (1, :c1__1, :c2__1, :b1__1)) as batch_values(row_index, c1, c2, b1), b
+        where c.c1 = batch_values.c1 and b.b1 = batch_values.b1
+        returning batch_values.row_index
+    """
+
+    def render(self, mapping: Entity, row_count: int):
+        update_clause = UpdateClauseRenderer().render(mapping)
+        where_clause = WhereClauseRenderer().render(mapping)
+        foreign_where_clause = ForeignWhereClauseRenderer(False, False).render(mapping)
+
+        # update from the values list first, then from the foreign key tables
+        from_clauses = [ValuesClauseRenderer().render(mapping, row_count, row_index=True)] + FromClauseRenderer(False).compile_as_list(mapping)
+        from_clause = ' from ' + ', '.join(from_clauses)
+
+        result = f'{batch_parameters(update_clause)}{from_clause}{batch_parameters(where_clause)}'
+        if foreign_where_clause:
+            result += ' and ' + batch_parameters(foreign_where_clause)
+
+        # return the index of each updated row, so that success can be reported per row
+        return f'{result} returning {BATCH_ALIAS}.{BATCH_ROW_INDEX}'
+
+
 class UpdateClauseRenderer:
     def render(self, mapping: Entity):
 
@@ -0,0 +1,79 @@
+"""
+This class renders a values list that binds the parameters of a batch of rows, so that a single statement can process all rows in the batch.
+
+Author: Romke Jonker
+Email: romke@stml.io
+"""
+import re
+
+from stimula.stml.model import Entity
+from stimula.stml.sql.parameter_types_renderer import ParameterTypesRenderer
+
+# alias of the values list in batch statements
+BATCH_ALIAS = 'batch_values'
+
+# column of the values list that holds the index of the row in the batch
+BATCH_ROW_INDEX = 'row_index'
+
+
+class ValuesClauseRenderer:
+    """
+        (values (cast(:title__0 as text), cast(:name__0 as text)), (:title__1, :name__1)) as batch_values(title, name)
+
+        with row index:
+        (values (0, cast(:title__0 as text)), (1, :title__1)) as batch_values(row_index, title)
+    """
+
+    def render(self, mapping: Entity, row_count: int, row_index: bool = False):
+        # get parameter names and types, in the same order as the parameter dictionaries of the rows
+        parameter_types = ParameterTypesRenderer().render(mapping)
+
+        # assert there's at least one row
+        assert row_count > 0, 'Values list must have at least one row'
+
+        # render a tuple of parameters for each row
+        rows = [self._row(parameter_types, index, row_index) for index in range(row_count)]
+
+        # the row index column lets a statement return which rows it affected
+        columns = ([BATCH_ROW_INDEX] if row_index else []) + list(parameter_types.keys())
+
+        return f"(values {', '.join(rows)}) as {BATCH_ALIAS}({', '.join(columns)})"
+
+    def _row(self, parameter_types: dict, index: int, row_index: bool):
+        # postgres infers the column types of a values list from its first row, and defaults to text for untyped literals.
+        # So cast the first row to the column types, and leave the other rows as they are.
+        if index == 0:
+            values = [self._cast(batch_parameter_name(name, index), type) for name, type in parameter_types.items()]
+        else:
+            values = [f':{batch_parameter_name(name, index)}' for name in parameter_types.keys()]
+
+        # prepend the row index as a literal, so it doesn't need a parameter
+        if row_index:
+            values = [str(index)] + values
+
+        return '(' + ', '.join(values) + ')'
+
+    def _cast(self, parameter_name: str, type: str):
+        # skip cast if type is not known
+        if not type:
+            return f':{parameter_name}'
+
+        # remove length and precision, because an explicit cast silently truncates values that would otherwise raise an error
+        base_type = re.sub(r'\(.*\)', '', type).strip()
+
+        return f'cast(:{parameter_name} as {base_type})'
+
+
+def batch_parameter_name(name: str, index: int):
+    # parameter name of a row in the values list
+    return f'{name}__{index}'
+
+
+def batch_parameters(clause: str):
+    # replace :xyz with batch_values.xyz, but make sure to not replace the '::text' type cast in to_jsonb(:parameter::text)
+    return re.sub(r'(?<!:):(\w+)', rf'{BATCH_ALIAS}.\1', clause)
+
+
+def batch_parameter_values(params_list: list):
+    # combine the parameter dictionaries of all rows into a single dictionary, using the parameter names of the values list
+    return {batch_parameter_name(name, index): value for index, params in enumerate(params_list) for name, value in params.items()}
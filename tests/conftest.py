@@ -247,6 +247,15 @@ def context(cr):
     cnx_context.cr = cr
 
 
+@pytest.fixture
+def prepared_transactions(cnx):
+    # two phase commit requires max_prepared_transactions to be set on the server
+    with cnx.cursor() as cr:
+        cr.execute('show max_prepared_transactions')
+        if int(cr.fetchone()[0]) == 0:
+            pytest.skip('max_prepared_transactions is not set on the server')
+
+
 @pytest.fixture
 def test_table(cnx):
     with cnx:
@@ -13,3 +13,8 @@ def test_get_select_statement(books, db, model_enricher):
 
     expected = 'select books.title, authors.name from books left join authors on books.authorid = authors.author_id order by books.title'
     assert query == expected
+
+
+def test_sort_tables(books, db):
+    # tables come after the tables they reference, a reference to the table itself is ignored
+    assert PostgresModelService().sort_tables(['books', 'authors', 'publishers']) == ['publishers', 'authors', 'books']
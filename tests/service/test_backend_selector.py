@@ -0,0 +1,87 @@
+import pytest
+
+from stimula.service.backend_selector import BackendSelector, RowBackend, BACKENDS, register_backend
+from stimula.service.query_executor import OperationType
+from stimula.service.sql_creator import InsertSqlCreator, BatchUpdateSqlCreator
+from stimula.stml.stml_parser import StmlParser
+
+
+def _mapping(model_enricher, table_name, header):
+    return model_enricher.enrich(StmlParser().parse_csv(table_name, header))
+
+
+def test_select_default(books, model_enricher):
+    # verify that backends are selected like before, if no backend is given
+    authors = _mapping(model_enricher, 'authors', 'name[unique=true]')
+    books = _mapping(model_enricher, 'books', 'title[unique=true], authorid(name)')
+
+    assert BackendSelector().select(books, OperationType.INSERT, 1000) == 'row'
+    assert BackendSelector(batch_size=100).select(books, OperationType.UPDATE, 1) == 'batch'
+    assert BackendSelector(copy=True).select(authors, OperationType.INSERT, 1) == 'copy'
+    # only plain columns can be copied, and only inserts
+    assert BackendSelector(copy=True).select(books, OperationType.INSERT, 1) == 'row'
+    assert BackendSelector(copy=True).select(authors, OperationType.DELETE, 1) == 'row'
+
+
+def test_select_orm_table(books, ir_attachment, model_enricher):
+    # verify that attachments are written through the ORM, even if another backend is selected
+    attachments = _mapping(model_enricher, 'ir_attachment', 'name[unique=true]')
+
+    assert BackendSelector(orm=object()).select(attachments, OperationType.INSERT, 1) == 'orm'
+    assert BackendSelector('auto', orm=object()).select(attachments, OperationType.INSERT, 1000) == 'orm'
+    assert BackendSelector('row', orm=object()).select(attachments, OperationType.INSERT, 1000) == 'orm'
+
+    with pytest.raises(AssertionError, match='ORM is required'):
+        BackendSelector().select(attachments, OperationType.INSERT, 1)
+
+
+def test_select_automatic(books, model_enricher):
+    # verify that the cheapest safe backend is selected
+    authors = _mapping(model_enricher, 'authors', 'name[unique=true]')
+    books = _mapping(model_enricher, 'books', 'title[unique=true], authorid(name)')
+    selector = BackendSelector('auto', copy=True, orm=object())
+
+    # a single row is cheapest without the overhead of a batch
+    assert selector.select(books, OperationType.UPDATE, 1) == 'row'
+    assert selector.select(books, OperationType.UPDATE, 1000) == 'batch'
+    assert selector.select(books, OperationType.INSERT, 1000) == 'batch'
+    assert selector.select(authors, OperationType.INSERT, 1000) == 'copy'
+
+
+def test_select_modifier(books, model_enricher):
+    # verify that a backend modifier in the mapping overrides the backend of the caller, if it's safe
+    books = _mapping(model_enricher, 'books', 'title[unique=true: backend=batch], authorid(name)')
+    authors = _mapping(model_enricher, 'authors', 'name[unique=true: backend=copy]')
+
+    assert BackendSelector('row').select(books, OperationType.UPDATE, 1) == 'batch'
+    assert BackendSelector(copy=True).select(authors, OperationType.INSERT, 1) == 'copy'
+    # copy is not safe for deletes, so the default is used instead
+    assert BackendSelector(copy=True).select(authors, OperationType.DELETE, 1) == 'row'
+
+    with pytest.raises(AssertionError, match="Backend 'fast' not supported"):
+        BackendSelector().select(_mapping(model_enricher, 'books', 'title[unique=true: backend=fast]'), OperationType.INSERT, 1)
+
+
+def test_create_creator():
+    # verify that the creator of a backend is created with the batch size
+    selector = BackendSelector(batch_size=10)
+
+    assert isinstance(selector.create_creator('row', OperationType.INSERT), InsertSqlCreator)
+    creator = selector.create_creator('batch', OperationType.UPDATE)
+    assert isinstance(creator, BatchUpdateSqlCreator) and creator._batch_size == 10
+
+
+def test_register_backend(books, model_enricher):
+    # verify that a registered backend can be selected
+    class FreeBackend(RowBackend):
+        name = 'free'
+
+        def cost(self, mapping, operation_type, row_count, batch_size):
+            return 0
+
+    register_backend(FreeBackend())
+    try:
+        books = _mapping(model_enricher, 'books', 'title[unique=true]')
+        assert BackendSelector('auto').select(books, OperationType.INSERT, 1000) == 'free'
+    finally:
+        BACKENDS.pop('free')
@@ -2,7 +2,9 @@ import pandas as pd
 import pytest
 from numpy import nan, isnan
 
+from stimula.service.external_id_cache import ExternalIdCache
 from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+from stimula.service.odoo.postgres_model_service import PostgresModelService
 
 
 def test_tables(books, db, context):
@@ -376,6 +378,8 @@ def test_post_table_get_full_report(db, books, context):
         'summary': {'commit': False,
                     'execute': True,
                     'failed': {'delete': 0, 'insert': 0, 'update': 1},
+                    'retry': {'rounds': 1, 'rows': 1},
+                    'backends': {'books': {'insert': 'row', 'update': 'row', 'delete': 'row'}},
                     'rows': 7,
                     'success': {'delete': 1, 'insert': 2, 'update': 2},
                     'total': {'delete': 1, 'failed': 1, 'insert': 2, 'operations': 6, 'success': 5, 'update': 3}
@@ -425,6 +429,8 @@ def test_post_table_get_full_report_no_execute(db, books, context):
     expected_summary = {
         'execute': False, 'commit': False,
         'failed': {'delete': 1, 'insert': 2, 'update': 3},
+        'retry': {'rounds': 0, 'rows': 0},
+        'backends': {'books': {'insert': 'row', 'update': 'row', 'delete': 'row'}},
         'rows': 7,
         'success': {'delete': 0, 'insert': 0, 'update': 0},
         'total': {'delete': 1, 'failed': 6, 'insert': 2, 'operations': 6, 'success': 0, 'update': 3}
@@ -438,3 +444,341 @@ def test_post_table_get_full_report_no_execute(db, books, context):
     rows = full_report['rows']
 
     assert len(rows) == 6
+
+
+def test_post_table_get_full_report_in_batches(db, books, context):
+    # verify that inserting in batches gives the same report as inserting row by row, including rows that fail
+    body = '''
+        Catch XIII, Joseph Heller
+        Hard Times, Charlie Dickens
+        A Christmas Carol, Charles Dickens
+        Oliver Twist, Charles Dickens
+    '''
+    header = 'title[unique=true], authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, execute=True, context='my table', batch_size=2)
+
+    rows = [(row['line_number'], row['success'], row['rowcount'], row['params']) for row in full_report['rows']]
+    expected = [
+        (0, True, 1, {'title': 'Catch XIII', 'name': 'Joseph Heller'}),
+        (1, False, 0, {'title': 'Hard Times', 'name': 'Charlie Dickens'}),
+        (2, True, 1, {'title': 'A Christmas Carol', 'name': 'Charles Dickens'}),
+        (3, True, 1, {'title': 'Oliver Twist', 'name': 'Charles Dickens'}),
+    ]
+    assert rows == expected
+    assert full_report['summary']['total'] == {'delete': 0, 'failed': 1, 'insert': 4, 'operations': 4, 'success': 3, 'update': 0}
+
+
+def test_post_table_get_full_report_insert_in_batches_rowcount_per_row(db, books, cnx, context):
+    # verify that a batch checks the number of inserted rows per row, not only in total
+    with cnx.cursor() as cr:
+        cr.execute('DROP TABLE IF EXISTS t2')
+        cr.execute('CREATE TABLE t2(id SERIAL PRIMARY KEY, name TEXT, publisherid INTEGER REFERENCES publishers(publisher_id))')
+        cr.execute("INSERT INTO publishers(publishername, country) VALUES ('P', 'NL'), ('P', 'UK'), ('Q', 'NL')")
+    cnx.commit()
+
+    # the first line matches two publishers and the second line none, so that the total equals the number of lines
+    body = '''
+        a, P
+        b, Z
+        c, Q
+    '''
+    header = 'name[unique=true], publisherid(publishername)'
+    try:
+        full_report = db.post_table_get_full_report('t2', header, None, body, insert=True, execute=True, context='my table', batch_size=10)
+    finally:
+        # drop the table, because it references publishers that the next test drops
+        cnx.rollback()
+        with cnx.cursor() as cr:
+            cr.execute('DROP TABLE t2')
+        cnx.commit()
+
+    rows = [(row['line_number'], row['success'], row['rowcount'], row.get('error')) for row in full_report['rows']]
+    assert rows == [(0, False, 2, 'More than one row was affected, do not commit.'), (1, False, 0, 'No row was affected'), (2, True, 1, None)]
+    assert full_report['summary']['total'] == {'delete': 0, 'failed': 2, 'insert': 3, 'operations': 3, 'success': 1, 'update': 0}
+
+
+
+def test_post_table_get_full_report_update_in_batches(db, books, context):
+    # verify that updating in batches reports success per row, including rows that fail
+    body = '''
+        Emma, Charles Dickens, 1.50
+        War and Peace, Unknown Author, 2.50
+        Anna Karenina, Charles Dickens, 3.50
+        David Copperfield, Charles Dickens, 4.50
+    '''
+    header = 'title[unique=true], authorid(name), price'
+    full_report = db.post_table_get_full_report('books', header, None, body, update=True, execute=True, commit=True, context='my table', batch_size=10)
+
+    rows = [(row['line_number'], row['success'], row['rowcount']) for row in full_report['rows']]
+    assert rows == [(0, True, 1), (1, False, 0), (2, True, 1), (3, True, 1)]
+    assert full_report['summary']['total'] == {'delete': 0, 'failed': 1, 'insert': 0, 'operations': 4, 'success': 3, 'update': 4}
+
+    # verify that the successful rows were updated
+    df, _ = db.get_table('books', 'title, authorid(name), price')
+    assert df[df['title'] == 'Anna Karenina'][['authorid(name)', 'price']].values.tolist() == [['Charles Dickens', 3.5]]
+
+
+def test_post_table_get_full_report_insert_with_copy(db, books, context):
+    # verify that an insert only load copies rows, and falls back to inserting by row to report the row that fails
+    body = '''
+        Fyodor Dostoevsky, 1821
+        Mark Twain, 99999999999
+        Virginia Woolf, 1882
+    '''
+    full_report = db.post_table_get_full_report('authors', 'name[unique=true], birthyear', None, body, insert=True, execute=True, commit=True, context='my table')
+
+    rows = [(row['line_number'], row['success']) for row in full_report['rows']]
+    assert rows == [(0, True), (1, False), (2, True)]
+
+    # verify that the successful rows were inserted
+    df, _ = db.get_table('authors', 'name[unique=true], birthyear')
+    assert df[df['name[unique=true]'] == 'Virginia Woolf']['birthyear'].values.tolist() == [1882]
+
+
+def test_post_table_get_full_report_with_prefetch(db, books, context):
+    # verify that references are looked up up front, and that rows that reference a row that doesn't exist fail before they're executed
+    body = '''
+        Emma, Charles Dickens
+        Catch XIII, Joseph Heller
+        Witches, Unknown Author
+    '''
+    header = 'title[unique=true], authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, commit=True, context='my table', prefetch=True)
+
+    rows = [(row['line_number'], row['success'], row.get('query'), row.get('params'), row.get('error')) for row in full_report['rows']]
+    assert rows == [
+        (0, True, 'update books set authorid = :authorid where books.title = :title', {'title': 'Emma', 'authorid': 4}, None),
+        (1, True, 'insert into books(title, authorid) select :title, :authorid', {'title': 'Catch XIII', 'authorid': 3}, None),
+        (2, False, None, {}, 'No row found in table authors for authorid: Unknown Author'),
+    ]
+
+    # verify that the rows were written
+    df, _ = db.get_table('books', 'title[unique=true], authorid(name)')
+    authors = dict(df[['title[unique=true]', 'authorid(name)']].values.tolist())
+    assert (authors['Emma'], authors['Catch XIII']) == ('Charles Dickens', 'Joseph Heller')
+
+
+def test_post_table_get_full_report_with_backend(db, books, context):
+    # verify that a backend modifier selects the backend of the mapping, and that the report shows the backend of each operation
+    body = '''
+        Emma, Charles Dickens
+        War and Peace, Joseph Heller
+        Catch XIII, Joseph Heller
+    '''
+    header = 'title[unique=true: backend=batch], authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, commit=True, context='my table', backend='auto')
+
+    assert full_report['summary']['backends'] == {'books': {'insert': 'batch', 'update': 'batch'}}
+    assert full_report['summary']['success'] == {'insert': 1, 'update': 2, 'delete': 0}
+
+    # verify that the rows were written
+    df, _ = db.get_table('books', 'title[unique=true], authorid(name)')
+    authors = dict(df[['title[unique=true]', 'authorid(name)']].values.tolist())
+    assert (authors['Emma'], authors['War and Peace'], authors['Catch XIII']) == ('Charles Dickens', 'Joseph Heller', 'Joseph Heller')
+
+
+def test_post_table_get_full_report_adaptive_tx_size(db, books, context):
+    # verify that the report shows the transaction sizes, if the transaction size is adaptive
+    body = '''
+        Emma, Charles Dickens
+        War and Peace, Joseph Heller
+        Catch XIII, Joseph Heller
+    '''
+    header = 'title[unique=true], authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, commit=True, context='my table', tx_size_bounds=(1, 10))
+
+    assert full_report['summary']['success'] == {'insert': 1, 'update': 2, 'delete': 0}
+    assert full_report['summary']['transactions']['commits'] >= 1
+    assert 1 <= full_report['summary']['transactions']['next_size'] <= 10
+
+
+def test_post_table_get_full_report_resume(db, books, context, tmp_path):
+    # verify that a resumed load skips rows that the journal proves are committed, and doesn't delete them either
+    body = '''
+        Emma, Charles Dickens
+        Catch XIII, Joseph Heller
+        Witches, Charles Dickens
+    '''
+    header = 'title[unique=true], authorid(name)'
+    journal = str(tmp_path / 'journal')
+
+    # a load that commits line 0 and 1, then dies
+    full_report = db.post_table_get_full_report('books', header, None, body.replace('        Witches, Charles Dickens\n', ''), insert=True, update=True, execute=True, commit=True,
+                                                context='my table', journal=journal)
+    assert full_report['summary']['success'] == {'insert': 1, 'update': 1, 'delete': 0}
+
+    # simulate the journal of the interrupted load of the full body
+    with open(journal) as file:
+        chunks = file.readlines()[1:]
+    db._open_journal(journal, False, ['books'], [header], [body]).close()
+    with open(journal, 'a') as file:
+        file.writelines(chunks)
+
+    # resume, only the last row is inserted, and committed rows are not deleted
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, delete=True, execute=True, commit=True, context='my table',
+                                                journal=journal, resume=True)
+    assert full_report['summary']['success'] == {'insert': 1, 'update': 0, 'delete': 5}
+    assert [row['line_number'] for row in full_report['rows'] if 'line_number' in row] == [2]
+
+    df, _ = db.get_table('books', 'title[unique=true]')
+    assert sorted(df['title[unique=true]']) == ['Catch XIII', 'Emma', 'Witches']
+
+
+def test_post_table_get_full_report_validate(db, books, context):
+    # verify that rows that violate the table definition are reported without executing them
+    body = '''
+        5, Fyodor Dostoevsky, 1821
+        6, Jane Austen, 1775
+        7, Mark Twain, 99999999999
+    '''
+    header = 'author_id[unique=true], name, birthyear'
+    full_report = db.post_table_get_full_report('authors', header, None, body, insert=True, execute=True, context='my table', validate=True)
+
+    rows = [(row['line_number'], row['success'], row.get('query'), row.get('error')) for row in full_report['rows']]
+    assert rows == [
+        (0, True, 'insert into authors(author_id, name, birthyear) select :author_id, :name, :birthyear', None),
+        (1, False, None, "Value already exists for unique constraint 'authors_name_key' on name"),
+        (2, False, None, "Value out of range for column 'birthyear' of type integer"),
+    ]
+
+
+@pytest.mark.parametrize('update', [False, True])
+def test_post_table_get_full_report_validate_delete_and_insert(db, books, context, update):
+    # verify that an insert of a unique value that the same load deletes is executed, and not reported as an existing value. Without updates, deleted rows only have their key
+    body = '''
+        7, Emma, Jane Austen
+    '''
+    header = 'bookid[unique=true], title, authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, 'books.bookid = 1', body, insert=True, update=update, delete=True, execute=True, commit=True, context='my table', validate=True)
+
+    rows = [(row.get('line_number'), row['success'], row.get('error')) for row in full_report['rows']]
+    assert rows == [(0, True, None), (None, True, None)]
+
+    # verify that the book moved to the new key
+    df, _ = db.get_table('books', 'bookid[unique=true], title')
+    assert df[df['title'] == 'Emma']['bookid[unique=true]'].tolist() == [7]
+
+
+def test_post_table_get_full_report_in_dependency_order(db, books, context):
+    # verify that a row that references a later row in the same table succeeds without retrying
+    body = '''
+        Emma 3, Emma 2, Jane Austen
+        Emma 2, Emma, Jane Austen
+        Persuasion, Unknown Book, Jane Austen
+    '''
+    header = 'title[unique=true], seriesid(title), authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, execute=True, context='my table', dependency_order=True)
+
+    rows = [(row['line_number'], row['success']) for row in full_report['rows']]
+    assert rows == [(0, True), (1, True), (2, False)]
+
+
+def test_post_table_get_full_report_in_dependency_order_nested_reference(db, books, context):
+    # verify that a row with a nested reference to a later row is retried, because its reference doesn't identify a row by values
+    body = '''
+        Emma 3, Emma 2:Jane Austen, Jane Austen
+        Emma 2, Emma:Jane Austen, Jane Austen
+    '''
+    header = 'title[unique=true], seriesid(title:authorid(name)), authorid(name)'
+    full_report = db.post_table_get_full_report('books', header, None, body, insert=True, execute=True, context='my table', dependency_order=True)
+
+    rows = [(row['line_number'], row['success']) for row in full_report['rows']]
+    assert rows == [(0, True), (1, True)]
+
+
+@pytest.mark.parametrize('table_name, header, body', [
+    ('books', 'title[unique=true], authorid(name), description, price', '''
+        Emma, Jane Austen, , 10.990
+        War and Peace, Leo Tolstoy, A novel, 12.5
+        Catch-22, Joseph Heller, ,
+        Pride and Prejudice, Jane Austen, , 9.95
+    '''),
+    ('books', 'title[unique=true], authorid(name:birthyear)', '''
+        Emma, Jane Austen:1775
+        War and Peace, Leo Tolstoy:1829
+    '''),
+    ('properties', 'name[unique=true], number, float, decimal, timestamp, date, jsonb', '''
+        key 0, 1, 1.5, 2.25, 2024-01-01 10:00, 2024-01-02, "{""a"": 1}"
+        key 1, 2, , , 2024-01-01 00:00, ,
+        key 2, , , , , ,
+    '''),
+])
+def test_diff_engine_hash_same_as_pandas(db, cnx, books, context, table_name, header, body):
+    # verify that the hash diff engine finds the same inserts, updates and deletes as the pandas diff engine
+    with cnx.cursor() as cr:
+        cr.execute("INSERT INTO properties (name, number, float, decimal, timestamp, date, jsonb) VALUES ('key 0', 1, 1.5, 2.25, '2024-01-01 10:00', '2024-01-02', '{\"a\": 1}')")
+        cr.execute("INSERT INTO properties (name, number, float, timestamp, date) VALUES ('key 1', 3, 0.1, '2024-01-01 12:00', '2024-01-03')")
+        cr.execute("INSERT INTO properties (name) VALUES ('key 2')")
+        cnx.commit()
+
+    pandas_diffs, _ = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, True, True, None, None)
+    hash_diffs, _ = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, True, True, None, None, diff_engine='hash')
+
+    for pandas_diff, hash_diff in zip(pandas_diffs, hash_diffs):
+        pd.testing.assert_frame_equal(hash_diff, pandas_diff)
+
+
+def test_fingerprint_changes(db):
+    # verify that only rows with different values are compared, and that values of different types are not taken for the same
+    left = pd.DataFrame({'__line__': [0, 1, 2], 'name': ['a', 'b', ''], 'price': [1.0, 2.0, nan]}, index=['x', 'y', 'z'])
+    right = pd.DataFrame({'name': ['c', None, 'a'], 'price': [2.0, nan, 1.0]}, index=['y', 'z', 'x'])
+
+    # '' and None hash differently, comparing cells tells that they are the same
+    assert db._fingerprint_changes(left, right).index.tolist() == ['y', 'z']
+
+    # 1 and '1' hash the same, so all rows are compared
+    left = pd.DataFrame({'number': ['1', '2']}, index=['x', 'y'])
+    right = pd.DataFrame({'number': [1, 2]}, index=['x', 'y'], dtype=object)
+    assert db._fingerprint_changes(left, right).index.tolist() == ['x', 'y']
+
+
+def test_key_pushdown_same_as_full_read(db, cnx, books, ir_model_data, context):
+    # verify that reading only the rows of a small request finds the same inserts and updates as reading all rows
+    with cnx.cursor() as cr:
+        cr.execute("insert into books(title, authorid) select 'Book ' || n, 1 from generate_series(1, 1000) n")
+        cr.execute("insert into ir_model_data(res_id, name, module, model) select bookid, 'book_' || bookid, 'netsuite_books', 'books' from books where bookid > 6")
+        cr.execute('analyze books')
+        cnx.commit()
+
+    for header, body in [('title[unique=true], authorid(name)', 'Emma, Leo Tolstoy\nBook 7, Jane Austen\nNew Book, Jane Austen\n'),
+                         ('bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_books: unique=true], title',
+                          '22222, Pride and Prejudice\nbook_10, Book 4\n77777, New Book\n')]:
+        for cache_external_ids in [False, True]:
+            full_diffs, _ = db._get_diffs_and_sql('books', header, None, body, 0, None, True, True, False, None, None, external_ids=ExternalIdCache() if cache_external_ids else None)
+            pushdown_diffs, _ = db._get_diffs_and_sql('books', header, None, body, 0, None, True, True, False, None, None, external_ids=ExternalIdCache() if cache_external_ids else None,
+                                                      key_pushdown=True)
+
+            for full_diff, pushdown_diff in zip(full_diffs, pushdown_diffs):
+                pd.testing.assert_frame_equal(pushdown_diff, full_diff)
+
+
+def test_key_pushdown_opt_in(db, cnx, books, context, monkeypatch):
+    # verify that the post methods read all rows unless key pushdown is requested
+    with cnx.cursor() as cr:
+        cr.execute("insert into books(title, authorid) select 'Book ' || n, 1 from generate_series(1, 1000) n")
+        cr.execute('analyze books')
+        cnx.commit()
+
+    key_filters = []
+    read_table = PostgresModelService.read_table
+    monkeypatch.setattr(PostgresModelService, 'read_table', lambda self, mapping, where_clause=None, key_filter=None: key_filters.append(key_filter) or read_table(self, mapping, where_clause, key_filter))
+
+    db.post_table_get_full_report('books', 'title[unique=true], authorid(name)', None, 'Emma, Jane Austen\n', insert=True, update=True)
+    db.post_table_get_full_report('books', 'title[unique=true], authorid(name)', None, 'Emma, Jane Austen\n', insert=True, update=True, key_pushdown=True)
+
+    assert key_filters == [None, [(0, 'text', ['Emma'])]]
+
+
+def test_diff_engine_hash_only_unique_columns(db, cnx, books, context):
+    # verify that the hash diff engine accepts a mapping without columns besides the unique columns
+    with cnx.cursor() as cr:
+        cr.execute("INSERT INTO publishers (publishername, country) VALUES ('Penguin', 'UK'), ('Old', 'US')")
+        cnx.commit()
+
+    header = 'publishername[unique=true], country[unique=true]'
+    body = 'Penguin, UK\nNew, NL\n'
+    pandas_diffs, _ = db._get_diffs_and_sql('publishers', header, None, body, 0, None, True, True, True, None, None)
+    hash_diffs, _ = db._get_diffs_and_sql('publishers', header, None, body, 0, None, True, True, True, None, None, diff_engine='hash')
+
+    for pandas_diff, hash_diff in zip(pandas_diffs, hash_diffs):
+        pd.testing.assert_frame_equal(hash_diff, pandas_diff)
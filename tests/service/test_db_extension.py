@@ -3,6 +3,9 @@ This script tests scenarios involving an extension table, such as the ir_model_d
 '''
 import pandas as pd
 
+from stimula.service.context import cnx_context
+from stimula.service.executor_service import ExecutorService
+
 
 def test_insert_extension(db, books, ir_model_data):
     # test that we can insert a record into an extension table
@@ -201,3 +204,58 @@ def test_delete_unique_extension_skip_null(db, books, ir_model_data, context):
 
     df = df.drop(columns=['errors'])
     assert df.equals(expected)
+
+
+def test_insert_execute_extension_grouped(db, books, ir_model_data, context):
+    # test that grouped inserts pair each returned id with the right external id, and report like inserting row by row
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    body = '''
+        Pride and Prejudice, Jane Austen, 12345
+        Sense and Sensibility, Unknown Author, 12346
+        Persuasion, Jane Austen, 12347
+    '''
+    _, query_executors = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, False, False, None, 'my table')
+    per_row = db._convert_to_df(ExecutorService().execute_sql(query_executors, True, False), True)
+    cnx_context.cnx.rollback()
+
+    _, query_executors = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, False, False, None, 'my table')
+    grouped = db._convert_to_df(ExecutorService().execute_sql(query_executors, True, False, group_size=10), True)
+
+    # ids differ, because sequences are not rolled back
+    assert grouped.drop(columns=['res_id']).equals(per_row.drop(columns=['res_id']))
+
+    cnx_context.cr.execute("select b.title, d.name from books b join ir_model_data d on d.res_id = b.bookid and d.model = 'books' where d.name like '1234%' order by d.name")
+    assert cnx_context.cr.fetchall() == [('Pride and Prejudice', '12345'), ('Persuasion', '12347')]
+
+
+def test_delete_execute_extension_grouped(db, books, ir_model_data, context):
+    # test that grouped deletes also delete the external ids of the deleted records
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    body = '''
+        War and Peace, Leo Tolstoy, 22222
+        Catch-22, Joseph Heller, 33333
+        David Copperfield, Charles Dickens, 44444
+    '''
+    db.post_table_get_full_report(table_name, header, None, body, delete=True, execute=True, context='my table', group_size=10)
+
+    cnx_context.cr.execute("select name from ir_model_data order by name")
+    assert [row[0] for row in cnx_context.cr.fetchall()] == ['22222', '33333', '44444']
+
+
+def test_delete_execute_extension_in_batches(db, books, ir_model_data, context):
+    # test that batched deletes also delete the external ids of the deleted records
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    body = '''
+        War and Peace, Leo Tolstoy, 22222
+        Catch-22, Joseph Heller, 33333
+        David Copperfield, Charles Dickens, 44444
+    '''
+    full_report = db.post_table_get_full_report(table_name, header, None, body, delete=True, execute=True, context='my table', batch_size=10)
+
+    assert full_report['summary']['success'] == {'delete': 3, 'insert': 0, 'update': 0}
+
+    cnx_context.cr.execute("select name from ir_model_data order by name")
+    assert [row[0] for row in cnx_context.cr.fetchall()] == ['22222', '33333', '44444']
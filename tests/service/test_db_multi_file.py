@@ -28,6 +28,8 @@ def test_post_multiple_tables_get_full_report(db, books, context):
         'summary': {'commit': False,
                     'execute': True,
                     'failed': {'delete': 0, 'insert': 0, 'update': 0},
+                    'retry': {'rounds': 0, 'rows': 0},
+                    'backends': {'authors': {'insert': 'row', 'delete': 'row'}, 'books': {'update': 'row'}},
                     'rows': 10,
                     'success': {'delete': 1, 'insert': 1, 'update': 1},
                     'total': {'delete': 1, 'failed': 0, 'insert': 1, 'operations': 3, 'success': 3, 'update': 1}
@@ -55,3 +57,64 @@ def test_post_multiple_tables_get_full_report(db, books, context):
     full_report['summary'].pop('timestamp')
 
     assert full_report == expected
+
+
+def test_post_multiple_tables_delete_child_before_parent(db, books, context):
+    # verify that books are deleted before the authors they reference, even if authors are posted first
+    table_names = ['authors', 'books']
+    contexts = ['authors.csv', 'books.csv']
+    # remove Dickens and his book
+    authors = '''name[unique=true]
+        Jane Austen
+        Leo Tolstoy
+        Joseph Heller
+    '''
+    books = '''title[unique=true]
+        Emma
+        War and Peace
+        Catch-22
+        Good as Gold
+        Anna Karenina
+    '''
+    body = [authors.encode('utf-8'), books.encode('utf-8')]
+
+    # with dependency order, deletes are not retried, so this only succeeds if the book is deleted first
+    full_report = db.post_multiple_tables_get_full_report(table_names, None, None, body, skiprows=1, delete=True, execute=True, context=contexts, dependency_order=True)
+
+    rows = [(row['table_name'], row['success'], row['params']) for row in full_report['rows']]
+    assert rows == [('books', True, {'title': 'David Copperfield'}), ('authors', True, {'name': 'Charles Dickens'})]
+
+
+def test_post_multiple_tables_get_full_report_parallel(db, cnx, books, context, prepared_transactions):
+    # verify that a load with dependencies between tables succeeds over several connections, and is committed
+    table_names = ['authors', 'books']
+    contexts = ['authors.csv', 'books.csv']
+    authors = '''name[unique=true]
+        Jane Austen
+        Leo Tolstoy
+        Joseph Heller
+        Charles Dickens
+        Fyodor Dostoevsky
+    '''
+    books = '''title[unique=true], authorid(name)
+        Emma, Jane Austen
+        War and Peace, Leo Tolstoy
+        Catch-22, Joseph Heller
+        David Copperfield, Charles Dickens
+        Good as Gold, Joseph Heller
+        Anna Karenina, Leo Tolstoy
+        Crime and Punishment, Fyodor Dostoevsky
+        The Idiot, Fyodor Dostoevsky
+        Pride and Prejudice, Jane Austen
+    '''
+    body = [authors.encode('utf-8'), books.encode('utf-8')]
+    full_report = db.post_multiple_tables_get_full_report(table_names, None, None, body, skiprows=1, insert=True, update=True, execute=True, commit=True, context=contexts,
+                                                          dependency_order=True, parallel_size=3)
+
+    assert full_report['summary']['success'] == {'insert': 4, 'update': 0, 'delete': 0}
+    assert full_report['summary']['failed'] == {'insert': 0, 'update': 0, 'delete': 0}
+
+    # verify that the rows were committed
+    with cnx.cursor() as cr:
+        cr.execute("select count(*) from books join authors on books.authorid = authors.author_id where authors.name = 'Fyodor Dostoevsky'")
+        assert cr.fetchone()[0] == 2
@@ -1,2 +1,89 @@
+import pandas as pd
+
+from stimula.service.db_reader import DbReader
+from stimula.service.odoo.postgres_model_service import PostgresModelService
+from stimula.stml.model_enricher import ModelEnricher
+from stimula.stml.stml_parser import StmlParser
+
+
 def test():
     pass
+
+
+def _mapping(table_name, header):
+    return ModelEnricher(PostgresModelService()).enrich(StmlParser().parse_csv(table_name, header))
+
+
+def _add_books(cnx, count):
+    # add many books and analyze the table, so that a small request is pushed down
+    with cnx.cursor() as cr:
+        cr.execute("insert into books(title, authorid) select 'Book ' || n, 1 from generate_series(1, %s) n", (count,))
+        cr.execute('analyze books')
+    cnx.commit()
+
+
+def test_key_filter(db, books, context):
+    # verify that unique values are converted to the type of their column
+    mapping = _mapping('books', 'title[unique=true], authorid(name), price')
+    assert DbReader()._key_filter(mapping, pd.Index(['Emma', 'War and Peace'])) == [(0, 'text', ['Emma', 'War and Peace'])]
+
+    mapping = _mapping('books', 'title[unique=true], authorid(name)[unique=true]')
+    keys = pd.MultiIndex.from_tuples([('Emma', 'Jane Austen')])
+    assert DbReader()._key_filter(mapping, keys) == [(0, 'text', ['Emma']), (1, 'text', ['Jane Austen'])]
+
+    # verify that keys with nulls, or of types that convert differently, read all rows
+    assert DbReader()._key_filter(mapping, pd.MultiIndex.from_tuples([('Emma', None)])) is None
+    mapping = _mapping('books', 'title, price[unique=true]')
+    assert DbReader()._key_filter(mapping, pd.Index(['1.5'])) is None
+
+
+def test_render_key_condition(db, books, context):
+    # verify that a single unique column is compared with an array, and multiple unique columns with unnested arrays
+    mapping = _mapping('books', 'title[unique=true], authorid(name)')
+    query = PostgresModelService()._create_select_query(mapping, None, [(0, 'text', ['Emma'])])
+    assert "cast(books.title as text) = any(cast(ARRAY['Emma'] as text[]))" in query
+
+    mapping = _mapping('books', 'title[unique=true], authorid(name)[unique=true]')
+    query = PostgresModelService()._create_select_query(mapping, 'books.price > 0', [(0, 'text', ['Emma']), (1, 'text', ['Jane Austen'])])
+    assert "(books.price > 0) and (cast(books.title as text), cast(authors.name as text)) in (select * from unnest(cast(ARRAY['Emma'] as text[]), cast(ARRAY['Jane Austen'] as text[])))" in query
+
+
+def test_read_from_db_with_keys(db, cnx, books, context):
+    # verify that only rows with the unique values of a small request are read
+    _add_books(cnx, 1000)
+    mapping = _mapping('books', 'title[unique=true], authorid(name)')
+    df = DbReader().read_from_db(mapping, None, set_index=True, keys=pd.Index(['Emma', 'Book 7', 'Unknown']))
+    assert sorted(df.index) == ['Book 7', 'Emma']
+
+    # verify that a large request reads all rows
+    df = DbReader().read_from_db(mapping, None, set_index=True, keys=pd.Index([f'Book {n}' for n in range(200)]))
+    assert len(df) == 1006
+
+
+def test_read_from_db_without_statistics(db, books, context):
+    # verify that all rows are read if the table was never analyzed
+    assert PostgresModelService().estimate_row_count('books') is None
+    mapping = _mapping('books', 'title[unique=true], authorid(name)')
+    df = DbReader().read_from_db(mapping, None, set_index=True, keys=pd.Index(['Emma']))
+    assert len(df) == 6
+
+
+def test_key_mapping(db, books, context):
+    # verify that only unique columns are selected, and that joins of other columns are dropped
+    mapping = DbReader().key_mapping(_mapping('books', 'title[unique=true], authorid(name), , price'))
+    assert PostgresModelService()._create_select_query(mapping, None) == 'select books.title from books order by books.title'
+
+    # verify that columns with a filter keep their join and filter, and that a free where clause keeps all joins
+    mapping = DbReader().key_mapping(_mapping('books', 'title[unique=true], authorid(name[filter="$ like \'J%\'"]), price'))
+    assert PostgresModelService()._create_select_query(mapping, None) == \
+           "select books.title from books left join authors on books.authorid = authors.author_id where authors.name like 'J%' order by books.title"
+    mapping = DbReader().key_mapping(_mapping('books', 'title[unique=true], authorid(name), price'), 'authors.birthyear > 1800')
+    assert PostgresModelService()._create_select_query(mapping, 'authors.birthyear > 1800') == \
+           'select books.title from books left join authors on books.authorid = authors.author_id where authors.birthyear > 1800 order by books.title'
+
+
+def test_key_mapping_extension(db, books, ir_model_data, context):
+    # verify that the extension column of the root table is selected, deletes need it to delete the extension record
+    mapping = DbReader().key_mapping(_mapping('books', 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_books]'))
+    df = DbReader().read_from_db(mapping, None, set_index=True)
+    assert df.columns.tolist() == ['bookid(name)']
@@ -0,0 +1,77 @@
+from stimula.service.dependency_sorter import DependencySorter
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType, BatchQueryExecutor
+
+
+def _executor(line_number, title, series=None):
+    executor = SimpleQueryExecutor(line_number, OperationType.INSERT, 'books', 'query', {}, 'books.csv')
+    executor.keys = [('books', {'title': title})]
+    executor.references = [('books', ('title',), (series,))] if series else []
+    return executor
+
+
+def test_sort_references_first():
+    # rows are executed after the rows they reference, independent rows keep their order
+    executors = [_executor(0, 'A', series='C'), _executor(1, 'B'), _executor(2, 'C', series='D'), _executor(3, 'D')]
+
+    sorted_executors, cyclic_executors = DependencySorter().sort(executors)
+
+    assert [e.line_number for e in sorted_executors] == [1, 3, 2, 0]
+    assert cyclic_executors == set()
+
+
+def test_sort_references_in_other_table():
+    # rows reference rows in other tables of the same post
+    author = SimpleQueryExecutor(1, OperationType.INSERT, 'authors', 'query', {}, 'authors.csv')
+    author.keys = [('authors', {'name': 'Jane Austen', 'birthyear': 1775})]
+    book = _executor(0, 'Emma')
+    book.references = [('authors', ('name',), ('Jane Austen',))]
+
+    sorted_executors, _ = DependencySorter().sort([book, author])
+
+    assert sorted_executors == [author, book]
+
+
+def test_sort_cycle():
+    # rows in a cycle, and rows that depend on them, are executed last and may be retried
+    executors = [_executor(0, 'A', series='B'), _executor(1, 'B', series='A'), _executor(2, 'C', series='A'), _executor(3, 'D')]
+
+    sorted_executors, cyclic_executors = DependencySorter().sort(executors)
+
+    assert [e.line_number for e in sorted_executors] == [3, 0, 1, 2]
+    assert cyclic_executors == set(executors[:3])
+
+
+def test_sort_reference_to_any_row():
+    # a row with a nested reference is executed after all rows that insert or update the referenced table, and may be retried
+    author = SimpleQueryExecutor(1, OperationType.INSERT, 'authors', 'query', {}, 'authors.csv')
+    author.keys = [('authors', {'name': 'Jane Austen'})]
+    book = _executor(0, 'Emma')
+    book.references = [('authors', None, None)]
+    other = _executor(2, 'Persuasion')
+
+    sorted_executors, cyclic_executors = DependencySorter().sort([book, author, other])
+
+    assert sorted_executors == [author, book, other]
+    assert cyclic_executors == {book}
+
+
+def test_sort_batch_with_internal_reference():
+    # a batch with a row that references another row in the same batch can't be ordered
+    rows = [_executor(0, 'A', series='B'), _executor(1, 'B')]
+    batch = BatchQueryExecutor(OperationType.INSERT, 'books', 'batch query', {}, rows, 'books.csv')
+
+    sorted_executors, cyclic_executors = DependencySorter().sort([batch])
+
+    assert sorted_executors == [batch]
+    assert cyclic_executors == {batch, *rows}
+
+
+def test_sort_deletes():
+    # deletes go after inserts and updates, and child tables are deleted before the tables they reference
+    author = SimpleQueryExecutor(None, OperationType.DELETE, 'authors', 'query', {}, 'authors.csv')
+    book_insert = _executor(0, 'Emma')
+    book_delete = SimpleQueryExecutor(None, OperationType.DELETE, 'books', 'query', {}, 'books.csv')
+
+    sorted_executors = DependencySorter().sort_deletes([author, book_insert, book_delete], ['authors', 'books'])
+
+    assert sorted_executors == [book_insert, book_delete, author]
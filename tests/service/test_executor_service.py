@@ -1,7 +1,8 @@
 import time
 
+from stimula.service.context import cnx_context
 from stimula.service.executor_service import ExecutorService
-from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType, BatchQueryExecutor, ExecutionResult, CopyQueryExecutor
 
 
 def test_execute_sql_no_commit(db, books, context):
@@ -66,3 +67,180 @@ def test_large_transaction(db, books, context):
     assert rowcounts == expected
 
 
+
+
+def test_execute_batch(db, books, context):
+    # a batch that affects one row per row executor is reported per row
+    query = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+    rows = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': title, 'name': name}, 'books.csv') for i, (title, name) in enumerate([('Catch XIII', 'Joseph Heller'), ('Witches', 'Charles Dickens')])]
+    batch_query = 'insert into books(title, authorid) select v.title, authors.author_id from (values (:title__0, :name__0), (:title__1, :name__1)) as v(title, name), authors where authors.name = v.name'
+    batch_params = {'title__0': 'Catch XIII', 'name__0': 'Joseph Heller', 'title__1': 'Witches', 'name__1': 'Charles Dickens'}
+
+    result = ExecutorService().execute_sql([BatchQueryExecutor(OperationType.INSERT, 'books', batch_query, batch_params, rows, 'books.csv')], True, False)
+
+    assert [(er.line_number, er.success, er.rowcount, er.query) for er in result] == [(0, True, 1, query), (1, True, 1, query)]
+
+
+def test_execute_batch_fall_back_to_rows(db, books, context):
+    # a batch that misses a row falls back to row executors, so that the error is reported on the right line
+    query = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+    rows = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': title, 'name': name}, 'books.csv') for i, (title, name) in enumerate([('Catch XIII', 'Joseph Heller'), ('Witches', 'Unknown Author')])]
+    batch_query = 'insert into books(title, authorid) select v.title, authors.author_id from (values (:title__0, :name__0), (:title__1, :name__1)) as v(title, name), authors where authors.name = v.name'
+    batch_params = {'title__0': 'Catch XIII', 'name__0': 'Joseph Heller', 'title__1': 'Witches', 'name__1': 'Unknown Author'}
+
+    result = ExecutorService().execute_sql([BatchQueryExecutor(OperationType.INSERT, 'books', batch_query, batch_params, rows, 'books.csv')], True, False)
+
+    assert [(er.line_number, er.success, er.rowcount, er.error) for er in result] == [(0, True, 1, None), (1, False, 0, 'No row was affected')]
+
+
+def test_fake_execute_batch(db, books, context):
+    # a dry run reports the row executors of a batch
+    query = 'insert into books(title) select :title'
+    rows = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': f'Title {i}'}, 'books.csv') for i in range(2)]
+
+    result = ExecutorService().execute_sql([BatchQueryExecutor(OperationType.INSERT, 'books', 'batch query', {}, rows, 'books.csv')], False, False)
+
+    assert [(er.line_number, er.query, er.params) for er in result] == [(0, query, {'title': 'Title 0'}), (1, query, {'title': 'Title 1'})]
+
+
+def _insert_executors(titles_and_names):
+    query = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+    return [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': title, 'name': name}, 'books.csv') for i, (title, name) in enumerate(titles_and_names)]
+
+
+def test_execute_with_savepoint_size_same_as_per_row(db, books, context):
+    # bisecting a group of executors gives the same results per line as executing rows under their own savepoint
+    titles_and_names = [('Catch XIII', 'Joseph Heller'), ('Witches', 'Unknown Author'), ('Hard Times', 'Charles Dickens'),
+                        ('Ulysses', 'Unknown Author'), ('Emma', 'Jane Austen'), ('Oliver Twist', 'Charles Dickens')]
+
+    per_row = ExecutorService().execute_sql(_insert_executors(titles_and_names), True, False)
+    cnx_context.cnx.rollback()
+    bisected = ExecutorService().execute_sql(_insert_executors(titles_and_names), True, False, savepoint_size=4)
+
+    expected = [(er.line_number, er.success, er.rowcount, er.error is None) for er in per_row]
+    assert [(er.line_number, er.success, er.rowcount, er.error is None) for er in bisected] == expected
+    assert [er.success for er in bisected] == [True, False, True, False, False, True]
+
+
+def test_execute_with_savepoint_size_one_savepoint_per_group(db, books, context):
+    # if all executors succeed, there's one savepoint per group
+    executor_service = ExecutorService()
+    savepoints = []
+    create_savepoint = executor_service.create_savepoint
+    executor_service.create_savepoint = lambda: savepoints.append(create_savepoint())
+
+    result = executor_service.execute_sql(_insert_executors([(f'Title {i}', 'Charles Dickens') for i in range(5)]), True, False, savepoint_size=2)
+
+    assert [er.success for er in result] == [True] * 5
+    assert len(savepoints) == 3
+
+
+def test_group_statements():
+    # verify that runs of executors with the same query are grouped, up to the group size
+    executors = _insert_executors([(f'Title {i}', 'Charles Dickens') for i in range(5)])
+    executors.insert(3, SimpleQueryExecutor(5, OperationType.DELETE, 'books', 'delete from books where title = :title', {'title': 'Emma'}, 'books.csv'))
+
+    groups = list(ExecutorService()._group_statements(executors, 2))
+
+    assert [type(g).__name__ for g in groups] == ['GroupQueryExecutor', 'SimpleQueryExecutor', 'SimpleQueryExecutor', 'GroupQueryExecutor']
+    assert [e.line_number for e in groups[0].executors] == [0, 1]
+    assert groups[0].query == ('with row_0 as (insert into books(title, authorid) select :title__0, authors.author_id from authors where authors.name = :name__0 returning 0 as row_index), '
+                               'row_1 as (insert into books(title, authorid) select :title__1, authors.author_id from authors where authors.name = :name__1 returning 1 as row_index) '
+                               'select row_index from row_0 union all select row_index from row_1')
+
+
+def test_execute_grouped(db, books, context):
+    # grouping statements gives the same results per line as executing rows one by one
+    titles_and_names = [('Catch XIII', 'Joseph Heller'), ('Witches', 'Unknown Author'), ('Hard Times', 'Charles Dickens'), ('Emma', 'Jane Austen')]
+
+    per_row = ExecutorService().execute_sql(_insert_executors(titles_and_names), True, False)
+    cnx_context.cnx.rollback()
+    grouped = ExecutorService().execute_sql(_insert_executors(titles_and_names), True, False, group_size=10)
+
+    expected = [(er.line_number, er.success, er.rowcount, er.error is None) for er in per_row]
+    assert [(er.line_number, er.success, er.rowcount, er.error is None) for er in grouped] == expected
+    assert [er.success for er in grouped] == [True, False, True, False]
+
+
+def test_execute_grouped_depends_on_earlier_row(db, books, context):
+    # a row that depends on a row earlier in the group doesn't see it in the same statement, so it's executed by row
+    query = 'insert into books(title, authorid, seriesid) select :title, 1, books.bookid from books where books.title = :series'
+    executors = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': title, 'series': series}, 'books.csv') for i, (title, series) in
+                 enumerate([('Emma 2', 'Emma'), ('Emma 3', 'Emma 2')])]
+
+    result = ExecutorService().execute_sql(executors, True, False, group_size=10)
+
+    assert [(er.line_number, er.success, er.rowcount) for er in result] == [(0, True, 1), (1, True, 1)]
+
+
+def test_execute_retries_only_retryable_rows(db, books, context):
+    # a row that references a later row is retried, a row with a value of the wrong type fails the same way in every round and is not retried
+    query = 'insert into books(title, authorid, seriesid) select :title, 1, books.bookid from books where books.title = :series'
+    executors = [
+        SimpleQueryExecutor(0, OperationType.INSERT, 'books', query, {'title': 'Emma 2', 'series': 'Emma 3'}, 'books.csv'),
+        SimpleQueryExecutor(1, OperationType.INSERT, 'books', 'insert into books(title, authorid) select :title, cast(:authorid as integer)', {'title': 'Emma 4', 'authorid': 'x'}, 'books.csv'),
+        SimpleQueryExecutor(2, OperationType.INSERT, 'books', query, {'title': 'Emma 3', 'series': 'Emma'}, 'books.csv'),
+    ]
+
+    executor_service = ExecutorService()
+    result = executor_service.execute_sql(executors, True, False)
+
+    assert [(er.line_number, er.success, er.sqlstate) for er in result] == [(0, True, None), (1, False, '22P02'), (2, True, None)]
+    assert executor_service.retry_statistics == {'rounds': 1, 'rows': 1}
+
+
+def test_execute_retries_unique_violation(db, cnx, context):
+    # two rows that swap unique values violate the unique constraint in the first round, the row that moves its value away fixes it
+    with cnx.cursor() as cr:
+        cr.execute('DROP TABLE IF EXISTS t3')
+        cr.execute('CREATE TABLE t3(code TEXT UNIQUE, label TEXT UNIQUE)')
+        cr.execute("INSERT INTO t3 VALUES ('1', 'x'), ('2', 'y')")
+        cnx.commit()
+
+    query = 'update t3 set label = :label where code = :code'
+    executors = [SimpleQueryExecutor(i, OperationType.UPDATE, 't3', query, {'code': code, 'label': label}, 't3.csv') for i, (code, label) in enumerate([('1', 'y'), ('2', 'z')])]
+
+    executor_service = ExecutorService()
+    result = executor_service.execute_sql(executors, True, True)
+
+    assert [(er.line_number, er.success) for er in result] == [(0, True), (1, True)]
+    assert executor_service.retry_statistics == {'rounds': 1, 'rows': 1}
+    with cnx.cursor() as cr:
+        cr.execute('select code, label from t3 order by code')
+        assert cr.fetchall() == [('1', 'y'), ('2', 'z')]
+
+
+def test_is_retryable():
+    def result(error, sqlstate=None):
+        return ExecutionResult(0, OperationType.INSERT, False, 0, 'books', None, {}, None, error=error, sqlstate=sqlstate)
+
+    executor_service = ExecutorService()
+
+    # rows that affected no row and foreign key or not null violations may succeed after other rows succeed
+    assert executor_service._is_retryable(result('No row was affected'))
+    assert executor_service._is_retryable(result(None))
+    assert executor_service._is_retryable(result('insert or update on table "books" violates foreign key constraint', '23503'))
+    assert executor_service._is_retryable(result('null value in column "authorid" violates not-null constraint', '23502'))
+
+    # unique and exclusion violations may succeed after another row changes the conflicting value
+    assert executor_service._is_retryable(result('duplicate key value violates unique constraint', '23505'))
+    assert executor_service._is_retryable(result('conflicting key value violates exclusion constraint', '23P01'))
+
+    # type errors and errors that are not raised by the database fail the same way in every round
+    assert not executor_service._is_retryable(result('invalid input syntax for type integer', '22P02'))
+    assert not executor_service._is_retryable(result('More than one row was affected, do not commit.'))
+
+
+def test_execute_copy(db, books, context):
+    # verify that copied rows keep nulls, empty strings and quotes
+    query = 'insert into authors(name, birthyear) select :name, :birthyear'
+    executors = [SimpleQueryExecutor(i, OperationType.INSERT, 'authors', query, params, 'authors.csv') for i, params in
+                 enumerate([{'name': 'Mark "Twain"', 'birthyear': 1835}, {'name': '', 'birthyear': None}])]
+    copy = CopyQueryExecutor(OperationType.INSERT, 'authors', 'copy authors(name, birthyear) from stdin with (format csv)', ['name', 'birthyear'], executors, 'authors.csv')
+
+    result = ExecutorService().execute_sql([copy], True, False)
+
+    assert [(er.line_number, er.success, er.rowcount) for er in result] == [(0, True, 1), (1, True, 1)]
+    with cnx_context.cnx.cursor() as cr:
+        cr.execute("select name, birthyear from authors where author_id > 4 order by author_id")
+        assert cr.fetchall() == [('Mark "Twain"', 1835), ('', None)]
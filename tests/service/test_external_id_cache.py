@@ -0,0 +1,142 @@
+import stimula.service.db
+from stimula.service.db_reader import DbReader
+from stimula.service.external_id_cache import ExternalIdCache, external_id_reference
+from stimula.stml.model_enricher import ModelEnricher
+from stimula.service.odoo.postgres_model_service import PostgresModelService
+from stimula.stml.stml_parser import StmlParser
+
+
+def _mapping(table_name, header):
+    return ModelEnricher(PostgresModelService()).enrich(StmlParser().parse_csv(table_name, header))
+
+
+def _caches(monkeypatch):
+    # keep the caches that loads create, to count their queries
+    caches = []
+
+    class _ExternalIdCache(ExternalIdCache):
+        def __init__(self):
+            super().__init__()
+            caches.append(self)
+
+    monkeypatch.setattr(stimula.service.db, 'ExternalIdCache', _ExternalIdCache)
+    return caches
+
+
+def _author_external_ids(cnx):
+    # give authors an external id
+    with cnx.cursor() as cr:
+        cr.execute("insert into ir_model_data(res_id, name, module, model) select author_id, 'author_' || author_id, 'netsuite_authors', 'authors' from authors")
+    cnx.commit()
+
+
+def test_ids_and_names(db, books, ir_model_data, context):
+    # verify that external ids are read once, in both directions
+    cache = ExternalIdCache()
+
+    assert cache.ids('netsuite_books', 'books')['22222'] == 2
+    assert cache.names('netsuite_books', 'books')[2] == '22222'
+    assert cache.ids('netsuite_books', 'authors') == {}
+    assert cache.loads == 2
+
+    # invalidate a module and model, then verify that it's read again
+    cache.invalidate('netsuite_books', 'books')
+    cache.ids('netsuite_books', 'books')
+    cache.ids('netsuite_books', 'authors')
+    assert cache.loads == 3
+
+
+def test_names_not_unique(db, cnx, books, ir_model_data, context):
+    # verify that the reverse map is not used if a record has more than one external id
+    with cnx.cursor() as cr:
+        cr.execute("insert into ir_model_data(res_id, name, module, model) values (2, '22222b', 'netsuite_books', 'books')")
+
+    cache = ExternalIdCache()
+
+    assert cache.names('netsuite_books', 'books') is None
+    assert cache.ids('netsuite_books', 'books')['22222b'] == 2
+
+
+def test_external_id_reference(db, books, ir_model_data):
+    # verify that root and nested external ids are recognized, and other references are not
+    mapping = _mapping('books', 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_books]')
+    assert [external_id_reference(a, 'books') for a in mapping.attributes] == [None, None, ('netsuite_books', 'books')]
+
+    mapping = _mapping('books', 'title[unique=true], authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_authors])')
+    assert external_id_reference(mapping.attributes[1], 'books') == ('netsuite_authors', 'authors')
+
+
+def test_read_from_db_with_external_ids(db, books, ir_model_data, context):
+    # verify that reading with cached external ids gives the same result as joining the external id table
+    for header in ['title[unique=true], authorid(name), bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_books]',
+                   'title, authorid(name), bookid(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_books: unique=true]']:
+        mapping = _mapping('books', header)
+        expected = DbReader().read_from_db(mapping, None, set_index=True).sort_index()
+        actual = DbReader().read_from_db(mapping, None, set_index=True, external_ids=ExternalIdCache()).sort_index()
+
+        assert actual.equals(expected)
+
+
+def test_resolve_external_ids_from_cache(db, cnx, books, ir_model_data, context, monkeypatch):
+    # verify that references by external id are resolved from the cache, without a lookup query
+    _author_external_ids(cnx)
+    caches = _caches(monkeypatch)
+    header = 'title[unique=true], authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_authors])'
+    body = '''
+        Pride and Prejudice, author_2
+        Emma, author_3
+    '''
+
+    report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, prefetch=True, cache_external_ids=True, context='books.csv')
+
+    assert report['summary']['success'] == {'insert': 1, 'update': 1, 'delete': 0}
+    assert report['summary']['failed'] == {'insert': 0, 'update': 0, 'delete': 0}
+    assert [cache.loads for cache in caches] == [1]
+
+    with cnx.cursor() as cr:
+        cr.execute("select title, authorid from books where title in ('Pride and Prejudice', 'Emma') order by title")
+        assert cr.fetchall() == [('Emma', 3), ('Pride and Prejudice', 2)]
+
+
+def test_external_ids_read_per_load(db, cnx, books, ir_model_data, context, monkeypatch):
+    # verify that each load reads the external ids again, so that it sees external ids that other sessions inserted
+    caches = _caches(monkeypatch)
+    header = 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    body = '''
+        Emma, Jane Austen, 12345
+    '''
+    report = db.post_table_get_full_report('books', header, None, body, update=True, cache_external_ids=True, context='books.csv')
+    assert report['summary']['total']['operations'] == 1
+
+    # another session gives the book this external id
+    with cnx.cursor() as cr:
+        cr.execute("update ir_model_data set name = '12345' where module = 'netsuite_books' and model = 'books' and res_id = 1")
+    cnx.commit()
+
+    # the next load finds the external id, so there's nothing to change
+    report = db.post_table_get_full_report('books', header, None, body, update=True, cache_external_ids=True, context='books.csv')
+
+    assert report['summary']['total']['operations'] == 0
+    assert [cache.loads for cache in caches] == [1, 1]
+
+
+def test_no_cache_without_caching(db, books, ir_model_data, context, monkeypatch):
+    # verify that no cache is created if caching is off
+    caches = _caches(monkeypatch)
+    db.post_table_get_full_report('books', 'title[unique=true], authorid(name)', None, 'Emma, Jane Austen', update=True, context='books.csv')
+    assert caches == []
+
+
+def test_invalidate_inserted_external_ids(db, cnx, books, ir_model_data, context, monkeypatch):
+    # verify that external ids that a load inserts are invalidated in the cache of that load
+    caches = _caches(monkeypatch)
+    header = 'title[unique=true], authorid(name), bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    body = '''
+        Pride and Prejudice, Jane Austen, 12345
+    '''
+    db.post_table_get_full_report('books', header, None, body, insert=True, execute=True, commit=True, cache_external_ids=True, context='books.csv')
+    assert caches[0].loads == 1
+
+    # the cache reads the inserted external id again
+    assert caches[0].ids('netsuite_books', 'books')['12345'] == 7
+    assert caches[0].loads == 2
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+
+from stimula.service.csv_reader import CsvReader
+from stimula.service.merge_reader import MergeReader
+from stimula.stml.stml_parser import StmlParser
+
+
+def _add_books(cnx):
+    # add titles that sort differently by code point than in a linguistic collation
+    with cnx.cursor() as cr:
+        cr.execute("insert into books(title, authorid) values ('apple', 1), ('Zebra', 1), ('Émile', 1), ('a b', 1), ('a-b', 1), ('ab', 1)")
+    cnx.commit()
+
+
+def _sorted(df):
+    # order rows by line number, or by key for deleted rows, because the merge diff finds them in key order
+    return df.sort_values(list(df.columns[:2])).reset_index(drop=True) if not df.empty else df
+
+
+def test_read_chunks(books, model_enricher, context):
+    # verify that each chunk of the table is paired with the request lines up to its last key
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(name)'))
+    body = '''
+        War and Peace, Leo Tolstoy
+        Alice, Jane Austen
+        Emma, Jane Austen
+        Zorro, Joseph Heller
+    '''
+    df_request = CsvReader().read_from_request(mapping, body, 0)
+
+    chunks = list(MergeReader(chunk_size=2).read_chunks(mapping, df_request, None))
+
+    assert [df_db.index.tolist() for _, df_db in chunks] == [['Anna Karenina', 'Catch-22'], ['David Copperfield', 'Emma'], ['Good as Gold', 'War and Peace'], [], []]
+    assert [df_request_chunk.index.tolist() for df_request_chunk, _ in chunks] == [['Alice'], ['Emma'], ['War and Peace'], [], ['Zorro']]
+
+
+def test_read_chunks_empty_keys(books, model_enricher, context):
+    # verify that the full table is read at once if the request has empty keys
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(name)[unique=true]'))
+    df_request = CsvReader().read_from_request(mapping, 'Emma, \n', 0)
+
+    chunks = list(MergeReader(chunk_size=2).read_chunks(mapping, df_request, None))
+
+    assert len(chunks) == 1 and len(chunks[0][1]) == 6
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 100])
+@pytest.mark.parametrize('table_name, header, body', [
+    ('books', 'title[unique=true], authorid(name), price', '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Émile, Jane Austen,
+        ab, Leo Tolstoy,
+        Pride and Prejudice, Jane Austen,
+        zz, Jane Austen,
+    '''),
+    ('books', 'title[unique=true], authorid(name)[unique=true], description', '''
+        Emma, Jane Austen, A novel
+        a b, Jane Austen,
+        Anna Karenina, Jane Austen,
+        Catch-22, Joseph Heller,
+    '''),
+    ('properties', 'number[unique=true], name', '''
+        1, key 0
+        3, key 3
+        10, key 10
+    '''),
+])
+def test_merge_same_as_pandas(db, cnx, books, model_enricher, context, chunk_size, table_name, header, body):
+    # verify that comparing the table chunk by chunk finds the same inserts, updates and deletes as comparing the full table
+    _add_books(cnx)
+    with cnx.cursor() as cr:
+        cr.execute("INSERT INTO properties (name, number) VALUES ('key 1', 1), ('key 2', 2), ('key 3', 3), ('key 9', 9)")
+        cnx.commit()
+
+    pandas_diffs, _ = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, True, True, None, None)
+
+    mapping = model_enricher.enrich(StmlParser().parse_csv(table_name, header))
+    df_request = CsvReader().read_from_request(mapping, body, 0)
+    chunk_diffs = [db._compare(df_request_chunk, df_db, True, True, True) for df_request_chunk, df_db in MergeReader(chunk_size).read_chunks(mapping, df_request, None)]
+    merge_diffs = [pd.concat(parts) for parts in zip(*chunk_diffs)]
+
+    # ignore dtypes, because pandas infers the dtype of a column that only has nulls from fewer rows. Chunks may have updates in other columns
+    for pandas_diff, merge_diff in zip(pandas_diffs, merge_diffs):
+        pd.testing.assert_frame_equal(_sorted(merge_diff), _sorted(pandas_diff), check_dtype=False, check_like=True)
+
+
+def test_diff_engine_merge(db, books, context):
+    # verify that the merge diff engine creates the same statements as the pandas diff engine
+    body = '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Pride and Prejudice, Jane Austen,
+    '''
+    header = 'title[unique=true], authorid(name), price'
+    pandas_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, delete=True)
+    merge_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, delete=True, diff_engine='merge')
+
+    assert merge_report['summary']['total'] == pandas_report['summary']['total']
+    assert sorted(r['query'] for r in merge_report['rows']) == sorted(r['query'] for r in pandas_report['rows'])
@@ -0,0 +1,77 @@
+import pytest
+
+from stimula.service.context import cnx_context
+from stimula.service.executor_service import ExecutorService
+from stimula.service.parallel_executor import ParallelExecutor
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+
+INSERT_QUERY = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+
+
+def _insert_executors(rows):
+    executors = []
+    for i, (title, name) in enumerate(rows):
+        executor = SimpleQueryExecutor(i, OperationType.INSERT, 'books', INSERT_QUERY, {'title': title, 'name': name}, 'books.csv')
+        executor.keys = [('books', {'title': title})]
+        executors.append(executor)
+    return executors
+
+
+def _books(cnx):
+    with cnx.cursor() as cr:
+        cr.execute('select title from books order by title')
+        return [row[0] for row in cr.fetchall()]
+
+
+def test_partition():
+    # verify that executors that depend on each other are in the same partition, and that deletes are in a single partition
+    executors = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', INSERT_QUERY, {}, 'books.csv') for i in range(20)]
+    for i, executor in enumerate(executors):
+        executor.keys = [('books', {'title': f'book {i}'})]
+    # the last book references the first
+    executors[-1].references = [('books', ('title',), ('book 0',))]
+    deletes = [SimpleQueryExecutor(None, OperationType.DELETE, 'books', 'delete from books where title = :title', {'title': f'old {i}'}, 'books.csv') for i in range(5)]
+
+    partitions = ParallelExecutor(4).partition(executors + deletes)
+
+    # all executors are in a partition, in their original order
+    assert sorted(e.line_number for p in partitions for e in p if e.line_number is not None) == list(range(20))
+    assert all([e for e in p if e.line_number is not None] == sorted([e for e in p if e.line_number is not None], key=lambda e: e.line_number) for p in partitions)
+    assert sum(1 for p in partitions if p) > 1
+
+    # first and last book are in the same partition, and deletes are together
+    assert [executors[-1] in p for p in partitions] == [executors[0] in p for p in partitions]
+    assert set(deletes) <= set(partitions[0])
+
+
+def test_execute_parallel_commit(db, cnx, books, context, prepared_transactions):
+    # verify that partitions report the same results as a single connection, and that all partitions are committed
+    rows = [('Catch XIII', 'Joseph Heller'), ('Emma 2', 'Jane Austen'), ('Witches', 'Charles Dickens'), ('Hard Times', 'Charlie Dickens'), ('Oliver Twist', 'Charles Dickens')]
+
+    result = ExecutorService().execute_sql(_insert_executors(rows), True, True, parallel_size=3)
+
+    assert [(r.line_number, r.success) for r in result] == [(0, True), (1, True), (2, True), (3, False), (4, True)]
+    assert {'Catch XIII', 'Emma 2', 'Witches', 'Oliver Twist'} <= set(_books(cnx))
+
+    # verify that the original connection is restored
+    assert cnx_context.cnx is cnx
+
+
+def test_execute_parallel_no_commit(db, cnx, books, context, prepared_transactions):
+    # verify that partitions are rolled back if commit is not requested
+    result = ExecutorService().execute_sql(_insert_executors([('Catch XIII', 'Joseph Heller'), ('Witches', 'Charles Dickens')]), True, False, parallel_size=2)
+
+    assert [r.success for r in result] == [True, True]
+    assert 'Catch XIII' not in _books(cnx)
+
+
+def test_execute_parallel_block_commit(db, cnx, books, context, prepared_transactions):
+    # verify that all partitions are rolled back if a row affected more than one row
+    executors = _insert_executors([('Catch XIII', 'Joseph Heller'), ('Witches', 'Charles Dickens')])
+    executors.append(SimpleQueryExecutor(2, OperationType.UPDATE, 'books', 'update books set price = :price from authors where books.authorid = authors.author_id and authors.name = :name',
+                                         {'price': 1.5, 'name': 'Leo Tolstoy'}, 'books.csv'))
+
+    with pytest.raises(ValueError, match='rolled back all partitions'):
+        ExecutorService().execute_sql(executors, True, True, parallel_size=2)
+
+    assert 'Catch XIII' not in _books(cnx) and 'Witches' not in _books(cnx)
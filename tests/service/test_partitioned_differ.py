@@ -0,0 +1,66 @@
+import pandas as pd
+
+from stimula.service.partitioned_differ import PartitionedDiffer
+
+
+def test_partition():
+    # verify that equal keys are in the same partition, also if their types differ
+    request_index = pd.Index([3, 1, None, 2], dtype='Int64')
+    db_index = pd.Index([1, 2, 3, 4], dtype='int64')
+
+    request_partitions, db_partitions = PartitionedDiffer(2).partition(request_index, db_index)
+
+    assert request_partitions.tolist()[:2] == [db_partitions[2], db_partitions[0]]
+    assert request_partitions[3] == db_partitions[1]
+    assert set(request_partitions.tolist() + db_partitions.tolist()) == {0, 1}
+
+
+def test_partition_multi_index():
+    # verify that equal composite keys are in the same partition
+    request_index = pd.MultiIndex.from_tuples([('a', 1), ('b', 2), ('c', 3)])
+    db_index = pd.MultiIndex.from_tuples([('c', 3), ('a', 1), ('a', 2)])
+
+    request_partitions, db_partitions = PartitionedDiffer(3).partition(request_index, db_index)
+
+    assert [request_partitions[0], request_partitions[2]] == [db_partitions[1], db_partitions[0]]
+
+
+def test_diff_processes_same_as_single_process(db, cnx, books, context):
+    # verify that comparing in several processes creates the same statements in the same order as a single process
+    body = '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Pride and Prejudice, Jane Austen,
+        Catch-22, Joseph Heller,
+        Oliver Twist, Charles Dickens, 8.50
+    '''
+    header = 'title[unique=true], authorid(name), price'
+    single_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, delete=True, execute=True)
+    cnx.rollback()
+    partitioned_report = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, delete=True, execute=True, diff_processes=3)
+    cnx.rollback()
+
+    # the worker processes leave the connection intact, so the statements execute
+    assert partitioned_report['summary']['total'] == single_report['summary']['total']
+    assert partitioned_report['summary']['failed'] == {'insert': 0, 'update': 0, 'delete': 0}
+    assert [r.get('line_number') for r in partitioned_report['rows']] == [r.get('line_number') for r in single_report['rows']]
+    assert sorted(r['query'] for r in partitioned_report['rows']) == sorted(r['query'] for r in single_report['rows'])
+
+
+def test_diff_processes_diffs(db, books, context):
+    # verify that the diffs of the partitions are combined in the order of the request lines
+    body = '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Pride and Prejudice, Jane Austen,
+        Catch-22, Joseph Heller, 1
+        Oliver Twist, Charles Dickens, 8.50
+    '''
+    header = 'title[unique=true], authorid(name), price'
+    single_diffs, _ = db._get_diffs_and_sql('books', header, None, body, 0, None, True, True, True, None, None)
+    partitioned_diffs, _ = db._get_diffs_and_sql('books', header, None, body, 0, None, True, True, True, None, None, diff_processes=2)
+
+    # inserts and updates are in the order of the request lines, deletes in the order of their partition
+    for single_diff, partitioned_diff in zip(single_diffs[:2], partitioned_diffs[:2]):
+        pd.testing.assert_frame_equal(partitioned_diff, single_diff, check_dtype=False, check_like=True)
+    assert sorted(partitioned_diffs[2].iloc[:, 0]) == sorted(single_diffs[2].iloc[:, 0])
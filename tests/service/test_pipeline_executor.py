@@ -0,0 +1,92 @@
+import pytest
+
+from stimula.service.context import cnx_context
+from stimula.service.executor_service import ExecutorService
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+
+# pipeline mode requires psycopg 3
+pytest.importorskip('psycopg')
+
+INSERT_QUERY = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+
+
+def _insert_executors(rows):
+    return [SimpleQueryExecutor(i, OperationType.INSERT, 'books', INSERT_QUERY, {'title': title, 'name': name}, 'books.csv') for i, (title, name) in enumerate(rows)]
+
+
+def _books(cnx):
+    with cnx.cursor() as cr:
+        cr.execute('select title from books order by title')
+        return [row[0] for row in cr.fetchall()]
+
+
+def test_execute_in_pipeline_same_as_by_row(db, cnx, books, context):
+    # verify that pipeline mode reports the same results as executing row by row, including rows that fail and rows that affect no row
+    rows = [('Catch XIII', 'Joseph Heller'), ('Emma', 'Jane Austen'), ('Witches', 'Charles Dickens'), ('Hard Times', 'Charlie Dickens'), ('Oliver Twist', 'Charles Dickens')]
+
+    by_row = ExecutorService().execute_sql(_insert_executors(rows), True, False)
+    cnx.rollback()
+    in_pipeline = ExecutorService().execute_sql(_insert_executors(rows), True, False, pipeline_size=10)
+
+    # psycopg2 adds a line break to error messages
+    assert [(r.line_number, r.success, r.rowcount, (r.error or "").strip()) for r in in_pipeline] == [(r.line_number, r.success, r.rowcount, (r.error or "").strip()) for r in by_row]
+    assert [r.success for r in in_pipeline] == [True, False, True, False, True]
+
+    # verify that the original connection is restored
+    assert cnx_context.cnx is cnx
+
+
+def test_execute_in_pipeline_commit(db, cnx, books, context):
+    # verify that rows after a failed row are executed, and that rows are committed on the pipeline connection
+    rows = [('Catch XIII', 'Joseph Heller'), ('Emma', 'Jane Austen'), ('Witches', 'Charles Dickens')]
+
+    result = ExecutorService().execute_sql(_insert_executors(rows), True, True, pipeline_size=2)
+
+    assert [r.success for r in result] == [True, False, True]
+    assert 'Catch XIII' in _books(cnx) and 'Witches' in _books(cnx)
+
+
+def test_execute_in_pipeline_retry(db, cnx, books, context):
+    # verify that a row that references a later row succeeds in the next round
+    sql = [
+        SimpleQueryExecutor(0, OperationType.INSERT, 'books', 'insert into books(title, authorid, seriesid) select :title, authors.author_id, books.bookid from authors, books where authors.name = :name and books.title = :series',
+                            {'title': 'Emma 2', 'name': 'Jane Austen', 'series': 'Emma 3'}, 'books.csv'),
+        SimpleQueryExecutor(1, OperationType.INSERT, 'books', INSERT_QUERY, {'title': 'Emma 3', 'name': 'Jane Austen'}, 'books.csv'),
+    ]
+
+    result = ExecutorService().execute_sql(sql, True, True, pipeline_size=10)
+
+    assert [r.success for r in result] == [True, True]
+
+
+def test_execute_in_pipeline_more_than_one_row(db, cnx, books, context):
+    # verify that a row that affects more than one row is rolled back, and that the rows after it are executed
+    sql = [
+        SimpleQueryExecutor(0, OperationType.UPDATE, 'books', 'update books set price = :price from authors where books.authorid = authors.author_id and authors.name = :name',
+                            {'price': 1.5, 'name': 'Leo Tolstoy'}, 'books.csv'),
+        SimpleQueryExecutor(1, OperationType.UPDATE, 'books', 'update books set price = :price where title = :title', {'price': 2.5, 'title': 'Emma'}, 'books.csv'),
+    ]
+
+    result = ExecutorService().execute_sql(sql, True, True, pipeline_size=10)
+
+    assert [(r.success, r.rowcount, r.block_commit) for r in result] == [(False, 2, True), (True, 1, False)]
+
+    with cnx.cursor() as cr:
+        cr.execute('select title, price from books where price is not null order by title')
+        assert cr.fetchall() == [('Emma', 2.5)]
+
+
+def test_execute_in_pipeline_refuses_open_changes(db, cnx, books, context):
+    # verify that pipeline mode is refused if the current transaction has changes that the pipeline connection can't see
+    with cnx.cursor() as cr:
+        cr.execute("insert into authors(name) values ('Mark Twain')")
+
+    with pytest.raises(AssertionError, match='Pipeline mode runs outside the current transaction'):
+        ExecutorService().execute_sql(_insert_executors([('Tom Sawyer', 'Mark Twain')]), True, False, pipeline_size=10)
+    cnx.rollback()
+
+    # verify that a transaction that only read rows is accepted
+    with cnx.cursor() as cr:
+        cr.execute('select count(*) from books')
+    result = ExecutorService().execute_sql(_insert_executors([('Tom Sawyer', 'Jane Austen')]), True, False, pipeline_size=10)
+    assert [r.success for r in result] == [True]
@@ -0,0 +1,135 @@
+from psycopg2 import sql
+
+from stimula.service.plan import Plan, mapping_markers, read_markers
+from stimula.stml.stml_parser import StmlParser
+
+
+def _tables(*tables):
+    # markers of whole tables
+    return {table: sql.SQL('from {table}').format(table=sql.Identifier(table)) for table in tables}
+
+
+def test_mapping_markers(db, cnx, books, model_enricher, context):
+    # verify that the written table is marked as a whole, and referenced tables only for the referenced rows
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(name)'))
+    markers = mapping_markers(mapping)
+    assert {name: rows.as_string(cnx) for name, rows in markers.items()} == {
+        'books': 'from "books"',
+        'books.authorid': 'from "authors" where "authors"."author_id" in (select "books"."authorid" from "books")',
+    }
+
+    # if references are resolved up front, referenced tables are marked as a whole
+    assert mapping_markers(mapping, resolved=True)['books.authorid'].as_string(cnx) == 'from "authors"'
+
+
+def test_mapping_markers_external_ids(db, cnx, books, model_enricher, ir_model_data, context):
+    # verify that external ids are only marked for the module and model of the reference
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_authors])'))
+    markers = mapping_markers(mapping)
+    assert markers['books.authorid.author_id'].as_string(cnx) == ('from "ir_model_data" where "ir_model_data"."res_id" in (select "authors"."author_id" '
+                                                                  'from "authors" where "authors"."author_id" in (select "books"."authorid" from "books")) '
+                                                                  'and "ir_model_data".module = \'netsuite_authors\' and "ir_model_data".model = \'authors\'')
+
+    # external ids of other models don't change the marker
+    before = read_markers(markers)
+    with cnx.cursor() as cr:
+        cr.execute("insert into ir_model_data(res_id, name, module, model) values (1, 'other', 'netsuite_books', 'books')")
+    cnx.commit()
+    assert read_markers(markers) == before
+
+
+def test_markers(db, cnx, books, context):
+    # verify that markers change on committed writes, but not on rolled back writes
+    markers = read_markers(_tables('books', 'authors'))
+
+    with cnx.cursor() as cr:
+        cr.execute("update books set price = 1 where title = 'Emma'")
+    cnx.rollback()
+    assert read_markers(_tables('books', 'authors')) == markers
+
+    with cnx.cursor() as cr:
+        cr.execute("update books set price = 1 where title = 'Emma'")
+    cnx.commit()
+    assert read_markers(_tables('books', 'authors'))['books'] != markers['books']
+    assert read_markers(_tables('books', 'authors'))['authors'] == markers['authors']
+
+
+def test_apply_current_plan(db, cnx, books, context, tmp_path):
+    # verify that a plan is applied without comparing again, if tables didn't change
+    plan = str(tmp_path / 'plan')
+    body = '''
+        Emma, Charles Dickens
+        Catch XIII, Joseph Heller
+    '''
+    header = 'title[unique=true], authorid(name)'
+    review = db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, context='my table', plan=plan)
+    # the review run ends without commit
+    cnx.rollback()
+
+    full_report = db.apply_plan(plan, commit=True)
+
+    assert full_report['summary']['plan'] == 'current'
+    assert full_report['summary']['commit'] is True
+    assert full_report['summary']['success'] == review['summary']['success'] == {'insert': 1, 'update': 1, 'delete': 0}
+    assert full_report['rows'] == review['rows']
+
+    df, _ = db.get_table('books', header)
+    authors = dict(df[['title[unique=true]', 'authorid(name)']].values.tolist())
+    assert (authors['Emma'], authors['Catch XIII']) == ('Charles Dickens', 'Joseph Heller')
+
+
+def test_apply_changed_plan(db, cnx, books, context, tmp_path):
+    # verify that a plan is loaded again, if a table changed since the plan was created
+    plan = str(tmp_path / 'plan')
+    body = '''
+        Emma, Charles Dickens
+        Catch XIII, Joseph Heller
+    '''
+    header = 'title[unique=true], authorid(name)'
+    db.post_table_get_full_report('books', header, None, body, insert=True, update=True, execute=True, context='my table', plan=plan)
+    cnx.rollback()
+
+    # another user changes the author of Emma in the mean time
+    with cnx.cursor() as cr:
+        cr.execute("update books set authorid = (select author_id from authors where name = 'Charles Dickens') where title = 'Emma'")
+    cnx.commit()
+
+    full_report = db.apply_plan(plan, commit=True)
+
+    assert full_report['summary']['plan'] == 'changed'
+    assert full_report['summary']['success'] == {'insert': 1, 'update': 0, 'delete': 0}
+
+
+def test_load_restores_orm(db, books, context, tmp_path):
+    # verify that the ORM is not pickled, but restored on load
+    path = str(tmp_path / 'plan')
+    orm = object()
+    Plan('post_table_get_full_report', {}, [], _tables('books')).save(path)
+
+    plan = Plan.load(path, orm)
+    assert plan.query_executors == [] and plan.is_current()
+
+
+def test_apply_plan_referenced_table_changed(db, cnx, books, context, tmp_path):
+    # verify that a plan is loaded again, if a row that the load references changed since the plan was created
+    plan = str(tmp_path / 'plan')
+    header = 'title[unique=true], authorid(name)'
+    db.post_table_get_full_report('books', header, None, 'Emma, Charles Dickens', update=True, execute=True, context='my table', plan=plan)
+    cnx.rollback()
+
+    # an author that no book references doesn't change the plan
+    with cnx.cursor() as cr:
+        cr.execute("insert into authors(name) values ('Mark Twain')")
+    cnx.commit()
+    assert Plan.load(plan).is_current()
+
+    # another user renames the author of Emma in the mean time, so the author of Emma is already called Charles Dickens
+    with cnx.cursor() as cr:
+        cr.execute("update authors set name = 'Charles Dickens Sr.' where name = 'Charles Dickens'")
+        cr.execute("update authors set name = 'Charles Dickens' where name = 'Jane Austen'")
+    cnx.commit()
+
+    full_report = db.apply_plan(plan, commit=True)
+
+    assert full_report['summary']['plan'] == 'changed'
+    assert full_report['summary']['success'] == {'insert': 0, 'update': 0, 'delete': 0}
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from stimula.service.progress_journal import ProgressJournal, to_ranges
+from stimula.service.query_executor import ExecutionResult, OperationType
+
+
+def _result(line_number, operation_type=OperationType.INSERT, table_name='books'):
+    return ExecutionResult(line_number, operation_type, True, 1, table_name, 'query', {}, 'books.csv')
+
+
+def test_to_ranges():
+    assert to_ranges([5, 1, 2, 3, 7, 8]) == [[1, 3], [5, 5], [7, 8]]
+    assert to_ranges([]) == []
+
+
+def test_record_and_resume(tmp_path):
+    # verify that committed lines are written as ranges, and read back when resuming
+    path = str(tmp_path / 'journal')
+    with ProgressJournal(path, ['books'], ['title[unique=true]'], ['a\nb\nc']).open() as journal:
+        journal.record([_result(0), _result(1), _result(None, OperationType.DELETE)])
+        journal.record([_result(3)])
+        journal.record([])
+
+    with open(path) as file:
+        entries = [json.loads(line) for line in file]
+    assert entries[1:] == [{'chunk': 0, 'lines': {'books': [[0, 1]]}, 'deletes': {'books': 1}}, {'chunk': 1, 'lines': {'books': [[3, 3]]}, 'deletes': {}}]
+
+    with ProgressJournal(path, ['books'], ['title[unique=true]'], ['a\nb\nc']).open(resume=True) as journal:
+        assert journal.committed_lines('books') == {0, 1, 3}
+        # new chunks are appended
+        journal.record([_result(4)])
+        assert journal.chunks == 3
+
+
+def test_resume_cut_off_line(tmp_path):
+    # verify that a line that was cut off by a crash is ignored
+    path = str(tmp_path / 'journal')
+    with ProgressJournal(path, ['books'], ['title[unique=true]'], ['a']).open() as journal:
+        journal.record([_result(0)])
+    with open(path, 'a') as file:
+        file.write('{"chunk":1,"lines":{"books":[[1,')
+
+    with ProgressJournal(path, ['books'], ['title[unique=true]'], ['a']).open(resume=True) as journal:
+        assert journal.committed_lines('books') == {0}
+
+
+def test_resume_other_contents(tmp_path):
+    # verify that a journal of other contents or another mapping can't be resumed
+    path = str(tmp_path / 'journal')
+    ProgressJournal(path, ['books'], ['title[unique=true]'], ['a']).open().close()
+
+    with pytest.raises(AssertionError, match='other contents'):
+        ProgressJournal(path, ['books'], ['title[unique=true]'], ['b']).open(resume=True)
+    with pytest.raises(AssertionError, match='another mapping'):
+        ProgressJournal(path, ['books'], ['title[unique=true], price'], ['a']).open(resume=True)
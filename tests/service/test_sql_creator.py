@@ -3,8 +3,8 @@ import pandas as pd
 import pytest
 from numpy import int64, nan
 
-from stimula.service.query_executor import OperationType
-from stimula.service.sql_creator import InsertSqlCreator, UpdateSqlCreator, DeleteSqlCreator
+from stimula.service.query_executor import OperationType, SimpleQueryExecutor, IndexedBatchQueryExecutor, CopyQueryExecutor
+from stimula.service.sql_creator import InsertSqlCreator, UpdateSqlCreator, DeleteSqlCreator, BatchSqlCreator, BatchInsertSqlCreator, BatchUpdateSqlCreator, BatchDeleteSqlCreator, CopyInsertSqlCreator
 from stimula.stml.alias_enricher import AliasEnricher
 from stimula.stml.model import Entity, Reference, Attribute
 from stimula.stml.stml_parser import StmlParser
@@ -26,6 +26,67 @@ def test_create_sql(model_enricher, books):
     assert result[0].query, result[0].params == expected
 
 
+def test_create_batch_insert(model_enricher, books):
+    # verify that rows with the same query are combined into batches, and rows with a different query are not
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    inserts = pd.DataFrame([
+        ['Pride and Prejudice', 0, 'Jane Austen'],
+        ['Sense and Sensibility', 1, 'Jane Austen'],
+        ['Hard Times', 2, nan],
+        ['Oliver Twist', 3, 'Charles Dickens'],
+    ],
+        columns=['title[unique=true]', '__line__', 'authorid(name)']
+    )
+    result = list(BatchInsertSqlCreator(batch_size=10).create_executors(mapping, inserts))
+
+    assert [type(e) for e in result] == [IndexedBatchQueryExecutor, SimpleQueryExecutor]
+    assert [e.line_number for e in result[0].executors] == [0, 1, 3]
+    assert result[0].query == ('with batch_rows(row_index, title, authorid) as (select batch_values.row_index, batch_values.title, authors.author_id '
+                               'from (values (0, cast(:title__0 as text), cast(:name__0 as text)), (1, :title__1, :name__1), (2, :title__2, :name__2)) as batch_values(row_index, title, name), authors '
+                               'where authors.name = batch_values.name), '
+                               'batch_insert as (insert into books(title, authorid) select title, authorid from batch_rows) '
+                               'select row_index from batch_rows')
+    assert result[0].params == {'title__0': 'Pride and Prejudice', 'name__0': 'Jane Austen', 'title__1': 'Sense and Sensibility', 'name__1': 'Jane Austen',
+                                'title__2': 'Oliver Twist', 'name__2': 'Charles Dickens'}
+    assert result[1].query == 'insert into books(title) select :title'
+
+
+def test_create_batch_insert_batch_size(model_enricher, books):
+    # verify that batches don't exceed the batch size, and that a single remaining row is not batched
+    table_name = 'books'
+    header = 'title[unique=true], price'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    inserts = pd.DataFrame([[f'Title {i}', i, 10.0] for i in range(5)], columns=['title[unique=true]', '__line__', 'price'])
+
+    result = list(BatchInsertSqlCreator(batch_size=2).create_executors(mapping, inserts))
+
+    assert [type(e) for e in result] == [IndexedBatchQueryExecutor, IndexedBatchQueryExecutor, SimpleQueryExecutor]
+    assert [len(e.executors) for e in result[:2]] == [2, 2]
+
+
+def test_create_copy_insert(model_enricher, books):
+    # verify that rows with plain columns are copied, and that rows with a foreign key are inserted by row
+    table_name = 'books'
+    header = 'title[unique=true], price, authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    inserts = pd.DataFrame([
+        ['Pride and Prejudice', 0, 10.0, nan],
+        ['Sense and Sensibility', 1, nan, nan],
+        ['Hard Times', 2, 12.0, 'Charles Dickens'],
+        ['Oliver Twist', 3, 13.0, nan],
+    ],
+        columns=['title[unique=true]', '__line__', 'price', 'authorid(name)']
+    )
+    result = list(CopyInsertSqlCreator().create_executors(mapping, inserts))
+
+    assert [type(e) for e in result] == [CopyQueryExecutor, SimpleQueryExecutor, SimpleQueryExecutor]
+    assert [e.line_number for e in result[0].executors] == [0, 3]
+    assert result[0].query == 'copy books(title, price) from stdin with (format csv)'
+    assert result[0].parameter_names == ['title', 'price']
+
+
 def test_create_sql_multiple_update_rows(model_enricher, books):
     # verify that it can create multiple rows with different columns
     table_name = 'books'
@@ -49,6 +110,49 @@ def test_create_sql_multiple_update_rows(model_enricher, books):
     assert [(u.query, u.params) for u in updates] == expected
 
 
+
+def test_create_batch_update(model_enricher, books):
+    # verify that rows that modify the same columns are combined into a batch that returns the index of each updated row
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name), description'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    # create multi index series with self/other columns
+    columns = ['__line__', ('title[unique=true]', ''), ('authorid(name)', 'self'), ('authorid(name)', 'other'), ('description', 'self'), ('description', 'other')]
+
+    updates = pd.DataFrame([
+        [0, 'Pride and Prejudice', 'Charles Dickens', 'Jane Austen', nan, nan],
+        [1, 'David Copperfield', nan, nan, 'A novel by Charles Dickens', nan],
+        [2, 'Emma', 'Charles Dickens', 'Jane Austen', nan, nan],
+    ],
+        columns=columns
+    )
+    result = list(BatchUpdateSqlCreator(batch_size=10).create_executors(mapping, updates))
+
+    assert [type(e) for e in result] == [IndexedBatchQueryExecutor, SimpleQueryExecutor]
+    assert [e.line_number for e in result[0].executors] == [0, 2]
+    assert result[0].query == ('update books set authorid = authors.author_id '
+                               'from (values (0, cast(:title__0 as text), cast(:name__0 as text)), (1, :title__1, :name__1)) as batch_values(row_index, title, name), authors '
+                               'where books.title = batch_values.title and authors.name = batch_values.name returning batch_values.row_index')
+    assert result[0].params == {'title__0': 'Pride and Prejudice', 'name__0': 'Charles Dickens', 'title__1': 'Emma', 'name__1': 'Charles Dickens'}
+    assert result[1].query == 'update books set description = :description where books.title = :title'
+
+
+
+def test_create_batch_delete(model_enricher, books):
+    # verify that deleted rows are combined into a batch that returns the index of each deleted row
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    deletes = pd.DataFrame([['Emma', 'Jane Austen'], ['Catch-22', 'Joseph Heller']], columns=['title[unique=true]', 'authorid(name)'])
+
+    result = list(BatchDeleteSqlCreator(batch_size=10).create_executors(mapping, deletes))
+
+    assert [type(e) for e in result] == [IndexedBatchQueryExecutor]
+    assert result[0].query == ('delete from books using (values (0, cast(:title__0 as text)), (1, :title__1)) as batch_values(row_index, title) '
+                               'where books.title = batch_values.title returning batch_values.row_index')
+    assert result[0].params == {'title__0': 'Emma', 'title__1': 'Catch-22'}
+
+
 def test_create_sql_row_insert(model_enricher, books):
     # test that it creates an insert sql query and a value dict
     table_name = 'books'
@@ -292,3 +396,40 @@ def test_is_value_modified():
     assert UpdateSqlCreator()._is_value_modified('a', None)
     assert not UpdateSqlCreator()._is_value_modified('', nan)
     assert not UpdateSqlCreator()._is_value_modified('', None)
+
+
+def test_create_keys_and_references(model_enricher, books):
+    # verify that executors know the values they provide and reference, to execute them in dependency order
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], seriesid(title), authorid(name)')))
+    inserts = pd.DataFrame([
+        ['Emma 2', 0, 'Emma', 'Jane Austen'],
+        ['Emma 3', 1, nan, 'Jane Austen'],
+    ],
+        columns=['title[unique=true]', '__line__', 'seriesid(title)', 'authorid(name)']
+    )
+    result = list(InsertSqlCreator().create_executors(mapping, inserts))
+
+    assert result[0].keys == [('books', {'title': 'Emma 2'})]
+    assert result[0].references == [('books', ('title',), ('Emma',)), ('authors', ('name',), ('Jane Austen',))]
+    assert result[1].references == [('authors', ('name',), ('Jane Austen',))]
+
+
+def test_create_references_to_any_row(model_enricher, books):
+    # verify that a nested reference references any row of the tables it joins, because its values don't identify a row
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(publisherid(publishername))')))
+    inserts = pd.DataFrame([
+        ['Emma 2', 0, 'Penguin'],
+        ['Emma 3', 1, nan],
+    ],
+        columns=['title[unique=true]', '__line__', 'authorid(publisherid(publishername))']
+    )
+    result = list(InsertSqlCreator().create_executors(mapping, inserts))
+
+    assert result[0].references == [('authors', None, None), ('publishers', None, None)]
+    assert result[1].references == []
+
+
+def test_batch_sql_creator_is_abstract():
+    # verify that a batch creator must implement how a batch is created
+    with pytest.raises(TypeError):
+        BatchSqlCreator()
@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from stimula.service.staging_reader import StagingReader
+from stimula.stml.model_enricher import ModelEnricher
+from stimula.stml.stml_parser import StmlParser
+from stimula.service.csv_reader import CsvReader
+
+
+def test_read_changes(books, model_enricher, context):
+    # verify that only inserted and updated lines and updated and deleted rows are returned
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(name), price'))
+    body = '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Pride and Prejudice, Jane Austen,
+        Catch-22, Joseph Heller,
+    '''
+    df_request = CsvReader().read_from_request(mapping, body, 0)
+
+    df_request_changes, df_db_changes = StagingReader().read_changes(mapping, df_request, None, True, True, True)
+
+    # War and Peace is updated, Pride and Prejudice is inserted
+    assert df_request_changes['__line__'].tolist() == [1, 2]
+
+    # War and Peace is updated, David Copperfield, Good as Gold and Anna Karenina are deleted
+    assert sorted(df_db_changes.index.tolist()) == ['Anna Karenina', 'David Copperfield', 'Good as Gold', 'War and Peace']
+    assert df_db_changes.columns.tolist() == ['authorid(name)', 'price']
+
+
+def test_read_changes_only_enabled_operations(books, model_enricher, context):
+    # verify that rows are not returned for disabled operations
+    mapping = model_enricher.enrich(StmlParser().parse_csv('books', 'title[unique=true], authorid(name), price'))
+    body = '''
+        Emma, Jane Austen, 10.99
+        War and Peace, Leo Tolstoy, 12.50
+        Pride and Prejudice, Jane Austen,
+    '''
+    df_request = CsvReader().read_from_request(mapping, body, 0)
+
+    df_request_changes, df_db_changes = StagingReader().read_changes(mapping, df_request, None, True, False, False)
+
+    # only Pride and Prejudice is inserted
+    assert df_request_changes['__line__'].tolist() == [2]
+    assert df_db_changes.empty
+
+
+@pytest.mark.parametrize('table_name, header, body', [
+    ('books', 'title[unique=true], authorid(name), description, price', '''
+        Emma, Jane Austen, , 10.990
+        War and Peace, Leo Tolstoy, A novel, 12.5
+        Catch-22, Joseph Heller, ,
+        Pride and Prejudice, Jane Austen, , 9.95
+    '''),
+    ('books', 'title[unique=true], authorid(name:birthyear)', '''
+        Emma, Jane Austen:1775
+        War and Peace, Leo Tolstoy:1829
+    '''),
+    ('properties', 'name[unique=true], number, float, decimal, timestamp, date, jsonb', '''
+        key 0, 1, 1.5, 2.25, 2024-01-01 10:00, 2024-01-02, "{""a"": 1}"
+        key 1, 2, , , 2024-01-01 00:00, ,
+    '''),
+])
+def test_diff_engine_staging_same_as_pandas(db, cnx, books, context, table_name, header, body):
+    # verify that the staging diff engine finds the same inserts, updates and deletes as the pandas diff engine
+    with cnx.cursor() as cr:
+        cr.execute("INSERT INTO properties (name, number, float, decimal, timestamp, date, jsonb) VALUES ('key 0', 1, 1.5, 2.25, '2024-01-01 10:00', '2024-01-02', '{\"a\": 1}')")
+        cr.execute("INSERT INTO properties (name, number, float, timestamp, date) VALUES ('key 1', 3, 0.1, '2024-01-01 12:00', '2024-01-03')")
+        cr.execute("INSERT INTO properties (name) VALUES ('key 2')")
+        cnx.commit()
+
+    pandas_diffs, _ = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, True, True, None, None)
+    staging_diffs, _ = db._get_diffs_and_sql(table_name, header, None, body, 0, None, True, True, True, None, None, diff_engine='staging')
+
+    # ignore dtypes, because pandas infers the dtype of a column that only has nulls from fewer rows
+    for pandas_diff, staging_diff in zip(pandas_diffs, staging_diffs):
+        pd.testing.assert_frame_equal(staging_diff.reset_index(drop=True), pandas_diff.reset_index(drop=True), check_dtype=False)
@@ -0,0 +1,57 @@
+from stimula.service.context import cnx_context
+from stimula.service.executor_service import ExecutorService
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+from stimula.service.statement_cache import StatementCache, PreparedStatementCursor
+
+
+def _prepared_statements(cr):
+    cr.execute('select name from pg_prepared_statements order by name')
+    return [row[0] for row in cr.fetchall()]
+
+
+def test_execute_prepared(books, context):
+    # verify that a query is prepared once and executed per row
+    cache = StatementCache(cnx_context.cnx)
+    cr = PreparedStatementCursor(cnx_context.cr, cache)
+
+    for title in ['Witches', 'Hard Times']:
+        cr.execute('insert into books(title, authorid) select %(title)s, authors.author_id from authors where authors.name = %(name)s', {'title': title, 'name': 'Charles Dickens'})
+        assert cr.rowcount == 1
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert _prepared_statements(cnx_context.cr) == ['stimula_statement_1']
+
+
+def test_execute_not_preparable(books, context):
+    # verify that a query is executed as is if postgres can't infer its parameter types
+    cache = StatementCache(cnx_context.cnx)
+    cr = PreparedStatementCursor(cnx_context.cr, cache)
+
+    cr.execute('select 1 where %(value)s is null', {'value': None})
+
+    assert cr.fetchone() == (1,)
+    assert _prepared_statements(cnx_context.cr) == []
+
+
+def test_evict_least_recently_used(books, context):
+    # verify that the least recently used statement is deallocated when the cache is full
+    cache = StatementCache(cnx_context.cnx, size=2)
+    cr = PreparedStatementCursor(cnx_context.cr, cache)
+
+    for query in ['select %(a)s::int', 'select %(a)s::text', 'select %(a)s::int', 'select %(a)s::numeric']:
+        cr.execute(query, {'a': 1})
+
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert _prepared_statements(cnx_context.cr) == ['stimula_statement_1', 'stimula_statement_3']
+
+
+def test_execute_sql_prepared(books, context):
+    # verify that executing with prepared statements gives the same results
+    query = 'insert into books(title, authorid) select :title, authors.author_id from authors where authors.name = :name'
+    executors = [SimpleQueryExecutor(i, OperationType.INSERT, 'books', query, {'title': title, 'name': name}, 'books.csv') for i, (title, name) in
+                 enumerate([('Witches', 'Charles Dickens'), ('Ulysses', 'Unknown Author'), ('Hard Times', 'Charles Dickens')])]
+
+    result = ExecutorService().execute_sql(executors, True, False, prepare=True)
+
+    assert [(er.line_number, er.success, er.rowcount) for er in result] == [(0, True, 1), (1, False, 0), (2, True, 1)]
+    assert StatementCache.get().misses == 1
@@ -0,0 +1,51 @@
+from stimula.service.executor_service import ExecutorService
+from stimula.service.query_executor import SimpleQueryExecutor, OperationType
+from stimula.service.transaction_sizer import TransactionSizer
+
+
+def test_record_grows():
+    # verify that fast statements with a slow commit grow the transaction, by no more than a factor two
+    sizer = TransactionSizer(100, 10000, 1000)
+    sizer.record(1000, 0.1, 0.05)
+    assert sizer.size == 2000
+
+
+def test_record_shrinks():
+    # verify that slow statements shrink the transaction, so that it holds its locks no longer than the target
+    sizer = TransactionSizer(100, 10000, 1000, target_duration=1.0)
+    sizer.record(1000, 4.0, 0.01)
+    assert sizer.size == 500
+
+
+def test_record_bounds():
+    # verify that the size stays within bounds
+    sizer = TransactionSizer(100, 1500, 1000)
+    sizer.record(1000, 0.1, 0.05)
+    assert sizer.size == 1500
+
+    sizer = TransactionSizer(800, 10000, 1000)
+    sizer.record(1000, 4.0, 0.01)
+    assert sizer.size == 800
+
+
+def test_statistics():
+    # verify that committed sizes are reported
+    sizer = TransactionSizer(100, 10000, 1000)
+    sizer.commit(lambda: None, 1000)
+    sizer.commit(lambda: None, 300)
+
+    assert sizer.statistics() == {'commits': 2, 'min_size': 300, 'max_size': 1000, 'next_size': sizer.size}
+
+
+def test_execute_sql_adaptive(db, cnx, books, context):
+    # verify that the executor commits with the adaptive size, and reports the transactions
+    executors = [SimpleQueryExecutor(i, OperationType.INSERT, 'authors', 'insert into authors(name) values (:name)', {'name': f'author {i}'}, 'authors.csv') for i in range(5)]
+    executor_service = ExecutorService()
+
+    result = executor_service.execute_sql(executors, True, False, tx_size=TransactionSizer(2, 4, 2))
+
+    assert all(r.success for r in result)
+    # the last transaction commits the remaining rows, so it may be smaller than the minimum size
+    statistics = executor_service.transaction_statistics
+    assert statistics['commits'] >= 2
+    assert statistics['max_size'] <= 4 and 2 <= statistics['next_size'] <= 4
@@ -0,0 +1,95 @@
+import pandas as pd
+from sqlalchemy import MetaData, Table, Column, Integer, SmallInteger, String, Numeric, Text, UniqueConstraint
+
+from stimula.service.model_service import ModelService
+from stimula.service.query_executor import OperationType
+from stimula.service.validator import Validator
+from stimula.stml.stml_parser import StmlParser
+
+
+class _ModelService(ModelService):
+    # provides a table definition without a database
+
+    def __init__(self, table):
+        self._table = table
+
+    def get_table(self, table_name):
+        return self._table
+
+    def find_primary_keys(self, table):
+        return []
+
+    def resolve_foreign_key_table(self, table, column_name):
+        return None, column_name
+
+    def get_non_empty_columns(self, table):
+        return []
+
+    def read_table(self, mapping: dict, where_clause=None):
+        return None
+
+
+def _validator():
+    table = Table('products', MetaData(),
+                  Column('code', String(5), nullable=False),
+                  Column('name', Text, nullable=False),
+                  Column('quantity', SmallInteger),
+                  Column('price', Numeric(4, 2)),
+                  Column('stock', Integer, nullable=False, server_default='0'),
+                  UniqueConstraint('name', name='uc_products_name'))
+    return Validator(_ModelService(table))
+
+
+def test_validate_inserts():
+    # verify that rows that would fail on the table definition are reported, and removed from the inserts
+    mapping = StmlParser().parse_csv('products', 'code[unique=true], name, quantity, price, stock')
+    inserts = pd.DataFrame([
+        [0, 'A1', 'Apple', 10, 1.5, None],
+        [1, 'B12345', 'Banana', 10, 1.5, 5],
+        [2, 'C1', None, 10, 1.5, 5],
+        [3, 'D1', 'Date', 40000, 100.0, 5],
+        [4, 'E1', 'Apple', 10, 1.5, 5],
+    ], columns=['__line__', 'code[unique=true]', 'name', 'quantity', 'price', 'stock'])
+
+    (valid, _, _), failed = _validator().validate(mapping, (inserts, pd.DataFrame(), pd.DataFrame()), 'products.csv', check_existing=False)
+
+    assert valid['__line__'].tolist() == [0]
+    assert [(f.line_number, f.operation_type, f.error) for f in failed] == [
+        (1, OperationType.INSERT, "Value too long for column 'code', maximum length is 5"),
+        (2, OperationType.INSERT, "Column 'name' must not be empty"),
+        (3, OperationType.INSERT, "Value out of range for column 'quantity' of type smallint; Value out of range for column 'price' of type NUMERIC(4, 2)"),
+        (4, OperationType.INSERT, "Duplicate value for unique constraint 'uc_products_name' on name"),
+    ]
+
+
+def test_validate_updates():
+    # verify that only the new values of modified columns are validated
+    mapping = StmlParser().parse_csv('products', 'code[unique=true], name, quantity')
+    updates = pd.DataFrame([
+        [0, 'A1', 'Apple', 'Pear', 10, 5],
+        [1, 'B1', None, 'Banana', 10, 5],
+        [2, 'C1', 'Cherry', 'Kiwi', 'many', 5],
+    ], columns=pd.MultiIndex.from_tuples([('__line__', ''), ('code[unique=true]', ''), ('name', 'self'), ('name', 'other'), ('quantity', 'self'), ('quantity', 'other')]))
+
+    (_, valid, _), failed = _validator().validate(mapping, (pd.DataFrame(), updates, pd.DataFrame()), 'products.csv')
+
+    assert valid[('__line__', '')].tolist() == [0]
+    assert [(f.line_number, f.operation_type, f.error) for f in failed] == [
+        (1, OperationType.UPDATE, "Column 'name' must not be empty"),
+        (2, OperationType.UPDATE, "Value is not a number for column 'quantity'"),
+    ]
+
+
+def test_released_values():
+    # verify that values that the load deletes or updates to other values are released, and that unknown values are reported as such
+    updates = pd.DataFrame([
+        [0, 'A1', 'Pear', 'Apple'],
+        [1, 'B1', 'Apple', 'Pear'],
+    ], columns=pd.MultiIndex.from_tuples([('__line__', ''), ('code[unique=true]', ''), ('name', 'self'), ('name', 'other')]))
+    deletes = pd.DataFrame([['C1', 'Cherry']], columns=['code[unique=true]', 'name'])
+
+    assert _validator()._released_values(['name'], updates, deletes) == {('Apple',), ('Pear',), ('Cherry',)}
+    assert _validator()._released_values(['code[unique=true]', 'name'], updates, pd.DataFrame()) == {('A1', 'Apple'), ('B1', 'Pear')}
+
+    # deletes that only have their key don't tell which values they release
+    assert _validator()._released_values(['name'], pd.DataFrame(), deletes[['code[unique=true]']]) is None
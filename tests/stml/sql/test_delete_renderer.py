@@ -1,5 +1,5 @@
 from stimula.stml.alias_enricher import AliasEnricher
-from stimula.stml.sql.delete_renderer import DeleteRenderer
+from stimula.stml.sql.delete_renderer import DeleteRenderer, BatchDeleteRenderer
 
 from stimula.stml.stml_parser import StmlParser
 
@@ -65,3 +65,35 @@ def test_delete_by_self_join(books, model_enricher, context):
     result = DeleteRenderer().render(mapping)
     expected = 'delete from books using books as books_1 where books.title = :title and books.seriesid = books_1.bookid and books_1.title = :title_1'
     assert result == expected
+
+
+def test_batch_delete(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true]'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchDeleteRenderer().render(mapping, 2)
+    expected = ('delete from books using (values (0, cast(:title__0 as text)), (1, :title__1)) as batch_values(row_index, title) '
+                'where books.title = batch_values.title returning batch_values.row_index')
+    assert result == expected
+
+
+def test_batch_delete_by_foreign_key(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], authorid(publisherid(publishername))[unique=true]'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchDeleteRenderer().render(mapping, 2)
+    expected = ('delete from books using (values (0, cast(:title__0 as text), cast(:publishername__0 as text)), (1, :title__1, :publishername__1)) as batch_values(row_index, title, publishername), '
+                'authors left join publishers on authors.publisherid = publishers.publisher_id '
+                'where books.title = batch_values.title and books.authorid = authors.author_id and publishers.publishername = batch_values.publishername returning batch_values.row_index')
+    assert result == expected
+
+
+def test_batch_delete_extension(books, model_enricher, context):
+    # the batch returns the deleted ids, to delete the extension records
+    table_name = 'books'
+    header = 'title[unique=true], bookid(name)[table=ir_model_data: id=bookid: target-name=res_id: qualifier=netsuite_books]'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchDeleteRenderer().render(mapping, 2)
+    expected = ('delete from books using (values (0, cast(:title__0 as text), cast(:name__0 as varchar)), (1, :title__1, :name__1)) as batch_values(row_index, title, name) '
+                'where books.title = batch_values.title returning batch_values.row_index, books.bookid')
+    assert result == expected
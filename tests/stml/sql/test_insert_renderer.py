@@ -1,6 +1,6 @@
 from stimula.stml.stml_parser import StmlParser
 from stimula.stml.alias_enricher import AliasEnricher
-from stimula.stml.sql.insert_renderer import InsertRenderer
+from stimula.stml.sql.insert_renderer import InsertRenderer, BatchInsertRenderer, CopyRenderer
 
 
 def test_simple_query(books, model_enricher, context):
@@ -116,3 +116,45 @@ def test_insert_lookup_by_json_field(model_enricher, properties_relation):
     result = InsertRenderer().render(mapping)
     expected = "insert into books(title, authorid, propertyid) select :title, authors.author_id, properties.property_id from authors, properties where authors.name = :name and properties.jsonb->>'en_US' = :jsonb"
     assert result == expected
+
+
+def test_batch_insert(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], price'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchInsertRenderer().render(mapping, 2)
+    expected = ('with batch_rows(row_index, title, price) as (select batch_values.row_index, batch_values.title, batch_values.price '
+                'from (values (0, cast(:title__0 as text), cast(:price__0 as numeric)), (1, :title__1, :price__1)) as batch_values(row_index, title, price)), '
+                'batch_insert as (insert into books(title, price) select title, price from batch_rows) '
+                'select row_index from batch_rows')
+    assert result == expected
+
+
+def test_batch_insert_join_query(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchInsertRenderer().render(mapping, 2)
+    expected = ('with batch_rows(row_index, title, authorid) as (select batch_values.row_index, batch_values.title, authors.author_id '
+                'from (values (0, cast(:title__0 as text), cast(:name__0 as text)), (1, :title__1, :name__1)) as batch_values(row_index, title, name), authors '
+                'where authors.name = batch_values.name), '
+                'batch_insert as (insert into books(title, authorid) select title, authorid from batch_rows) '
+                'select row_index from batch_rows')
+    assert result == expected
+
+
+def test_copy_query(books, model_enricher, context):
+    table_name = 'authors'
+    header = 'name[unique=true], birthyear'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    assert CopyRenderer().is_copyable(mapping)
+    assert CopyRenderer().render(mapping) == 'copy authors(name, birthyear) from stdin with (format csv)'
+    assert CopyRenderer().render_parameters(mapping) == ['name', 'birthyear']
+
+
+def test_copy_not_copyable(books, model_enricher, context):
+    # a foreign key must be looked up, so it can't be copied
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    assert not CopyRenderer().is_copyable(mapping)
@@ -0,0 +1,36 @@
+from stimula.stml.alias_enricher import AliasEnricher
+from stimula.stml.sql.lookup_renderer import LookupRenderer
+from stimula.stml.stml_parser import StmlParser
+
+
+def test_lookup_query(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = LookupRenderer().render(mapping, mapping.attributes[1], 2)
+    expected = ('select batch_values.row_index, authors.author_id from (values (0, cast(:name__0 as text)), (1, :name__1)) as batch_values(row_index, name), authors '
+                'where authors.name = batch_values.name')
+    assert result == expected
+
+
+def test_lookup_nested_query(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], seriesid(title: seriesid(title))'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = LookupRenderer().render(mapping, mapping.attributes[1], 2)
+    expected = ('select batch_values.row_index, books_1.bookid '
+                'from (values (0, cast(:title_1__0 as text), cast(:title_2__0 as text)), (1, :title_1__1, :title_2__1)) as batch_values(row_index, title_1, title_2), books as books_1 '
+                'left join books as books_2 on books_1.seriesid = books_2.bookid '
+                'where books_1.title = batch_values.title_1 and books_2.title = batch_values.title_2')
+    assert result == expected
+
+
+def test_lookup_extension_query(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], authorid(author_id(name)[table=ir_model_data: target-name=res_id: qualifier=netsuite_authors])'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = LookupRenderer().render(mapping, mapping.attributes[1], 1)
+    expected = ('select batch_values.row_index, authors.author_id from (values (0, cast(:name__0 as varchar))) as batch_values(row_index, name), authors '
+                "left join ir_model_data on authors.author_id = ir_model_data.res_id and ir_model_data.model = 'authors' and ir_model_data.module = 'netsuite_authors' "
+                'where ir_model_data.name = batch_values.name')
+    assert result == expected
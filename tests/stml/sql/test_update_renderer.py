@@ -1,5 +1,5 @@
 from stimula.stml.alias_enricher import AliasEnricher
-from stimula.stml.sql.update_renderer import UpdateRenderer
+from stimula.stml.sql.update_renderer import UpdateRenderer, BatchUpdateRenderer
 from stimula.stml.stml_parser import StmlParser
 
 
@@ -169,3 +169,36 @@ def test_update_with_filter_clause(books, model_enricher, context):
     result = UpdateRenderer().render(mapping)
     expected = 'update books set price = :price where books.title = :title and books.price > 10'
     assert result == expected
+
+
+def test_batch_update(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], price'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchUpdateRenderer().render(mapping, 2)
+    expected = ('update books set price = batch_values.price '
+                'from (values (0, cast(:title__0 as text), cast(:price__0 as numeric)), (1, :title__1, :price__1)) as batch_values(row_index, title, price) '
+                'where books.title = batch_values.title returning batch_values.row_index')
+    assert result == expected
+
+
+def test_batch_update_join_query(books, model_enricher, context):
+    table_name = 'books'
+    header = 'title[unique=true], authorid(name)'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchUpdateRenderer().render(mapping, 2)
+    expected = ('update books set authorid = authors.author_id '
+                'from (values (0, cast(:title__0 as text), cast(:name__0 as text)), (1, :title__1, :name__1)) as batch_values(row_index, title, name), authors '
+                'where books.title = batch_values.title and authors.name = batch_values.name returning batch_values.row_index')
+    assert result == expected
+
+
+def test_batch_update_jsonb_key(model_enricher, context):
+    table_name = 'properties'
+    header = 'name[unique=true], jsonb[key=en_US]'
+    mapping = AliasEnricher().enrich(model_enricher.enrich(StmlParser().parse_csv(table_name, header)))
+    result = BatchUpdateRenderer().render(mapping, 2)
+    expected = ("update properties set jsonb = jsonb_set(COALESCE(properties.jsonb, '{}'::jsonb), '{en_US}', to_jsonb(batch_values.jsonb::text)) "
+                "from (values (0, cast(:name__0 as text), cast(:jsonb__0 as text)), (1, :name__1, :jsonb__1)) as batch_values(row_index, name, jsonb) "
+                "where properties.name = batch_values.name returning batch_values.row_index")
+    assert result == expected
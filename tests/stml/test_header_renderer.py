@@ -80,3 +80,11 @@ def test_list_with_skip(books, model_enricher):
     mapping = model_enricher.enrich(StmlParser().parse_csv(table_name, header))
     list = HeaderRenderer().render_list(mapping)
     assert list == ['title[unique=true]', 'price']
+
+
+def test_backend_modifier(books, model_enricher):
+    table_name = 'books'
+    header = 'title[backend=row: unique=true], authorid(name)[backend=row]'
+    mapping = model_enricher.enrich(StmlParser().parse_csv(table_name, header))
+    csv = HeaderRenderer().render_csv(mapping)
+    assert csv == header